@@ -1,4 +1,5 @@
 #include <avr/pgmspace.h>
+#include <util/crc16.h>
 
 // 引脚定义
 #define SI_PIN 2     // SI -> Digital Pin 2
@@ -6,9 +7,40 @@
 #define AO_PIN A0    // AO -> Analog Pin A0
 #define NPIXELS 128  // 128像素传感器
 
+// 固件版本：V 命令回复版本号和支持的功能，旧固件不回复
+#define FIRMWARE_VERSION 2
+
+// 二进制帧：同步字 + 序号 + 像素数据 + CRC16
+#define SYNC0 0xA5
+#define SYNC1 0x5A
+
+// 输出格式
+#define MODE_ASCII 0
+#define MODE_BINARY16 1  // 每像素2字节(小端)
+#define MODE_PACKED10 2  // 每4像素5字节
+
 // 全局变量
 bool continuousCapture = false;
 int frameDelay = 20;  // 默认20ms帧间隔
+byte outputMode = MODE_ASCII;
+uint16_t frameSeq = 0;  // 二进制帧序号
+
+// 高速模式：端口直接读写 SI/CLK + 提高 ADC 时钟，整帧采到缓冲区后一次发送
+bool fastMode = false;
+unsigned long exposureUs = 0;  // 曝光(积分)时间(us)，0 表示积分时间等于帧周期
+uint16_t pixels[NPIXELS];
+byte txBuffer[4 + NPIXELS * 2 + 2];  // 最大的二进制帧(binary16)
+volatile uint8_t *siOut, *clkOut;
+uint8_t siMask, clkMask;
+
+#define SI_HIGH() (*siOut |= siMask)
+#define SI_LOW() (*siOut &= ~siMask)
+#define CLK_HIGH() (*clkOut |= clkMask)
+#define CLK_LOW() (*clkOut &= ~clkMask)
+
+// ADC 预分频：128 为默认的 125 kHz(约 110 us/次)，16 为 1 MHz(约 13 us/次，10 位精度略降)
+#define ADC_PRESCALE_DEFAULT (_BV(ADPS2) | _BV(ADPS1) | _BV(ADPS0))
+#define ADC_PRESCALE_FAST _BV(ADPS2)
 
 void setup() {
   // 初始化引脚
@@ -19,6 +51,12 @@ void setup() {
   // 初始状态
   digitalWrite(SI_PIN, LOW);
   digitalWrite(CLK_PIN, LOW);
+
+  // 高速模式直接读写的端口寄存器
+  siOut = portOutputRegister(digitalPinToPort(SI_PIN));
+  siMask = digitalPinToBitMask(SI_PIN);
+  clkOut = portOutputRegister(digitalPinToPort(CLK_PIN));
+  clkMask = digitalPinToBitMask(CLK_PIN);
   
   // 串口初始化
   Serial.begin(115200);
@@ -44,12 +82,34 @@ void loop() {
       case 'T': // 设置间隔时间
         setFrameDelay();
         break;
+
+      case 'B': // 设置输出格式: B0=ASCII, B16=16位二进制, B10=10位打包
+        setOutputMode();
+        break;
+
+      case 'V': // 版本与功能
+        Serial.print("CMD: Version ");
+        Serial.print(FIRMWARE_VERSION);
+        Serial.println(" fast exposure");
+        break;
+
+      case 'F': // 高速模式: F1=开, F0=关
+        setFastMode();
+        break;
+
+      case 'E': // 设置曝光时间(us)，E0 为积分时间等于帧周期
+        setExposure();
+        break;
     }
   }
   
   // 连续数据采集模式
   if (continuousCapture) {
-    captureFrame();
+    if (fastMode) {
+      captureFrameFast();
+    } else {
+      captureFrame();
+    }
     delay(frameDelay); // 帧间延迟
   }
 }
@@ -71,6 +131,152 @@ void setFrameDelay() {
   }
 }
 
+// 设置输出格式
+void setOutputMode() {
+  delay(10); // 等待数据到达
+  String input = Serial.readStringUntil('\n');
+  input.trim();
+  int bits = input.toInt();
+
+  if (bits == 16) {
+    outputMode = MODE_BINARY16;
+    Serial.println("CMD: Output mode binary16");
+  } else if (bits == 10) {
+    outputMode = MODE_PACKED10;
+    Serial.println("CMD: Output mode packed10");
+  } else {
+    outputMode = MODE_ASCII;
+    Serial.println("CMD: Output mode ascii");
+  }
+}
+
+// 切换高速模式
+void setFastMode() {
+  delay(10); // 等待数据到达
+  String input = Serial.readStringUntil('\n');
+  input.trim();
+  fastMode = input.toInt() != 0;
+  if (fastMode) {
+    analogRead(AO_PIN);  // 由 Arduino 核心设置参考电压和输入通道，之后直接启动转换
+  }
+  ADCSRA = (ADCSRA & ~ADC_PRESCALE_DEFAULT) | (fastMode ? ADC_PRESCALE_FAST : ADC_PRESCALE_DEFAULT);
+  Serial.println(fastMode ? "CMD: Fast mode on" : "CMD: Fast mode off");
+}
+
+// 设置曝光时间
+void setExposure() {
+  delay(10); // 等待数据到达
+  String input = Serial.readStringUntil('\n');
+  input.trim();
+  long value = input.toInt();
+
+  if (value >= 0 && value <= 1000000L) {
+    exposureUs = value;
+    Serial.print("CMD: Exposure set to ");
+    Serial.print(exposureUs);
+    Serial.println("us");
+  }
+}
+
+// 读取一个像素：时钟上升沿读取数据
+int readPixel() {
+  digitalWrite(CLK_PIN, HIGH);
+  int value = analogRead(AO_PIN); // 10位ADC值(0-1023)
+  digitalWrite(CLK_PIN, LOW);
+  return value;
+}
+
+// 发送一个字节并更新CRC
+uint16_t writeByte(uint16_t crc, byte b) {
+  Serial.write(b);
+  return _crc_xmodem_update(crc, b);
+}
+
+// 高速读取一个像素：端口寄存器输出时钟，直接启动 ADC 转换
+inline uint16_t readPixelFast() {
+  CLK_HIGH();
+  ADCSRA |= _BV(ADSC);
+  while (ADCSRA & _BV(ADSC));
+  uint16_t value = ADC;
+  CLK_LOW();
+  return value;
+}
+
+// 空读一帧清空像素，新的积分从第 19 个时钟开始
+void startIntegration() {
+  SI_HIGH();
+  CLK_HIGH();
+  SI_LOW();
+  CLK_LOW();
+  for (int i = 0; i <= NPIXELS; i++) {
+    CLK_HIGH();
+    CLK_LOW();
+  }
+}
+
+// 高速模式：(可选)按曝光时间积分，整帧读入缓冲区后一次发送
+void captureFrameFast() {
+  if (exposureUs > 0) {
+    startIntegration();
+    unsigned long start = micros();
+    while (micros() - start < exposureUs);
+  }
+
+  SI_HIGH();
+  CLK_HIGH();
+  SI_LOW();
+  CLK_LOW();
+  for (int i = 0; i < NPIXELS; i++) {
+    pixels[i] = readPixelFast();
+  }
+  CLK_HIGH();  // 第 129 个时钟结束读出
+  CLK_LOW();
+
+  if (outputMode == MODE_ASCII) {
+    for (int i = 0; i < NPIXELS; i++) {
+      Serial.print(pixels[i]);
+      if (i < NPIXELS - 1) Serial.print(",");
+    }
+    Serial.println();
+  } else {
+    sendBufferedFrame();
+  }
+}
+
+// 把缓冲区中的帧打包成二进制帧，一次写入串口
+void sendBufferedFrame() {
+  byte *p = txBuffer;
+  *p++ = SYNC0;
+  *p++ = SYNC1;
+  *p++ = lowByte(frameSeq);
+  *p++ = highByte(frameSeq);
+
+  if (outputMode == MODE_BINARY16) {
+    for (int i = 0; i < NPIXELS; i++) {
+      *p++ = lowByte(pixels[i]);
+      *p++ = highByte(pixels[i]);
+    }
+  } else {
+    for (int i = 0; i < NPIXELS; i += 4) {
+      byte high = 0;
+      for (int j = 0; j < 4; j++) {
+        *p++ = lowByte(pixels[i + j]);
+        high |= ((pixels[i + j] >> 8) & 0x03) << (2 * j);
+      }
+      *p++ = high;
+    }
+  }
+
+  uint16_t crc = 0xFFFF;
+  for (byte *q = txBuffer + 2; q < p; q++) {
+    crc = _crc_xmodem_update(crc, *q);
+  }
+  *p++ = lowByte(crc);
+  *p++ = highByte(crc);
+  Serial.write(txBuffer, p - txBuffer);
+  frameSeq++;
+}
+
 // 捕获一帧数据
 void captureFrame() {
   // 触发传感器采集
@@ -78,17 +284,51 @@ void captureFrame() {
   digitalWrite(CLK_PIN, HIGH);
   digitalWrite(SI_PIN, LOW);
   digitalWrite(CLK_PIN, LOW);
+
+  if (outputMode != MODE_ASCII) {
+    sendBinaryFrame();
+    return;
+  }
   
   // 读取128个像素
   for (int i = 0; i < NPIXELS; i++) {
-    // 时钟上升沿读取数据
-    digitalWrite(CLK_PIN, HIGH);
-    int value = analogRead(AO_PIN); // 10位ADC值(0-1023)
-    digitalWrite(CLK_PIN, LOW);
+    int value = readPixel();
     
     // 发送数据到上位机
     Serial.print(value);
     if (i < NPIXELS - 1) Serial.print(",");
   }
   Serial.println(); // 结束帧
+}
+
+// 边读取边发送二进制帧
+void sendBinaryFrame() {
+  uint16_t crc = 0xFFFF;
+  Serial.write(SYNC0);
+  Serial.write(SYNC1);
+  crc = writeByte(crc, lowByte(frameSeq));
+  crc = writeByte(crc, highByte(frameSeq));
+
+  if (outputMode == MODE_BINARY16) {
+    for (int i = 0; i < NPIXELS; i++) {
+      int value = readPixel();
+      crc = writeByte(crc, lowByte(value));
+      crc = writeByte(crc, highByte(value));
+    }
+  } else {
+    // 4个低8位字节后跟1个字节存放4个像素的高2位
+    for (int i = 0; i < NPIXELS; i += 4) {
+      byte high = 0;
+      for (int j = 0; j < 4; j++) {
+        int value = readPixel();
+        crc = writeByte(crc, lowByte(value));
+        high |= ((value >> 8) & 0x03) << (2 * j);
+      }
+      crc = writeByte(crc, high);
+    }
+  }
+
+  Serial.write(lowByte(crc));
+  Serial.write(highByte(crc));
+  frameSeq++;
 }
\ No newline at end of file
@@ -1,82 +1,192 @@
+import argparse
+import os
 import sys
+import time
 import numpy as np
-import serial
-import re
-import serial.tools.list_ports
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QComboBox, QLabel, QFrame, QSizePolicy
+    QPushButton, QComboBox, QLabel, QFrame, QSizePolicy, QGridLayout, QSpinBox
 )
-from PySide6.QtCore import QThread, Signal, Slot, Qt, QSize
-from PySide6.QtGui import QFont, QFontDatabase, QIcon, QResizeEvent, QColor
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-import matplotlib.ticker as ticker
-
-
-# 串口通信线程
-class SerialThread(QThread):
-    dataReceived = Signal(list)
-
-    def __init__(self, port):
-        super().__init__()
-        self.port = port
-        self.running = True
-        self.capturing = False
-
-    def run(self):
-        try:
-            self.ser = serial.Serial(self.port, 115200, timeout=1)
-            while self.running:
-                if self.ser.in_waiting and self.capturing:
-                    line = self.ser.readline().decode().strip()
-                    if line:
-                        try:
-                            data = [int(x) for x in line.split(',')]
-                            if len(data) == 128:
-                                self.dataReceived.emit(data)
-                        except ValueError:
-                            pass
-        except serial.SerialException as e:
-            print(f"Serial error: {e}")
-        finally:
-            if hasattr(self, 'ser') and self.ser.is_open:
-                self.ser.close()
-
-    def stop(self):
-        self.running = False
-        self.wait(1000)
-
-    def start_capture(self):
-        """开始采集数据"""
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.write('S'.encode())
-            self.capturing = True
-
-    def stop_capture(self):
-        """停止采集数据"""
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.write('X'.encode())
-            self.capturing = False
+from PySide6.QtCore import QObject, QTimer, Signal, Slot, Qt, QSize
+from PySide6.QtGui import QFont, QFontDatabase, QFontMetrics, QIcon, QColor, QKeySequence, QShortcut
+
+from plotting import BACKENDS, DEFAULT_BACKEND, create_backend
+from tsl1401 import protocol
+from tsl1401.acquisition import ReplayAcquisition, SerialAcquisition
+from tsl1401.averaging import AVERAGE_MODES, AVERAGE_NONE
+from tsl1401.calibration import Calibration
+from tsl1401.channel import Channel, safe_name
+from tsl1401.discovery import BUSY, UNKNOWN, PortScanner, register_provider, static_provider
+from tsl1401.exposure import AutoExposure, describe_setting
+from tsl1401.library import METHODS as MATCH_METHODS, SpectralLibrary
+from tsl1401.metrics import Metrics, MetricsExporter, format_overlay
+from tsl1401.pipeline import Pipeline, parse_pipeline
+from tsl1401.recording import EXTENSION
+from tsl1401.replay import open_source
+from tsl1401.spectral import REFINE_METHODS, WavelengthCalibration, find_peaks
+from tsl1401.stats import frame_stats
+from tsl1401.timing import StageTimer, format_report
+from tsl1401.trigger import DEFAULT_POST, DEFAULT_PRE, TRIGGER_DIR, EventWriter, TriggerCapture, parse_trigger
+from tsl1401.waterfall import WaterfallFeed, make_lut
+
+
+# 采集线程的回调在采集线程中执行，经信号排队到界面线程处理
+class AcquisitionSignals(QObject):
+    averagingDone = Signal()  # 处理链的暗场/参考帧已采够
+
+
+# 已连接的设备：采集线程 + 独立的处理链 + 绘图对象
+class Device:
+    def __init__(self, thread, channel, color):
+        self.thread = thread
+        self.channel = channel
+        self.color = color
+        self.signals = AcquisitionSignals()  # 在界面线程创建，接收方按排队连接调用
+        self.ax = None  # 所在的坐标轴
+        self.line = None
+        self.peak_markers = None
+        self.plot_pixels = None  # 曲线对应的传感器像素
+        self.plot_index = None
+        self.plot_x = None  # 横轴坐标（像素或波长）
+
+    @property
+    def name(self):
+        return self.channel.name
 
 
 # 主应用窗口
 class SpectrometerApp(QMainWindow):
-    def __init__(self):
+    portsFound = Signal(object)  # 后台串口扫描完成，参数为 PortInfo 列表
+
+    DEFAULT_REFRESH_RATE = 30  # 默认重绘频率(Hz)
+    UI_STAGES = ('render', 'stats', 'match')  # 界面线程上计时的阶段，render 已包含 plot 和 draw
+    DEFAULT_STATS_WINDOW = 100  # 滚动统计窗口(帧)
+    STATS_RATE = 10  # 统计面板刷新频率(Hz)，与帧率无关
+    OVERLAY_RATE = 2  # 性能面板刷新频率(Hz)
+    OVERLAY_KEY = "F3"  # 显示/隐藏性能面板
+    RECORD_DIR = "recordings"  # 录制文件目录
+    CALIBRATION_DIR = "calibration"  # 每个设备的暗场/平场校正数据
+    CALIBRATION_FRAMES = 100  # 暗场/参考帧平均的帧数
+    WAVELENGTH_FILE = "wavelength.json"  # 像素 -> 波长定标
+    PEAK_METHOD = 'parabolic'  # 亚像素峰值细化方法
+    DEFAULT_AVERAGE_N = 10  # 帧累加的默认帧数
+    WATERFALL_COLORMAP = 'viridis'
+    MATCH_TOP = 3  # 显示的最佳匹配数
+    MATCH_NAME_CHARS = 16  # 匹配名称最多显示的字符数
+    NO_PORTS = "No COM ports available"
+    SCANNING_PORTS = "Scanning ports..."
+
+    # 多设备绘图：overlay 叠加在同一坐标轴，tiled 每个设备一个坐标轴
+    PLOT_LAYOUTS = ('overlay', 'tiled')
+    DEVICE_COLORS = ["#007AFF", "#FF2D55", "#34C759", "#AF52DE", "#5AC8FA", "#FFCC00", "#8E8E93", "#FF9500"]
+
+    # 帧累加模式：(模式, 显示名称)
+    AVERAGE_ITEMS = [
+        ('none', "No Averaging"),
+        ('boxcar', "Boxcar Average"),
+        ('ema', "Exponential Average"),
+        ('median', "Median"),
+    ]
+
+    # 统计面板的指标：(键, 名称, 颜色)
+    STAT_ROWS = [
+        ('max', "Max Value", "#007AFF"),
+        ('min', "Min Value", "#FF2D55"),
+        ('mean', "Average", "#34C759"),
+        ('std', "Standard Deviation", "#AF52DE"),
+        ('peak', "Peak Position", "#FF9500"),
+        ('fwhm', "Peak FWHM", "#FFCC00"),
+        ('noise', "Frame Noise (RMS)", "#5AC8FA"),
+        ('snr', "Peak SNR", "#FF3B30"),
+        ('integration', "Integration", "#8E8E93"),
+    ]
+
+    def __init__(self, refresh_rate=DEFAULT_REFRESH_RATE, stats_window=DEFAULT_STATS_WINDOW,
+                 calibration_dir=CALIBRATION_DIR, mask=None, wavelength_file=WAVELENGTH_FILE,
+                 peak_method=PEAK_METHOD, average_mode=AVERAGE_NONE, average_n=DEFAULT_AVERAGE_N,
+                 layout='overlay', waterfall=0, plot_backend=DEFAULT_BACKEND,
+                 metrics_file=None, metrics_interval=10.0,
+                 trigger=None, trigger_pre=DEFAULT_PRE, trigger_post=DEFAULT_POST, trigger_dir=TRIGGER_DIR,
+                 auto_exposure=False, exposure_target=0.7, library=None, match_method='cosine',
+                 pipeline=None, pipeline_workers=0):
         super().__init__()
         self.setWindowTitle("High Precision Spectrometer")
         self.setGeometry(100, 100, 1200, 900)  # 4:3 比例
         self.base_font_size = 14  #
         self.base_padding = 12  #
         self.setMinimumSize(1200, 900)  # 最小尺寸
+        self.stats_window = stats_window
+        self.average_mode = average_mode
+        self.average_n = average_n
+        self.pending_stats = None  # 尚未显示的最新统计数据
+        self.ui_scale = (self.base_font_size, self.base_padding)  # 当前 (字号, 边距)
+        self.style_cache = {}
+        # queue: 串口读出到界面取走；plot: 更新曲线；draw: 重绘；latency: 串口读出到重绘完成
+        self.timings = StageTimer(('queue', 'plot', 'draw', 'latency', 'render', 'stats', 'match'))
+        self.metrics = Metrics({'gui': self.timings})
+        self.metrics_exporter = None
+        if metrics_file:
+            self.metrics_exporter = MetricsExporter(self.metrics, metrics_file, interval=metrics_interval)
+            self.metrics_exporter.start()
+        self.calibration_dir = calibration_dir
+        self.mask = mask
+        self.wavelength = self.load_wavelength(wavelength_file)
+        self.peak_method = peak_method
+        self.layout_mode = layout
+        self.plot_backend = plot_backend
+        self.devices = {}  # 设备名 -> Device，按连接顺序
+        self.axes = []
+        # 瀑布图：显示选中设备最近 waterfall 帧，0 为不显示
+        self.waterfall_depth = waterfall
+        self.waterfall_lut = None  # 颜色查找表，由绘图后端的颜色映射生成
+        self.waterfall_ax = None
+        self.waterfall_image = None
+        self.waterfall_feed = None
+        self.waterfall_device = None
+        self.waterfall_shown = None  # 已按其像素设置好横轴的瀑布图
+        # 自动曝光：每个串口设备按饱和像素数和 p99 调整帧间隔，目标为满量程的 exposure_target
+        self.auto_exposure = auto_exposure
+        self.exposure_target = exposure_target
+        # 触发模式：每个设备按 trigger 条件检测事件，只保存和显示事件前后的帧
+        self.trigger = trigger
+        self.trigger_pre = trigger_pre
+        self.trigger_post = trigger_post
+        self.trigger_dir = trigger_dir
+        # 处理阶段流水线：每个设备一条，重的阶段在该设备的工作进程中运行，界面线程只画结果
+        self.pipeline = pipeline
+        self.pipeline_workers = pipeline_workers
+        # 参考光谱库：统计面板刷新时把选中设备的当前光谱与整个库匹配
+        self.library = self.load_library(library)
+        self.match_method = match_method
+        self.pending_match = None  # 尚未匹配的 (光谱, 传感器像素)
+        self.capture_started = None  # 开始采集时的 (墙钟时间, CPU 时间)
+        self.scanner = PortScanner()
+        self.scanning = False
+        self.portsFound.connect(self.on_ports_found)
         self.setup_ui()
-        self.serial_thread = None
         self.is_capturing = False
 
+        # 绘图与采集解耦：所有设备共用一个定时器，按固定的总频率只绘制各自最新的光谱
+        self.render_timer = QTimer(self)
+        self.render_timer.setInterval(int(1000 / refresh_rate))
+        self.render_timer.timeout.connect(self.render_latest)
+
+        # 统计面板按人眼可读的频率刷新
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(int(1000 / self.STATS_RATE))
+        self.stats_timer.timeout.connect(self.flush_stats)
+
+        # 性能面板只在显示时刷新
+        self.overlay_timer = QTimer(self)
+        self.overlay_timer.setInterval(int(1000 / self.OVERLAY_RATE))
+        self.overlay_timer.timeout.connect(self.update_overlay)
+        QShortcut(QKeySequence(self.OVERLAY_KEY), self, self.toggle_overlay)
+
     def setup_ui(self):
         # 设置全局字体
         font = QFont("Arial", self.base_font_size)
         QApplication.setFont(font)
+        self.title_labels = []  # (标题标签, 相对基础字号的增量)
 
         # 主布局
         main_widget = QWidget()
@@ -98,6 +208,7 @@ class SpectrometerApp(QMainWindow):
         # 应用标题
         app_title = QLabel("Spectrometer Pro")
         app_title.setFont(QFont("Arial", self.base_font_size + 4, QFont.Bold))
+        self.title_labels.append((app_title, 4))
         app_title.setAlignment(Qt.AlignCenter)
         app_title.setStyleSheet("""
             color: #007AFF;
@@ -115,6 +226,7 @@ class SpectrometerApp(QMainWindow):
 
         serial_title = QLabel("SERIAL PORT")
         serial_title.setFont(QFont("Arial", self.base_font_size + 1, QFont.Bold))
+        self.title_labels.append((serial_title, 1))
         serial_title.setStyleSheet("color: #5F6368;")
         serial_layout.addWidget(serial_title)
 
@@ -202,6 +314,7 @@ class SpectrometerApp(QMainWindow):
         # 采集控制
         capture_title = QLabel("DATA CAPTURE")
         capture_title.setFont(QFont("Arial", self.base_font_size + 1, QFont.Bold))
+        self.title_labels.append((capture_title, 1))
         capture_title.setStyleSheet("color: #5F6368;")
         serial_layout.addWidget(capture_title)
 
@@ -228,6 +341,62 @@ class SpectrometerApp(QMainWindow):
         self.capture_btn.setEnabled(False)
         serial_layout.addWidget(self.capture_btn)
 
+        # 录制按钮：把收到的每一帧写入磁盘
+        self.record_btn = QPushButton("Start Recording")
+        self.record_btn.setMinimumHeight(35)
+        self.record_btn.setStyleSheet(self.record_style("#5856D6"))
+        self.record_btn.clicked.connect(self.toggle_recording)
+        self.record_btn.setEnabled(False)
+        serial_layout.addWidget(self.record_btn)
+
+        # 帧累加：用帧率换信噪比
+        average_layout = QHBoxLayout()
+        average_layout.setSpacing(self.base_padding - 6)
+        styles = self.scale_styles(self.base_font_size, self.base_padding)
+        self.average_combo = QComboBox()
+        self.average_combo.setMinimumHeight(32)
+        self.average_combo.setStyleSheet(styles['combo'])
+        for mode, name in self.AVERAGE_ITEMS:
+            self.average_combo.addItem(name, mode)
+        self.average_combo.setCurrentIndex(self.average_combo.findData(self.average_mode))
+        self.average_combo.currentIndexChanged.connect(self.change_averaging)
+        average_layout.addWidget(self.average_combo, 65)
+
+        self.average_spin = QSpinBox()
+        self.average_spin.setMinimumHeight(32)
+        self.average_spin.setStyleSheet(styles['spin'])
+        self.average_spin.setRange(2, 1000)
+        self.average_spin.setPrefix("N = ")
+        self.average_spin.setValue(self.average_n)
+        self.average_spin.setEnabled(self.average_mode != AVERAGE_NONE)
+        self.average_spin.valueChanged.connect(self.change_averaging)
+        average_layout.addWidget(self.average_spin, 35)
+        serial_layout.addLayout(average_layout)
+
+        # 暗场/平场校正
+        calib_title = QLabel("CALIBRATION")
+        calib_title.setFont(QFont("Arial", self.base_font_size + 1, QFont.Bold))
+        self.title_labels.append((calib_title, 1))
+        calib_title.setStyleSheet("color: #5F6368;")
+        serial_layout.addWidget(calib_title)
+
+        calib_layout = QHBoxLayout()
+        calib_layout.setSpacing(self.base_padding - 6)
+        self.dark_btn = QPushButton("Dark")
+        self.dark_btn.setToolTip("Average dark frames with the light source blocked")
+        self.dark_btn.clicked.connect(lambda: self.start_averaging('dark'))
+        self.flat_btn = QPushButton("Flat")
+        self.flat_btn.setToolTip("Average frames of a uniform reference source")
+        self.flat_btn.clicked.connect(lambda: self.start_averaging('flat'))
+        self.clear_calib_btn = QPushButton("Clear")
+        self.clear_calib_btn.setToolTip("Discard dark and flat calibration")
+        self.clear_calib_btn.clicked.connect(self.clear_calibration)
+        for button in (self.dark_btn, self.flat_btn, self.clear_calib_btn):
+            button.setStyleSheet(self.calib_style(self.base_font_size, self.base_padding))
+            button.setEnabled(False)
+            calib_layout.addWidget(button)
+        serial_layout.addLayout(calib_layout)
+
         control_layout.addWidget(serial_group)
 
         # 数据显示区域
@@ -238,24 +407,45 @@ class SpectrometerApp(QMainWindow):
 
         data_title = QLabel("DATA STATISTICS")
         data_title.setFont(QFont("Arial", self.base_font_size + 1, QFont.Bold))
+        self.title_labels.append((data_title, 1))
         data_title.setStyleSheet("color: #5F6368;")
         data_layout.addWidget(data_title)
 
-        # 创建统计数据显示标签
-        self.stats_label = QLabel()
-        self.stats_label.setStyleSheet(f"""
-            QLabel {{
-                background-color: #FFFFFF;
-                border-radius: 14px;
-                padding: {self.base_padding - 3}px;
-                font-family: Calibri;
-                font-size: {self.base_font_size}pt;
-                border: 1px solid #E0E0E0;
-            }}
-        """)
-        self.stats_label.setTextFormat(Qt.RichText)
-        self.update_stats_display()  # 初始化显示
-        data_layout.addWidget(self.stats_label)
+        # 统计数据面板：每个指标一对常驻标签，只在显示值变化时更新文本
+        self.stats_frame = QFrame()
+        self.stats_frame.setObjectName("StatsPanel")
+        self.stats_frame.setStyleSheet(self.stats_style(self.base_font_size, self.base_padding))
+        stats_layout = QGridLayout(self.stats_frame)
+        stats_layout.setContentsMargins(0, 0, 0, 0)
+        stats_layout.setSpacing(0)
+        stats_layout.setColumnStretch(1, 1)
+
+        self.stats_placeholder = QLabel("Waiting for data...")
+        self.stats_placeholder.setObjectName("StatsPlaceholder")
+        self.stats_placeholder.setAlignment(Qt.AlignCenter)
+        stats_layout.addWidget(self.stats_placeholder, 0, 0, 1, 2)
+
+        self.stat_labels = {}
+        self.stat_texts = {}
+        value_width = QFontMetrics(QFont("Calibri", self.base_font_size, QFont.Bold)).horizontalAdvance(
+            "1023 (Pixel 127)")
+        for row, (key, name, color) in enumerate(self.STAT_ROWS, start=1):
+            name_label = QLabel(name)
+            name_label.setObjectName("StatName")
+            value_label = QLabel()
+            value_label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            value_label.setStyleSheet(f"color: {color}; font-weight: bold;")
+            # 数值文本长度变化不应引起整个窗口重新布局
+            value_label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Preferred)
+            value_label.setMinimumWidth(value_width)
+            if row == len(self.STAT_ROWS):
+                name_label.setProperty("last", True)
+                value_label.setProperty("last", True)
+            value_label.setText("--")
+            stats_layout.addWidget(name_label, row, 0)
+            stats_layout.addWidget(value_label, row, 1)
+            self.stat_labels[key] = (name_label, value_label)
+        data_layout.addWidget(self.stats_frame)
 
         # 状态指示器
         status_layout = QHBoxLayout()
@@ -284,6 +474,7 @@ class SpectrometerApp(QMainWindow):
         # 绘图区域标题
         plot_title = QLabel("Spectral Analysis")
         plot_title.setFont(QFont("Arial", self.base_font_size + 4, QFont.Bold))
+        self.title_labels.append((plot_title, 4))
         plot_title.setAlignment(Qt.AlignCenter)
         plot_title.setStyleSheet("""
             color: #007AFF;
@@ -292,43 +483,31 @@ class SpectrometerApp(QMainWindow):
         """)
         plot_layout.addWidget(plot_title)
 
-        self.figure = Figure(figsize=(8, 5), dpi=150)
-        self.canvas = FigureCanvas(self.figure)
+        # 绘图后端：matplotlib 或 QPainter，界面只通过后端接口绘图
+        self.plot = create_backend(self.plot_backend)
+        self.plot.set_font_size(self.ui_scale[0])
+        self.waterfall_lut = make_lut(self.plot.colormap(self.WATERFALL_COLORMAP))
+        self.canvas = self.plot.widget
         self.canvas.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.ax = self.figure.add_subplot(111)
-
-        # 设置图表字体为Arial
-        title_font = {'fontname': 'Arial', 'fontsize': self.base_font_size + 2}
-        label_font = {'fontname': 'Arial', 'fontsize': self.base_font_size + 1}
-        tick_font = {'fontname': 'Arial', 'fontsize': self.base_font_size - 1}
-
-        self.ax.set_title("Spectral Distribution", **title_font)
-        self.ax.set_xlabel("Pixel Index", **label_font)
-        self.ax.set_ylabel("ADC Value (0-1023)", **label_font)
-        self.ax.tick_params(axis='both', which='major', labelsize=tick_font['fontsize'])
-
-        # 设置网格线样式
-        self.ax.grid(True, linestyle='-', alpha=0.2)
-
-        # 设置坐标轴颜色
-        self.ax.spines['bottom'].set_color('#007AFF')
-        self.ax.spines['top'].set_color('#007AFF')
-        self.ax.spines['right'].set_color('#007AFF')
-        self.ax.spines['left'].set_color('#007AFF')
-
-        # 细化X轴刻度
-        self.ax.xaxis.set_major_locator(ticker.MultipleLocator(10))
-        self.ax.xaxis.set_minor_locator(ticker.MultipleLocator(5))
-
-        self.line, = self.ax.plot([], [], '#007AFF', linewidth=1.8, alpha=0.8)
-        self.ax.set_xlim(0, 127)
-        self.ax.set_ylim(0, 1023)
-
-        # 设置背景透明
-        self.figure.patch.set_alpha(0.0)
-        self.ax.patch.set_alpha(0.0)
+        self.rebuild_plot()
 
+        self.canvas.resizeSettled.connect(self.apply_ui_scale)
         plot_layout.addWidget(self.canvas)
+        if self.library is not None:
+            self.setup_match_panel(plot_layout)
+
+        # 性能面板：浮在绘图区左上角，不接收鼠标事件
+        self.overlay = QLabel(self.canvas)
+        self.overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.overlay.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.overlay.setStyleSheet("""
+            background-color: rgba(0, 0, 0, 170);
+            color: #FFFFFF;
+            border-radius: 6px;
+            padding: 6px;
+        """)
+        self.overlay.move(12, 12)
+        self.overlay.hide()
 
         # 添加布局
         self.main_layout.addWidget(control_frame, 30)  # 30% 宽度
@@ -336,22 +515,95 @@ class SpectrometerApp(QMainWindow):
 
         self.setCentralWidget(main_widget)
         self.refresh_ports()
-
-    def resizeEvent(self, event: QResizeEvent):
-        """窗口大小变化时调整UI元素"""
+        # 切换选中的串口时更新连接按钮和统计面板对应的设备
+        self.port_combo.currentIndexChanged.connect(self.update_device_controls)
+
+    def setup_match_panel(self, layout):
+        """参考光谱库的最佳匹配：绘图区下方一行，依次为名称和分数，与统计面板同样式"""
+        self.match_frame = QFrame()
+        self.match_frame.setObjectName("StatsPanel")
+        self.match_frame.setStyleSheet(self.stats_style(self.base_font_size, self.base_padding))
+        match_layout = QGridLayout(self.match_frame)
+        match_layout.setContentsMargins(0, 0, 0, 0)
+        match_layout.setHorizontalSpacing(self.base_padding)
+        match_title = QLabel("Match")
+        match_title.setToolTip(f"{len(self.library)} references in {self.library.path}, {self.match_method} score")
+        match_title.setObjectName("StatName")
+        match_title.setProperty("last", True)
+        match_layout.addWidget(match_title, 0, 0)
+        self.match_labels = []
+        for rank in range(self.MATCH_TOP):
+            name_label = QLabel("--")
+            score_label = QLabel("--")
+            score_label.setStyleSheet(f"color: {'#007AFF' if rank == 0 else '#5F6368'}; font-weight: bold;")
+            for label in (name_label, score_label):
+                label.setProperty("last", True)
+            match_layout.addWidget(name_label, 0, 1 + 2 * rank)
+            match_layout.addWidget(score_label, 0, 2 + 2 * rank)
+            match_layout.setColumnStretch(1 + 2 * rank, 1)
+            self.match_labels.append((name_label, score_label))
+        self.match_texts = [None] * self.MATCH_TOP
+        layout.addWidget(self.match_frame)
+
+    def add_spectrum_axes(self, title):
+        """光谱坐标轴：横轴为像素序号或波长，纵轴为 ADC 值"""
+        xlabel = "Wavelength (nm)" if self.wavelength else "Pixel Index"
+        ax = self.plot.add_axes(title, xlabel, "ADC Value (0-1023)", (0, 1023), pixel_ticks=not self.wavelength)
+        ax.set_xlim(0, protocol.NPIXELS - 1)
+        return ax
+
+    def rebuild_plot(self):
+        """设备增减时重建坐标轴和曲线：叠加模式一个坐标轴，平铺模式每个设备一个，瀑布图在最下方"""
+        self.plot.clear()
+        devices = list(self.devices.values())
+        if self.layout_mode == 'tiled' and len(devices) > 1:
+            self.axes = [self.add_spectrum_axes(device.name) for device in devices]
+            for ax, device in zip(self.axes, devices):
+                device.ax = ax
+        else:
+            ax = self.add_spectrum_axes("Spectral Distribution")
+            self.axes = [ax]
+            for device in devices:
+                device.ax = ax
+
+        # 曲线单独绘制，其余部分作为静态背景缓存
+        for device in devices:
+            device.line = device.ax.line(device.color, label=device.name)
+            device.peak_markers = device.ax.markers(device.color)
+            device.plot_pixels = None
+        if self.layout_mode == 'overlay' and len(devices) > 1:
+            self.axes[0].legend()
+        if self.waterfall_depth:
+            # 瀑布图与光谱各占一半高度，纵轴为多少帧以前，最新的一帧在顶部
+            xlabel = "Wavelength (nm)" if self.wavelength else "Pixel Index"
+            self.waterfall_ax = self.plot.add_axes("Waterfall", xlabel, "Frames Ago", (self.waterfall_depth, 0),
+                                                   pixel_ticks=not self.wavelength, height=len(self.axes))
+            self.waterfall_ax.set_xlim(0, protocol.NPIXELS - 1)
+            self.axes.append(self.waterfall_ax)
+            # 一个图像对象，之后只更新数据；绘制时按屏幕行数取行
+            self.waterfall_image = self.waterfall_ax.image((0, protocol.NPIXELS - 1, self.waterfall_depth, 0))
+            self.waterfall_device = self.waterfall_feed = None
+        self.update_figure_layout()
+
+    def apply_ui_scale(self):
+        """窗口尺寸稳定后按新尺寸调整UI元素"""
         # 根据窗口大小调整字体大小
-        scale_factor = min(event.size().width() / 1200, event.size().height() / 900)
+        scale_factor = min(self.width() / 1200, self.height() / 900)
         new_font_size = max(9, int(self.base_font_size * scale_factor * 0.9))  # 最小9pt
         new_padding = max(8, int(self.base_padding * scale_factor * 0.8))  # 最小8px
 
-        # 更新控件样式
-        self.update_ui_scale(new_font_size, new_padding)
-        super().resizeEvent(event)
-
-    def update_ui_scale(self, font_size: int, padding: int):
-        """根据当前窗口大小更新UI元素尺寸"""
-        # 更新按钮样式
-        self.connect_btn.setStyleSheet(f"""
+        # 字号和边距没有变化时不重建样式表
+        if (new_font_size, new_padding) != self.ui_scale:
+            self.ui_scale = (new_font_size, new_padding)
+            self.update_ui_scale(new_font_size, new_padding)
+        self.update_figure_layout()
+
+    def scale_styles(self, font_size, padding):
+        """某一缩放级别的控件样式表，按 (字号, 边距) 缓存"""
+        key = (font_size, padding)
+        if key not in self.style_cache:
+            self.style_cache[key] = {
+                'connect': f"""
             QPushButton {{
                 background-color: #007AFF;
                 color: white;
@@ -362,9 +614,8 @@ class SpectrometerApp(QMainWindow):
                 font-weight: bold;
                 min-height: 35px;
             }}
-        """)
-
-        self.capture_btn.setStyleSheet(f"""
+        """,
+                'capture': f"""
             QPushButton {{
                 background-color: #34C759;
                 color: white;
@@ -375,10 +626,8 @@ class SpectrometerApp(QMainWindow):
                 font-weight: bold;
                 min-height: 35px;
             }}
-        """)
-
-        # 更新下拉框样式
-        self.port_combo.setStyleSheet(f"""
+        """,
+                'combo': f"""
             QComboBox {{
                 background-color: #FFFFFF;
                 border: 1px solid #D1D5DB;
@@ -389,94 +638,133 @@ class SpectrometerApp(QMainWindow):
                 min-height: 32px;
                 selection-background-color: #E3F2FD;
             }}
-        """)
-
-        # 更新统计数据区域样式
-        self.stats_label.setStyleSheet(f"""
-            QLabel {{
+        """,
+                'spin': f"""
+            QSpinBox {{
                 background-color: #FFFFFF;
-                border-radius: 14px;
-                padding: {padding - 3}px;
+                border: 1px solid #D1D5DB;
+                border-radius: 10px;
+                padding: {padding - 7}px;
                 font-size: {font_size}pt;
                 font-family: Calibri;
-                border: 1px solid #E0E0E0;
+                min-height: 32px;
             }}
-        """)
+        """,
+                'stats': self.stats_style(font_size, padding),
+                'calib': self.calib_style(font_size, padding),
+            }
+        return self.style_cache[key]
+
+    def update_ui_scale(self, font_size: int, padding: int):
+        """根据当前窗口大小更新UI元素尺寸"""
+        styles = self.scale_styles(font_size, padding)
+
+        # 更新按钮样式
+        self.connect_btn.setStyleSheet(styles['connect'])
+        self.capture_btn.setStyleSheet(styles['capture'])
+        recording = any(device.thread.recorder for device in self.devices.values())
+        self.record_btn.setStyleSheet(self.record_style("#FF3B30" if recording else "#5856D6"))
+        for button in (self.dark_btn, self.flat_btn, self.clear_calib_btn):
+            button.setStyleSheet(styles['calib'])
+
+        # 更新下拉框样式
+        self.port_combo.setStyleSheet(styles['combo'])
+        self.average_combo.setStyleSheet(styles['combo'])
+        self.average_spin.setStyleSheet(styles['spin'])
+
+        # 更新统计数据区域样式
+        self.stats_frame.setStyleSheet(styles['stats'])
+        if self.library is not None:
+            self.match_frame.setStyleSheet(styles['stats'])
 
         # 更新标题字体
-        titles = [
-            "Spectrometer Pro", "SERIAL PORT",
-            "DATA CAPTURE", "DATA STATISTICS",
-            "Spectral Analysis"
-        ]
-        for title in self.findChildren(QLabel, options=Qt.FindDirectChildrenOnly):
-            if title.text() in titles:
-                if title.text() == "Spectrometer Pro":
-                    title.setFont(QFont("Arial", font_size + 4, QFont.Bold))
-                elif title.text() == "Spectral Analysis":
-                    title.setFont(QFont("Arial", font_size + 4, QFont.Bold))
-                else:
-                    title.setFont(QFont("Arial", font_size + 1, QFont.Bold))
+        for title, delta in self.title_labels:
+            title.setFont(QFont("Arial", font_size + delta, QFont.Bold))
 
         # 更新图表字体
-        if hasattr(self, 'ax'):
-            title_font = font_size + 2
-            label_font = font_size + 1
-            tick_font = font_size - 1
-
-            self.ax.title.set_fontsize(title_font)
-            self.ax.title.set_fontfamily('Arial')
-            self.ax.xaxis.label.set_fontsize(label_font)
-            self.ax.xaxis.label.set_fontfamily('Arial')
-            self.ax.yaxis.label.set_fontsize(label_font)
-            self.ax.yaxis.label.set_fontfamily('Arial')
-            self.ax.tick_params(axis='both', which='major', labelsize=tick_font)
-            self.figure.tight_layout()
-            self.canvas.draw()
+        self.plot.set_font_size(font_size)
+
+    def update_figure_layout(self):
+        """按当前字号和画布尺寸重新排布坐标轴并整图重绘"""
+        self.plot.update_layout()
 
     def refresh_ports(self):
-        """刷新可用串口列表"""
+        """在后台线程中扫描串口，界面不等待探测结果"""
+        if self.scanning:
+            return
+        self.scanning = True
+        self.refresh_btn.setEnabled(False)
+        if self.port_combo.count() == 0 or self.selected_port() is None:
+            self.port_combo.blockSignals(True)
+            self.port_combo.clear()
+            self.port_combo.addItem(self.SCANNING_PORTS)
+            self.port_combo.blockSignals(False)
+        # 已连接的端口正被占用，不再探测
+        self.scanner.scan_async(self.portsFound.emit, skip=list(self.devices))
+
+    @Slot(object)
+    def on_ports_found(self, ports):
+        """用扫描结果更新下拉框，尽量保持原来的选择；打不开的端口不列出"""
+        self.scanning = False
+        self.refresh_btn.setEnabled(True)
+        current = self.selected_port()
+        self.port_combo.blockSignals(True)
         self.port_combo.clear()
-        available_ports = []
-
-        # 获取所有可用串口
-        ports = serial.tools.list_ports.comports()
         for port in ports:
-            if re.match(r'^COM\d+$', port.device, re.IGNORECASE):
-                try:
-                    # 尝试打开端口以验证是否真正可用
-                    with serial.Serial(port.device):
-                        available_ports.append(port.device)
-                except serial.SerialException:
-                    continue
-
-        if available_ports:
-            self.port_combo.addItems(available_ports)
-            self.port_combo.setCurrentIndex(0)
-        else:
-            self.port_combo.addItem("No COM ports available")
+            if port.status == BUSY:
+                continue
+            label = port.device if port.status != UNKNOWN else f"{port.device} (no TSL1401 reply)"
+            self.port_combo.addItem(label, port.device)
+        if self.port_combo.count() == 0:
+            self.port_combo.addItem(self.NO_PORTS)
+        index = self.port_combo.findData(current)
+        self.port_combo.setCurrentIndex(max(index, 0))
+        self.port_combo.blockSignals(False)
+        self.update_device_controls()
+
+    def selected_port(self):
+        """下拉框选中的端口，没有可选端口时为 None"""
+        return self.port_combo.currentData()
 
     def toggle_connection(self):
-        """连接/断开设备"""
-        if self.serial_thread and self.serial_thread.isRunning():
-            # 如果正在采集，先停止采集
+        """连接/断开下拉框中选中的设备，其他已连接的设备不受影响"""
+        port = self.selected_port()
+        if port in self.devices:
+            self.disconnect_device(self.devices[port])
+        elif port:
+            self.connect_device(port)
+        else:
+            self.disconnect_all()  # 没有可选串口时（如回放）断开全部
+        self.update_device_controls()
+
+    def selected_device(self):
+        """下拉框选中的已连接设备，没有时取第一个已连接的设备（如回放）"""
+        device = self.devices.get(self.selected_port())
+        if device is None and self.devices:
+            device = next(iter(self.devices.values()))
+        return device
+
+    def update_device_controls(self):
+        """按连接状态更新按钮和状态栏"""
+        connected = bool(self.devices)
+        port = self.selected_port()
+        disconnect = port in self.devices or (connected and port is None)
+        self.connect_btn.setText("Disconnect" if disconnect else "Connect Device")
+        self.capture_btn.setEnabled(connected)
+        self.record_btn.setEnabled(connected)
+        self.set_calibration_enabled(connected)
+        if not connected:
             if self.is_capturing:
                 self.toggle_capture()
-
-            self.disconnect_device()
-            self.connect_btn.setText("Connect Device")
-            self.capture_btn.setEnabled(False)
-            self.capture_btn.setText("Start Capture")
+            self.stop_recording()
             self.status_label.setText("Not connected")
             self.status_indicator.setStyleSheet("background-color: #E0E0E0; border-radius: 7px;")
-        else:
-            port = self.port_combo.currentText()
-            if port and port != "No COM ports available":
-                self.connect_device(port)
-                self.connect_btn.setText("Disconnect")
-                self.capture_btn.setEnabled(True)
-                self.status_label.setText("Connected")
-                self.status_indicator.setStyleSheet("background-color: #34C759; border-radius: 7px;")
+        elif not self.is_capturing:
+            count = f" ({len(self.devices)} devices)" if len(self.devices) > 1 else ""
+            self.status_label.setText("Connected" + count)
+            self.status_indicator.setStyleSheet("background-color: #34C759; border-radius: 7px;")
+        self.pending_stats = None
+        self.flush_stats()
 
     def toggle_capture(self):
         """开始/停止采集"""
@@ -494,9 +782,11 @@ class SpectrometerApp(QMainWindow):
                     min-height: 35px;
                 }}
             """)
-            if self.serial_thread:
-                self.serial_thread.start_capture()
+            if self.devices:
+                for device in self.devices.values():
+                    device.thread.start_capture()
                 self.is_capturing = True
+                self.capture_started = (time.perf_counter(), time.process_time())
                 self.status_label.setText("Capturing data...")
                 self.status_indicator.setStyleSheet("background-color: #FF9500; border-radius: 7px;")
         else:
@@ -513,96 +803,579 @@ class SpectrometerApp(QMainWindow):
                     min-height: 35px;
                 }}
             """)
-            if self.serial_thread:
-                self.serial_thread.stop_capture()
-                self.is_capturing = False
+            self.is_capturing = False
+            if self.devices:
+                for device in self.devices.values():
+                    device.thread.stop_capture()
                 self.status_label.setText("Connected")
                 self.status_indicator.setStyleSheet("background-color: #34C759; border-radius: 7px;")
 
+    def calib_style(self, font_size, padding):
+        """校正按钮样式"""
+        return f"""
+            QPushButton {{
+                background-color: #F1F3F4;
+                color: #202124;
+                border-radius: 10px;
+                padding: {padding - 7}px;
+                font-size: {font_size}pt;
+                font-family: Calibri;
+                font-weight: bold;
+                min-height: 30px;
+            }}
+            QPushButton:hover {{
+                background-color: #E8EAED;
+            }}
+            QPushButton:disabled {{
+                color: #9AA0A6;
+            }}
+        """
+
+    def record_style(self, color):
+        """录制按钮样式，跟随当前缩放级别"""
+        font_size, padding = self.ui_scale
+        return f"""
+            QPushButton {{
+                background-color: {color};
+                color: white;
+                border-radius: 10px;
+                padding: {padding - 7}px;
+                font-size: {font_size}pt;
+                font-family: Calibri;
+                font-weight: bold;
+                min-height: 35px;
+            }}
+            QPushButton:disabled {{
+                background-color: #C7C7CC;
+            }}
+        """
+
+    def toggle_recording(self):
+        """开始/停止录制，每个设备写入各自的文件"""
+        if not self.devices:
+            return
+        if not any(device.thread.recorder for device in self.devices.values()):
+            stamp = time.strftime("spectrum_%Y%m%d_%H%M%S")
+            paths = []
+            try:
+                for device in self.devices.values():
+                    suffix = f"_{safe_name(device.name)}" if len(self.devices) > 1 else ""
+                    path = os.path.join(self.RECORD_DIR, stamp + suffix + EXTENSION)
+                    device.thread.start_recording(path)
+                    paths.append(path)
+            except OSError as e:
+                self.stop_recording()
+                self.status_label.setText(f"Recording failed: {e}")
+                return
+            self.record_btn.setText("Stop Recording")
+            self.record_btn.setToolTip("\n".join(paths))
+            self.record_btn.setStyleSheet(self.record_style("#FF3B30"))
+        else:
+            self.stop_recording()
+
+    def stop_recording(self):
+        errors = []
+        for device in self.devices.values():
+            device.thread.stop_recording()
+            if device.thread.recording_error is not None:
+                errors.append(f"{device.name}: {device.thread.recording_error}")
+        self.record_btn.setText("Start Recording")
+        self.record_btn.setStyleSheet(self.record_style("#5856D6"))
+        if errors:
+            self.status_label.setText("Recording failed: " + "; ".join(errors))
+
     def connect_device(self, port):
         """连接串口设备"""
-        self.serial_thread = SerialThread(port)
-        self.serial_thread.dataReceived.connect(self.update_plot)
-        self.serial_thread.start()
-
-    def disconnect_device(self):
-        """断开串口连接"""
-        if self.serial_thread:
-            self.serial_thread.stop()
-            self.serial_thread = None
-
-    def update_stats_display(self, stats=None):
-        """更新统计数据展示"""
-        if stats is None:
-            html = f"""
-            <div style='font-family: Calibri; font-size: {self.base_font_size}pt;'>
-                <div style='color: #888; text-align: center; padding: 15px;'>
-                    Waiting for data...
-                </div>
-            </div>
-            """
+        auto_exposure = AutoExposure(self.exposure_target) if self.auto_exposure else None
+        self.attach_source(SerialAcquisition(port, auto_exposure=auto_exposure), port)
+
+    def attach_source(self, thread, name):
+        """接入一个数据源线程（串口或回放），各设备有独立的处理链和曲线"""
+        channel = Channel(name, self.load_calibration(name), self.stats_window,
+                          self.average_mode, self.average_n, self.waterfall_depth, self.create_trigger(name),
+                          self.create_pipeline())
+        color = self.DEVICE_COLORS[len(self.devices) % len(self.DEVICE_COLORS)]
+        device = Device(thread, channel, color)
+        self.devices[name] = device
+        self.rebuild_plot()
+        thread.channel = channel
+        thread.instrument = self.instrumented
+        self.metrics.add_source(name, thread)
+        thread.on_averaging_done = device.signals.averagingDone.emit
+        device.signals.averagingDone.connect(self.on_averaging_done)
+        thread.start()
+        if self.is_capturing:
+            thread.start_capture()
+        self.render_timer.start()
+        self.stats_timer.start()
+        return device
+
+    def create_trigger(self, name):
+        """触发模式下为设备创建预触发缓冲区，事件写入 trigger_dir"""
+        if not self.trigger:
+            return None
+        writer = EventWriter(self.trigger_dir, safe_name(name))
+        writer.start()
+        return TriggerCapture(parse_trigger(self.trigger), self.trigger_pre, self.trigger_post, writer=writer)
+
+    def create_pipeline(self):
+        """按声明创建设备的处理阶段流水线；触发模式只处理事件窗口，不需要进程池"""
+        if not self.pipeline:
+            return None
+        return Pipeline(parse_pipeline(self.pipeline), 0 if self.trigger else self.pipeline_workers)
+
+    def start_replay(self, source, speed=1.0, name="replay"):
+        """不连接设备，回放录制文件或合成光谱并立即开始采集"""
+        self.attach_source(ReplayAcquisition(source, speed), name)
+        self.update_device_controls()
+        if not self.is_capturing:
+            self.toggle_capture()
+        self.status_label.setText("Replaying")
+
+    def performance_report(self):
+        """各设备帧率、总帧率、CPU 占用与各阶段耗时"""
+        lines = []
+        elapsed = cpu = 0.0
+        if self.capture_started:
+            elapsed = time.perf_counter() - self.capture_started[0]
+            cpu = time.process_time() - self.capture_started[1]
+        total = 0
+        for device in self.devices.values():
+            frames = device.channel.frames
+            total += frames
+            rate = frames / elapsed if elapsed else 0.0
+            lines.append(f"{device.name}: {frames} frames, {rate:.1f} frames/s")
+        if elapsed:
+            lines.append(f"aggregate {total / elapsed:.1f} frames/s from {len(self.devices)} device(s), "
+                         f"CPU {100 * cpu / elapsed:.0f}%")
+            redraws = self.timings.counts['render']
+            lines.append(f"{redraws} redraws, {redraws / elapsed:.1f} redraws/s "
+                         f"(timer interval {self.render_timer.interval()} ms)")
+        if total:
+            # 界面线程上计时的工作（绘制、统计面板、库匹配）平均到每个输入帧
+            ui = {stage: self.timings.totals[stage] * 1000 / total for stage in self.UI_STAGES}
+            lines.append(f"UI thread {sum(ui.values()):.3f} ms/frame ("
+                         + ", ".join(f"{stage} {ms:.3f}" for stage, ms in ui.items()) + ")")
+        timers = [device.thread.timings for device in self.devices.values()]
+        timers += [device.channel.pipeline.timings for device in self.devices.values() if device.channel.pipeline is not None]
+        timers.append(self.timings)
+        lines.append(format_report(*timers))
+        return '\n'.join(lines)
+
+    def disconnect_device(self, device):
+        """断开一个设备"""
+        device.thread.stop()
+        if device.channel.trigger is not None:
+            device.channel.trigger.close()
+        device.channel.close()
+        self.metrics.remove_source(device.name)
+        del self.devices[device.name]
+        if not self.devices:
+            self.render_timer.stop()
+            self.stats_timer.stop()
+        self.rebuild_plot()
+
+    def disconnect_all(self):
+        for device in list(self.devices.values()):
+            self.disconnect_device(device)
+
+    @property
+    def instrumented(self):
+        """性能面板显示或导出指标时，采集线程额外统计串口读取耗时"""
+        return self.metrics_exporter is not None or not self.overlay.isHidden()
+
+    def toggle_overlay(self):
+        """显示/隐藏性能面板"""
+        self.overlay.setVisible(self.overlay.isHidden())
+        for device in self.devices.values():
+            device.thread.instrument = self.instrumented
+        if self.overlay.isHidden():
+            self.overlay_timer.stop()
+        else:
+            self.update_overlay()
+            self.overlay_timer.start()
+
+    @Slot()
+    def update_overlay(self):
+        self.overlay.setText(format_overlay(self.metrics.snapshot(consumer='overlay')))
+        self.overlay.adjustSize()
+        self.overlay.raise_()
+
+    def stop_metrics_export(self):
+        """停止定期导出并写入最终指标"""
+        exporter, self.metrics_exporter = self.metrics_exporter, None
+        if exporter is not None:
+            exporter.close()
+
+    def load_library(self, path):
+        """打开参考光谱库（矩阵按需映射），没有指定、不存在或为空时返回 None"""
+        if not path:
+            return None
+        try:
+            library = SpectralLibrary.open(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Spectral library load error: {e}")
+            return None
+        if not len(library):
+            print(f"Spectral library {path} is empty, matching disabled")
+            return None
+        return library
+
+    def update_matches(self):
+        """把最新光谱与参考库匹配，只更新显示文本变化的标签"""
+        if self.pending_match is None:
+            texts = [("--", "--")] * self.MATCH_TOP
         else:
-            max_val, min_val, mean_val, std_val, peak_pos = stats
-            html = f"""
-            <div style='font-family: Calibri; font-size: {self.base_font_size}pt;'>
-                <div style='display: flex; justify-content: space-between; border-bottom: 1px solid #E0E0E0; padding: 8px 0;'>
-                    <div style='color: #5F6368;'>Max Value</div>
-                    <div style='color: #007AFF; font-weight: bold;'>{max_val} <span style='font-size: {self.base_font_size - 1}pt; color: #666;'>(Pixel {np.argmax(stats[0])})</span></div>
-                </div>
-
-                <div style='display: flex; justify-content: space-between; border-bottom: 1px solid #E0E0E0; padding: 8px 0;'>
-                    <div style='color: #5F6368;'>Min Value</div>
-                    <div style='color: #FF2D55; font-weight: bold;'>{min_val}</div>
-                </div>
-
-                <div style='display: flex; justify-content: space-between; border-bottom: 1px solid #E0E0E0; padding: 8px 0;'>
-                    <div style='color: #5F6368;'>Average</div>
-                    <div style='color: #34C759; font-weight: bold;'>{mean_val:.2f}</div>
-                </div>
-
-                <div style='display: flex; justify-content: space-between; border-bottom: 1px solid #E0E0E0; padding: 8px 0;'>
-                    <div style='color: #5F6368;'>Standard Deviation</div>
-                    <div style='color: #AF52DE; font-weight: bold;'>{std_val:.2f}</div>
-                </div>
-
-                <div style='display: flex; justify-content: space-between; padding: 8px 0;'>
-                    <div style='color: #5F6368;'>Peak Position</div>
-                    <div style='color: #FF9500; font-weight: bold;'>{peak_pos}</div>
-                </div>
-            </div>
-            """
-        self.stats_label.setText(html)
-
-    @Slot(list)
-    def update_plot(self, data):
-        """更新光谱图和统计数据"""
-        # 数据处理：剔除前12帧和后3帧的数据
-        if len(data) == 128:
-            # 去除暗电流影响
-            processed_data = data[12:-3]  # 保留第13帧到第125帧
+            data, pixels = self.pending_match
+            self.pending_match = None
+            t = time.perf_counter()
+            matches = self.library.match(data, self.MATCH_TOP, self.match_method, pixels)
+            self.timings.since('match', t)
+            entries = self.library.entries
+            texts = [(entries[i]['name'][:self.MATCH_NAME_CHARS], f"{score:.3f}")
+                     for i, score in zip(matches.index[0], matches.score[0])]
+            texts += [("--", "--")] * (self.MATCH_TOP - len(texts))
+        for rank, text in enumerate(texts):
+            if self.match_texts[rank] != text:
+                self.match_texts[rank] = text
+                name_label, score_label = self.match_labels[rank]
+                name_label.setText(text[0])
+                score_label.setText(text[1])
+
+    def calibration_path(self, name):
+        return os.path.join(self.calibration_dir, safe_name(name) + ".npz")
+
+    def load_calibration(self, name):
+        """读取设备保存的校正数据，命令行指定了像素掩码时覆盖保存的掩码"""
+        path = self.calibration_path(name)
+        if os.path.exists(path):
+            try:
+                calibration = Calibration.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Calibration load error: {e}")
+                calibration = Calibration()
         else:
-            processed_data = data  # 如果数据长度不是128，则使用原始数据
+            calibration = Calibration()
+        if self.mask is not None:
+            calibration.set_mask(self.mask)
+        return calibration
 
-        # 更新绘图数据
-        x = np.arange(len(processed_data))
-        self.line.set_data(x, processed_data)
+    def save_calibration(self, device):
+        try:
+            os.makedirs(self.calibration_dir, exist_ok=True)
+            device.channel.calibration.save(self.calibration_path(device.name))
+        except OSError as e:
+            print(f"Calibration save error: {e}")
+
+    def set_calibration_enabled(self, enabled):
+        for button in (self.dark_btn, self.flat_btn, self.clear_calib_btn):
+            button.setEnabled(enabled)
+
+    def start_averaging(self, kind):
+        """对选中的设备采集 CALIBRATION_FRAMES 帧原始数据求平均，kind 为 'dark' 或 'flat'"""
+        device = self.selected_device()
+        if device is None:
+            return
+        device.channel.start_averaging(kind, self.CALIBRATION_FRAMES)
+        self.status_label.setText(f"Averaging {kind} frames ({device.name})...")
+
+    def finish_averaging(self, device):
+        """平均完成：更新校正数据并保存"""
+        try:
+            kind = device.channel.finish_averaging()
+        except ValueError as e:
+            self.status_label.setText(f"Calibration failed: {e}")
+            return
+        self.save_calibration(device)
+        self.status_label.setText(f"{kind.capitalize()} calibration saved ({device.name})")
+
+    def clear_calibration(self):
+        device = self.selected_device()
+        if device is None:
+            return
+        device.channel.clear_calibration()
+        self.save_calibration(device)
+        self.status_label.setText(f"Calibration cleared ({device.name})")
+
+    def change_averaging(self):
+        """切换帧累加模式或帧数，所有设备重新开始累加"""
+        self.average_mode = self.average_combo.currentData()
+        self.average_n = self.average_spin.value()
+        self.average_spin.setEnabled(self.average_mode != AVERAGE_NONE)
+        for device in self.devices.values():
+            device.channel.set_averaging(self.average_mode, self.average_n)
+
+    def stats_style(self, font_size, padding):
+        """统计数据面板样式"""
+        return f"""
+            QFrame#StatsPanel {{
+                background-color: #FFFFFF;
+                border-radius: 14px;
+                padding: {padding - 3}px;
+                border: 1px solid #E0E0E0;
+            }}
+            QFrame#StatsPanel QLabel {{
+                font-family: Calibri;
+                font-size: {font_size}pt;
+                padding: 8px 0;
+                border: none;
+                border-bottom: 1px solid #E0E0E0;
+            }}
+            QFrame#StatsPanel QLabel[last="true"] {{
+                border-bottom: none;
+            }}
+            QLabel#StatName {{
+                color: #5F6368;
+            }}
+            QFrame#StatsPanel QLabel#StatsPlaceholder {{
+                color: #888;
+                padding: 15px;
+                border-bottom: none;
+            }}
+        """
 
-        # 更新X轴范围
-        self.ax.set_xlim(0, len(processed_data) - 1)
-        self.canvas.draw()
+    def update_stats_display(self, stats=None, peak=None):
+        """记录最新统计数据，由定时器按固定频率刷新到界面
 
-        # 计算统计数据
-        max_val = max(processed_data)
-        min_val = min(processed_data)
-        mean_val = np.mean(processed_data)
-        std_val = np.std(processed_data)
-        peak_pos = np.argmax(processed_data)
+        peak 为主峰的 (亚像素位置, 半高全宽)，单位与横轴相同，没有峰时为 None。
+        """
+        self.pending_stats = None if stats is None else (stats, peak)
+        if stats is None:
+            self.flush_stats()
+
+    @Slot()
+    def flush_stats(self):
+        """把最新统计数据写入面板，只更新显示值变化的标签"""
+        t = time.perf_counter()
+        stats = self.pending_stats
+        waiting = stats is None
+        if waiting == self.stats_placeholder.isHidden():
+            # 各指标行始终保留，避免数据到达时面板宽度变化引起整个窗口重新布局
+            self.stats_placeholder.setVisible(waiting)
+        if waiting:
+            for key, (_, value_label) in self.stat_labels.items():
+                self.stat_texts[key] = "--"
+                value_label.setText("--")
+            if self.library is not None:
+                self.pending_match = None
+                self.update_matches()
+            return
+
+        (max_val, min_val, mean_val, std_val, peak_pos), peak = stats
+        device = self.selected_device()
+        noise_val, snr_val = device.channel.noise() if device else (0.0, 0.0)
+        texts = {
+            'max': f"{max_val:.0f} (Pixel {peak_pos})",
+            'min': f"{min_val:.0f}",
+            'mean': f"{mean_val:.2f}",
+            'std': f"{std_val:.2f}",
+            'peak': self.format_axis(peak[0]) if peak else "--",
+            'fwhm': self.format_axis(peak[1]) if peak else "--",
+            'noise': f"{noise_val:.2f}",
+            'snr': f"{snr_val:.1f}",
+            'integration': describe_setting(device.thread.reader.device_state) if device else "--",
+        }
+        for key, text in texts.items():
+            if self.stat_texts.get(key) != text:
+                self.stat_texts[key] = text
+                self.stat_labels[key][1].setText(text)
+        self.timings.since('stats', t)
+        if self.library is not None and self.pending_match is not None:
+            self.update_matches()
+
+    @Slot()
+    def on_averaging_done(self):
+        """某个设备的暗场/参考帧已采够"""
+        device = next((d for d in self.devices.values() if d.signals is self.sender()), None)
+        if device is not None:
+            self.finish_averaging(device)
+
+    @Slot()
+    def render_latest(self):
+        """定时器回调：更新所有有新数据的设备的曲线和瀑布图，然后一次性 blit"""
+        updated = False
+        read_times = []  # 本次绘制的各光谱从串口读出的时间
+        t = time.perf_counter()
+        for device in self.devices.values():
+            spectrum = device.channel.take_result()
+            if spectrum is not None:
+                if spectrum.timestamp is not None:
+                    self.timings.since('queue', spectrum.timestamp)
+                    read_times.append(spectrum.timestamp)
+                t_plot = time.perf_counter()
+                self.update_plot(device, spectrum.data)
+                self.timings.since('plot', t_plot)
+                updated = True
+                if device.channel.trigger is not None:
+                    self.status_label.setText(f"Trigger {device.channel.trigger.fired} at frame "
+                                              f"{device.channel.event.seq} ({device.name})")
+        if self.waterfall_depth and self.update_waterfall():
+            updated = True
+        if updated:
+            t_draw = time.perf_counter()
+            self.plot.render()
+            self.timings.since('draw', t_draw)
+            self.timings.since('render', t)
+            for read_time in read_times:
+                self.timings.since('latency', read_time)
+
+    def update_waterfall(self):
+        """把选中设备的新帧加入瀑布图，返回是否需要重绘"""
+        device = self.selected_device()
+        if device is not self.waterfall_device:
+            # 切换设备后从该设备的历史重新开始
+            self.waterfall_device = device
+            self.waterfall_feed = WaterfallFeed(self.waterfall_depth, self.waterfall_lut)
+        if device is None:
+            return False
+        if not self.waterfall_feed.update(device.channel.history):
+            return False
+        waterfall = self.waterfall_feed.waterfall
+        if waterfall is not self.waterfall_shown and device.plot_x is not None:
+            # 新的瀑布图（首次、切换设备或像素掩码变化）：横轴与光谱曲线一致，需要整图重绘
+            self.waterfall_shown = waterfall
+            x = device.plot_x
+            self.waterfall_image.set_extent((x[0], x[-1], self.waterfall_depth, 0))
+            self.waterfall_ax.set_xlim(x.min(), x.max())
+            self.waterfall_ax.set_title(device.name)
+            self.plot.invalidate()
+        rows = max(1, self.waterfall_ax.pixel_height())
+        self.waterfall_image.set_data(waterfall.view(rows))
+        return True
+
+    def load_wavelength(self, path):
+        """读取波长定标，文件不存在或像素数不符时横轴使用像素序号"""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            wavelength = WavelengthCalibration.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Wavelength calibration load error: {e}")
+            return None
+        if wavelength.npixels != protocol.NPIXELS:
+            print(f"Wavelength calibration is for {wavelength.npixels} pixels, ignored")
+            return None
+        return wavelength
+
+    def format_axis(self, value):
+        """按横轴单位格式化位置或宽度"""
+        if value != value:  # NaN
+            return "--"
+        return f"{value:.2f} nm" if self.wavelength else f"{value:.2f} px"
+
+    def set_plot_pixels(self, device, pixels):
+        """设置曲线对应的传感器像素，横轴取其像素序号或波长，此时需要整图重绘"""
+        device.plot_pixels = pixels
+        device.plot_index = np.arange(len(pixels))
+        device.plot_x = self.wavelength.axis[pixels] if self.wavelength else pixels
+        # 同一坐标轴上的所有曲线都要能完整显示
+        shown = [d.plot_x for d in self.devices.values() if d.ax is device.ax and d.plot_x is not None]
+        device.ax.set_xlim(min(x.min() for x in shown), max(x.max() for x in shown))
+        self.plot.invalidate()
+
+    def update_plot(self, device, processed_data):
+        """更新一个设备的曲线，选中的设备同时更新统计数据；processed_data 为处理后的一帧"""
+
+        # 像素掩码变化时才更新X轴范围
+        pixels = device.channel.calibration.pixels
+        if len(processed_data) != len(pixels):
+            pixels = np.arange(len(processed_data))
+        if pixels is not device.plot_pixels and not np.array_equal(pixels, device.plot_pixels):
+            self.set_plot_pixels(device, pixels)
+
+        # 多峰检测：峰位从数组下标换算到传感器像素，再换算到横轴单位
+        peaks = find_peaks(processed_data, method=self.peak_method)
+        positions = np.interp(peaks.position, device.plot_index, pixels)
+        if self.wavelength:
+            positions = self.wavelength.to_wavelength(positions)
 
-        # 更新数据统计显示
-        self.update_stats_display((max_val, min_val, mean_val, std_val, peak_pos))
+        # 更新绘图数据
+        device.line.set_data(device.plot_x, processed_data)
+        device.peak_markers.set_data(positions, peaks.height)
+        if device is not self.selected_device():
+            return
+
+        # 计算统计数据并更新显示，参考库匹配随统计面板一起按固定频率进行
+        if self.library is not None:
+            self.pending_match = (processed_data, pixels)
+        stats = frame_stats(processed_data)
+        peak = None
+        if len(positions):
+            main = int(np.argmax(peaks.height))
+            fwhm = peaks.fwhm[main]
+            if self.wavelength:
+                pixel = np.interp(peaks.position[main], device.plot_index, pixels)
+                fwhm = self.wavelength.width_to_nm(pixel, fwhm)
+            peak = (positions[main], fwhm)
+        self.update_stats_display(stats._replace(peak_pos=int(pixels[stats.peak_pos])), peak)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TSL1401 spectrometer")
+    parser.add_argument('--replay', metavar='SOURCE',
+                        help="replay a recording file, or 'synthetic' for generated spectra, instead of a device")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed multiplier, 0 = as fast as possible")
+    parser.add_argument('--connect', nargs='+', metavar='PORT', default=[],
+                        help="connect these serial ports at start and begin capturing")
+    parser.add_argument('--fake', type=int, default=0, metavar='N',
+                        help="also list N pty-backed fake devices in the port list (Linux/macOS)")
+    parser.add_argument('--layout', default='overlay', choices=SpectrometerApp.PLOT_LAYOUTS,
+                        help="draw several devices overlaid on one plot or tiled one plot each")
+    parser.add_argument('--waterfall', type=int, default=0, metavar='FRAMES',
+                        help="show a scrolling waterfall of the last FRAMES frames of the selected device")
+    parser.add_argument('--plot', default=DEFAULT_BACKEND, choices=BACKENDS,
+                        help="plot backend: matplotlib (Agg) or qt (QPainter, faster redraw and startup)")
+    parser.add_argument('--calibration', default=SpectrometerApp.CALIBRATION_DIR,
+                        help="directory of per-device dark/flat calibration files")
+    parser.add_argument('--mask', help="pixels to keep, e.g. '12:125' or '0:5,12:125' (default: saved mask)")
+    parser.add_argument('--wavelength', default=SpectrometerApp.WAVELENGTH_FILE,
+                        help="pixel-to-wavelength calibration made with 'python -m tsl1401 spectral fit'")
+    parser.add_argument('--peak-method', default=SpectrometerApp.PEAK_METHOD, choices=REFINE_METHODS,
+                        help="sub-pixel peak refinement")
+    parser.add_argument('--average', default=AVERAGE_NONE, choices=AVERAGE_MODES,
+                        help="host-side frame averaging shown in the plot and statistics")
+    parser.add_argument('--average-n', type=int, default=SpectrometerApp.DEFAULT_AVERAGE_N,
+                        help="number of frames to average")
+    parser.add_argument('--auto-exposure', action='store_true',
+                        help="adjust each device's frame delay to keep the p99 level near --target without saturating")
+    parser.add_argument('--target', type=float, default=0.7, help="auto-exposure target as a fraction of full scale")
+    parser.add_argument('--library', metavar='DIR',
+                        help="reference spectrum library to match the selected device against "
+                             "(build with 'python -m tsl1401 library add')")
+    parser.add_argument('--match', default='cosine', choices=MATCH_METHODS, help="library match score")
+    parser.add_argument('--pipeline', metavar='SPEC',
+                        help="processing stages applied before display, e.g. median:5,deconvolve:30,baseline:31 "
+                             "(append @pool or @local to override where a stage runs)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="worker processes per device for the heavy pipeline stages, 0 = acquisition thread")
+    parser.add_argument('--trigger', metavar='SPEC',
+                        help="trigger mode: <level|edge|deviation>:<threshold>[@pixel|@start:stop], e.g. edge:600@64; "
+                             "only frames around events are saved and drawn")
+    parser.add_argument('--pre', type=int, default=DEFAULT_PRE, help="frames saved before each trigger")
+    parser.add_argument('--post', type=int, default=DEFAULT_POST, help="frames saved from each trigger on")
+    parser.add_argument('--trigger-dir', default=TRIGGER_DIR, help="directory for the saved trigger windows")
+    parser.add_argument('--refresh-rate', type=float, default=SpectrometerApp.DEFAULT_REFRESH_RATE, metavar='HZ',
+                        help="plot redraw rate; only the newest frame is drawn on each tick")
+    parser.add_argument('--duration', type=float,
+                        help="quit after this many seconds and print throughput and per-stage latency")
+    parser.add_argument('--overlay', action='store_true',
+                        help=f"show the performance overlay at start (toggle with {SpectrometerApp.OVERLAY_KEY})")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="periodically write metrics to FILE (.json = JSON, otherwise Prometheus text)")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="metrics export interval (s)")
+    args, qt_args = parser.parse_known_args()
+    if args.trigger:
+        try:
+            parse_trigger(args.trigger)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.pipeline:
+        try:
+            parse_pipeline(args.pipeline)
+        except ValueError as e:
+            parser.error(str(e))
+
     # 启用高DPI缩放
     QApplication.setHighDpiScaleFactorRoundingPolicy(
         Qt.HighDpiScaleFactorRoundingPolicy.PassThrough
@@ -610,7 +1383,7 @@ if __name__ == "__main__":
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
 
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
 
     # 全局样式
     app.setStyle("Fusion")
@@ -658,7 +1431,39 @@ if __name__ == "__main__":
         }
     """)
 
-    window = SpectrometerApp()
+    fake_devices = []
+    if args.fake:
+        from tsl1401.fakedevice import start_devices
+        fake_devices = start_devices(args.fake, 100.0)
+        register_provider(static_provider([device.port for device in fake_devices], "TSL1401 fake device"))
+
+    window = SpectrometerApp(refresh_rate=args.refresh_rate, calibration_dir=args.calibration, mask=args.mask,
+                             layout=args.layout, wavelength_file=args.wavelength, peak_method=args.peak_method,
+                             average_mode=args.average, average_n=args.average_n,
+                             waterfall=args.waterfall, plot_backend=args.plot,
+                             metrics_file=args.metrics, metrics_interval=args.metrics_interval,
+                             trigger=args.trigger, trigger_pre=args.pre, trigger_post=args.post,
+                             trigger_dir=args.trigger_dir, auto_exposure=args.auto_exposure,
+                             exposure_target=args.target, library=args.library, match_method=args.match,
+                             pipeline=args.pipeline, pipeline_workers=args.workers)
     window.show()
-    sys.exit(app.exec())
+    if args.overlay:
+        window.toggle_overlay()
+    for port in args.connect:
+        window.connect_device(port)
+    if args.connect:
+        window.update_device_controls()
+        window.toggle_capture()
+    if args.replay:
+        window.start_replay(open_source(args.replay), args.speed)
+    if args.duration:
+        QTimer.singleShot(int(args.duration * 1000), app.quit)
+    code = app.exec()
+    if args.duration:
+        print(window.performance_report())
+    window.stop_metrics_export()
+    window.disconnect_all()
+    for device in fake_devices:
+        device.close()
+    sys.exit(code)
 
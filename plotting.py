@@ -0,0 +1,557 @@
+"""绘图后端：matplotlib (Agg 光栅化后 blit) 或直接用 QPainter 绘制，启动时选择
+
+两个后端提供同样的小接口，界面只通过它绘图：
+
+    plot = create_backend('qt')
+    ax = plot.add_axes("Spectrum", "Pixel Index", "ADC Value", ylim=(0, 1023))
+    line = ax.line('#007AFF', label='COM3')
+    line.set_data(x, y)
+    plot.render()
+
+坐标轴标题、刻度等静态部分缓存为背景，每次刷新只重绘曲线、峰值标记和瀑布图。
+matplotlib 只在选用时才导入。比较两个后端的重绘和启动耗时（无界面）：
+
+    QT_QPA_PLATFORM=offscreen python plotting.py bench
+
+拖动调整大小期间两个后端都只缩放显示上一次的结果，尺寸稳定后整图重绘一次。检查一次
+连续调整大小后的整图重绘次数，超过 --max-draws 时以非零状态退出：
+
+    QT_QPA_PLATFORM=offscreen python plotting.py resize --steps 30
+"""
+import argparse
+import math
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PySide6.QtCore import QLineF, QPointF, QRectF, Qt, QTimer, Signal
+from PySide6.QtGui import QColor, QFont, QFontMetricsF, QImage, QPainter, QPen, QPixmap, QPolygonF
+from PySide6.QtWidgets import QWidget
+
+SPINE_COLOR = "#007AFF"
+FIGURE_DPI = 150  # matplotlib 图表的 dpi，QPainter 后端按它换算字号和线宽
+
+
+# viridis 的 9 个取样点，QPainter 后端不导入 matplotlib 时用线性插值生成颜色查找表
+VIRIDIS = np.array([
+    (0.267, 0.005, 0.329), (0.279, 0.175, 0.483), (0.230, 0.322, 0.546), (0.173, 0.449, 0.558),
+    (0.128, 0.567, 0.551), (0.153, 0.680, 0.504), (0.360, 0.785, 0.388), (0.668, 0.862, 0.196),
+    (0.993, 0.906, 0.144),
+])
+
+
+def _viridis(values):
+    stops = np.linspace(0.0, 1.0, len(VIRIDIS))
+    rgb = np.stack([np.interp(values, stops, VIRIDIS[:, i]) for i in range(3)], axis=-1)
+    return np.concatenate([rgb, np.ones(rgb.shape[:-1] + (1,))], axis=-1)
+
+
+def nice_ticks(lo, hi, count=8):
+    """lo..hi 之间约 count 个 1/2/5×10^k 间隔的刻度"""
+    lo, hi = min(lo, hi), max(lo, hi)
+    if hi <= lo:
+        return np.array([lo])
+    raw = (hi - lo) / count
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw)
+    return np.arange(math.ceil(lo / step) * step, hi + step * 1e-9, step)
+
+
+class QtPlotWidget(QWidget):
+    """QPainter 后端的绘图控件：静态背景缓存在 QPixmap，动态对象每次直接绘制"""
+
+    resizeSettled = Signal()
+
+    RESIZE_DELAY = 150  # 尺寸停止变化多久后调整字号(毫秒)
+
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(self.RESIZE_DELAY)
+        self.resize_timer.timeout.connect(self.resizeSettled)
+
+    @property
+    def resizing(self):
+        return self.resize_timer.isActive()
+
+    def resizeEvent(self, event):
+        self.resize_timer.start()
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        self.backend.paint(painter)
+        painter.end()
+
+
+class QtBackend:
+    """直接用 QPainter 绘制：不经过 Agg 光栅化，也不导入 matplotlib"""
+
+    name = 'qt'
+    SCALE = FIGURE_DPI / 72  # 与 matplotlib 图表的字号/线宽一致
+    MARGIN = 10  # 坐标轴之间及到边缘的间距(像素)
+
+    def __init__(self):
+        self.widget = QtPlotWidget(self)
+        self.axes = []
+        self.background = None  # 缓存的静态部分 QPixmap
+        self.font_size = 14
+        self.full_draws = 0  # 静态背景重绘次数（调整大小检查用）
+
+    def colormap(self, name):
+        if name != 'viridis':
+            raise ValueError(f"colormap {name!r} needs the matplotlib backend")
+        return _viridis
+
+    def clear(self):
+        self.axes = []
+        self.background = None
+
+    def add_axes(self, title, xlabel, ylabel, ylim, pixel_ticks=True, height=1):
+        ax = QtAxes(self, title, xlabel, ylabel, ylim, pixel_ticks, height)
+        self.axes.append(ax)
+        self.background = None
+        return ax
+
+    def font(self, delta, bold=False):
+        font = QFont("Arial")
+        font.setPixelSize(max(1, round((self.font_size + delta) * self.SCALE)))
+        font.setBold(bold)
+        return font
+
+    def set_font_size(self, font_size):
+        self.font_size = font_size
+        self.background = None
+
+    def update_layout(self):
+        self.background = None
+        self.widget.update()
+
+    def invalidate(self):
+        self.background = None
+
+    def render(self):
+        """立即重绘（与 matplotlib 的 blit 一样同步），只有动态对象需要重新绘制"""
+        self.widget.repaint()
+
+    def layout(self):
+        """按字号和控件尺寸计算每个坐标轴的绘图区域"""
+        if not self.axes:
+            return
+        title = QFontMetricsF(self.font(2)).height()
+        label = QFontMetricsF(self.font(1)).height()
+        ticks = QFontMetricsF(self.font(-1))
+        tick_width = max(ticks.horizontalAdvance(ax.format_tick(value))
+                         for ax in self.axes for value in ax.yticks())
+        left = self.MARGIN + label + tick_width + 8
+        right = self.widget.width() - self.MARGIN - ticks.horizontalAdvance("000") / 2
+        top_space = title + 6
+        bottom_space = ticks.height() + label + 10
+        total = self.widget.height() - self.MARGIN * 2 - len(self.axes) * (top_space + bottom_space)
+        total = max(total, len(self.axes))
+        weights = sum(ax.height for ax in self.axes)
+        y = self.MARGIN
+        for ax in self.axes:
+            height = total * ax.height / weights
+            ax.rect = QRectF(left, y + top_space, max(1.0, right - left), height)
+            y += top_space + height + bottom_space
+
+    def paint_background(self):
+        """标题、网格、刻度、坐标轴标签和图例"""
+        self.full_draws += 1
+        ratio = self.widget.devicePixelRatioF()
+        pixmap = QPixmap(max(1, round(self.widget.width() * ratio)), max(1, round(self.widget.height() * ratio)))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        self.layout()
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        for ax in self.axes:
+            ax.paint_static(painter)
+        painter.end()
+        self.background = pixmap
+
+    def paint(self, painter):
+        size = self.widget.size()
+        if self.background is not None and self.widget.resizing:
+            # 拖动期间把上次的背景和曲线按比例缩放显示，尺寸稳定后才重新排版
+            old = self.background.deviceIndependentSize()
+            painter.scale(size.width() / old.width(), size.height() / old.height())
+        elif self.background is None or self.background.deviceIndependentSize().toSize() != size:
+            self.paint_background()
+        painter.drawPixmap(0, 0, self.background)
+        painter.setRenderHint(QPainter.Antialiasing)
+        for ax in self.axes:
+            ax.paint_dynamic(painter)
+
+
+class QtLine:
+    """曲线或峰值标记，接口与 matplotlib Line2D.set_data 相同"""
+
+    ALPHA = 0.8  # 曲线透明度，预先与白色背景混合
+
+    def __init__(self, color, label=None, marker=False):
+        self.color = QColor(color)
+        # 半透明的宽线条抗锯齿很慢，改用与白色背景混合后的不透明颜色
+        r, g, b = (self.ALPHA * c + 1 - self.ALPHA for c in self.color.getRgbF()[:3])
+        self.line_color = QColor.fromRgbF(r, g, b)
+        self.label = label
+        self.marker = marker
+        self.x = self.y = np.empty(0)
+
+    def set_data(self, x, y):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+
+
+class QtImage:
+    """RGBA 图像，接口与 matplotlib AxesImage 的 set_data/set_extent 相同"""
+
+    def __init__(self, extent):
+        self.extent = extent
+        self.data = None
+
+    def set_data(self, rgba):
+        self.data = rgba
+
+    def set_extent(self, extent):
+        self.extent = extent
+
+
+class QtAxes:
+    def __init__(self, backend, title, xlabel, ylabel, ylim, pixel_ticks, height):
+        self.backend = backend
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.xlim = (0.0, 1.0)
+        self.ylim = ylim  # (下边缘的值, 上边缘的值)
+        self.pixel_ticks = pixel_ticks
+        self.height = height
+        self.lines = []
+        self.images = []
+        self.show_legend = False
+        self.rect = QRectF()
+
+    def set_xlim(self, lo, hi):
+        self.xlim = (float(lo), float(hi))
+
+    def set_title(self, title):
+        self.title = title
+
+    def line(self, color, label=None):
+        line = QtLine(color, label)
+        self.lines.append(line)
+        return line
+
+    def markers(self, color):
+        markers = QtLine(color, marker=True)
+        self.lines.append(markers)
+        return markers
+
+    def image(self, extent):
+        image = QtImage(extent)
+        self.ylim = (extent[2], extent[3])
+        self.images.append(image)
+        return image
+
+    def legend(self):
+        self.show_legend = True
+
+    def pixel_height(self):
+        return int(self.rect.height())
+
+    def xticks(self):
+        lo, hi = sorted(self.xlim)
+        if self.pixel_ticks:
+            return np.arange(math.ceil(lo / 10) * 10, hi + 1e-9, 10)
+        return nice_ticks(lo, hi)
+
+    def yticks(self):
+        return nice_ticks(*self.ylim, count=5)
+
+    @staticmethod
+    def format_tick(value):
+        return f"{value:g}"
+
+    def map_x(self, x):
+        x0, x1 = self.xlim
+        return self.rect.left() + (x - x0) * (self.rect.width() / ((x1 - x0) or 1.0))
+
+    def map_y(self, y):
+        y0, y1 = self.ylim
+        return self.rect.bottom() - (y - y0) * (self.rect.height() / ((y1 - y0) or 1.0))
+
+    def paint_static(self, painter):
+        backend = self.backend
+        rect = self.rect
+        grid = QColor(176, 176, 176, 51)  # matplotlib 默认网格颜色，alpha 0.2
+        tick_font = backend.font(-1)
+        metrics = QFontMetricsF(tick_font)
+        painter.setFont(tick_font)
+        for value in self.xticks():
+            x = self.map_x(value)
+            painter.setPen(QPen(grid, 1))
+            painter.drawLine(QPointF(x, rect.top()), QPointF(x, rect.bottom()))
+            painter.setPen(Qt.black)
+            text = self.format_tick(value)
+            painter.drawText(QPointF(x - metrics.horizontalAdvance(text) / 2, rect.bottom() + 4 + metrics.ascent()),
+                             text)
+        for value in self.yticks():
+            y = self.map_y(value)
+            painter.setPen(QPen(grid, 1))
+            painter.drawLine(QPointF(rect.left(), y), QPointF(rect.right(), y))
+            painter.setPen(Qt.black)
+            text = self.format_tick(value)
+            painter.drawText(QPointF(rect.left() - 6 - metrics.horizontalAdvance(text),
+                                     y + metrics.ascent() / 2 - 1), text)
+
+        painter.setPen(QPen(QColor(SPINE_COLOR), 1))
+        painter.drawRect(rect)
+
+        painter.setPen(Qt.black)
+        painter.setFont(backend.font(2))
+        title = QFontMetricsF(painter.font())
+        painter.drawText(QPointF(rect.center().x() - title.horizontalAdvance(self.title) / 2,
+                                 rect.top() - 6 - title.descent()), self.title)
+        painter.setFont(backend.font(1))
+        label = QFontMetricsF(painter.font())
+        painter.drawText(QPointF(rect.center().x() - label.horizontalAdvance(self.xlabel) / 2,
+                                 rect.bottom() + 6 + metrics.height() + label.ascent()), self.xlabel)
+        ylabel = label.elidedText(self.ylabel, Qt.ElideRight, rect.height())  # 平铺时坐标轴可能比标签矮
+        painter.save()
+        painter.translate(backend.MARGIN + label.ascent(), rect.center().y() + label.horizontalAdvance(ylabel) / 2)
+        painter.rotate(-90)
+        painter.drawText(QPointF(0, 0), ylabel)
+        painter.restore()
+
+        if self.show_legend:
+            self.paint_legend(painter)
+
+    def paint_legend(self, painter):
+        painter.setFont(self.backend.font(-2))
+        metrics = QFontMetricsF(painter.font())
+        entries = [line for line in self.lines if line.label]
+        if not entries:
+            return
+        sample = 2 * metrics.height()
+        width = sample + 12 + max(metrics.horizontalAdvance(line.label) for line in entries)
+        box = QRectF(self.rect.right() - width - 14, self.rect.top() + 6, width + 8, metrics.height() * len(entries) + 8)
+        painter.setPen(QPen(QColor(0, 0, 0, 40), 1))
+        painter.setBrush(QColor(255, 255, 255, 200))
+        painter.drawRoundedRect(box, 4, 4)
+        painter.setBrush(Qt.NoBrush)
+        for i, line in enumerate(entries):
+            y = box.top() + 4 + metrics.height() * (i + 0.5)
+            painter.setPen(QPen(line.line_color, 1.8 * self.backend.SCALE))
+            painter.drawLine(QPointF(box.left() + 4, y), QPointF(box.left() + 4 + sample, y))
+            painter.setPen(Qt.black)
+            painter.drawText(QPointF(box.left() + 10 + sample, y + metrics.ascent() / 2 - 1), line.label)
+
+    def paint_dynamic(self, painter):
+        painter.save()
+        painter.setClipRect(self.rect)
+        for image in self.images:
+            if image.data is None or not len(image.data):
+                continue
+            # origin 在下方：第 0 行画在底部，QImage 第 0 行在顶部，所以上下翻转
+            rows = np.ascontiguousarray(image.data[::-1])
+            height, width = rows.shape[:2]
+            qimage = QImage(rows.data, width, height, width * 4, QImage.Format_RGBA8888)
+            left, right, bottom, top = image.extent
+            target = QRectF(QPointF(self.map_x(left), self.map_y(top)), QPointF(self.map_x(right), self.map_y(bottom)))
+            painter.drawImage(target.normalized(), qimage)
+        scale = self.backend.SCALE
+        for line in self.lines:
+            if not len(line.x):
+                continue
+            xs = self.map_x(line.x)
+            ys = self.map_y(line.y)
+            if line.marker:
+                # 向下的三角形标记
+                size = 3.5 * scale
+                painter.setPen(Qt.NoPen)
+                painter.setBrush(line.color)
+                for x, y in zip(xs, ys):
+                    painter.drawPolygon(QPolygonF([QPointF(x - size, y - size), QPointF(x + size, y - size),
+                                                   QPointF(x, y + size)]))
+                painter.setBrush(Qt.NoBrush)
+            else:
+                # 逐段绘制：宽线条的折线抗锯齿要计算连接处，比分段画慢一个数量级
+                points = [QPointF(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+                painter.setPen(QPen(line.line_color, 1.8 * scale))
+                painter.drawLines([QLineF(a, b) for a, b in zip(points, points[1:])])
+        painter.restore()
+
+
+BACKENDS = ('matplotlib', 'qt')
+DEFAULT_BACKEND = 'matplotlib'
+
+
+def create_backend(name=DEFAULT_BACKEND):
+    """按名称创建后端，matplotlib 只在选用时才导入"""
+    if name == 'matplotlib':
+        from plotting_mpl import MatplotlibBackend
+        return MatplotlibBackend()
+    if name == 'qt':
+        return QtBackend()
+    raise ValueError(f"unknown plot backend {name!r}")
+
+
+def demo_plot(plot, devices=1, waterfall=0):
+    """基准测试用：devices 条曲线的光谱图，可选瀑布图；返回 (曲线, 标记, 图像)"""
+    from tsl1401.protocol import NPIXELS
+    colors = ["#007AFF", "#FF2D55", "#34C759", "#AF52DE"]
+    plot.clear()
+    ax = plot.add_axes("Spectral Distribution", "Pixel Index", "ADC Value (0-1023)", (0, 1023))
+    ax.set_xlim(0, NPIXELS - 1)
+    lines = [ax.line(colors[i % len(colors)], label=f"device {i}") for i in range(devices)]
+    markers = [ax.markers(colors[i % len(colors)]) for i in range(devices)]
+    if devices > 1:
+        ax.legend()
+    image = None
+    if waterfall:
+        wax = plot.add_axes("Waterfall", "Pixel Index", "Frames Ago", (waterfall, 0), height=1)
+        wax.set_xlim(0, NPIXELS - 1)
+        image = wax.image((0, NPIXELS - 1, waterfall, 0))
+    plot.update_layout()
+    return lines, markers, image
+
+
+def settle(app, plot):
+    """等尺寸稳定并完成一次整图重绘，之后的刷新只重绘动态对象"""
+    while plot.widget.resizing:
+        app.processEvents()
+        time.sleep(0.01)
+    plot.update_layout()
+    app.processEvents()
+    plot.render()
+    app.processEvents()
+
+
+def startup(name):
+    """在新进程中运行：打印第一帧画出的时刻（墙钟）和创建后端到第一帧的耗时"""
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    start = time.perf_counter()
+    plot = create_backend(name)
+    lines, _, _ = demo_plot(plot)
+    lines[0].set_data(np.arange(128), np.zeros(128))
+    plot.widget.resize(800, 500)
+    plot.widget.show()
+    plot.update_layout()
+    app.processEvents()
+    plot.render()
+    plot.widget.repaint()
+    print(f"{time.time():.6f} {(time.perf_counter() - start) * 1000:.1f}")
+
+
+def bench(names, frames, devices, waterfall, size):
+    from PySide6.QtWidgets import QApplication
+    from tsl1401.replay import SyntheticSpectrum
+    from tsl1401.spectral import find_peaks
+    from tsl1401.waterfall import Waterfall, make_lut
+
+    app = QApplication.instance() or QApplication([])
+    source = SyntheticSpectrum(seed=0)
+    spectra = source.read(64).astype(np.float64)
+    peaks = [find_peaks(spectrum) for spectrum in spectra]
+    x = np.arange(spectra.shape[1])
+    print(f"{size[0]}x{size[1]} px, {devices} trace(s)" + (f", waterfall {waterfall} rows" if waterfall else ""))
+    print(f"{'backend':>10}  {'startup ms':>10}  {'backend ms':>10}  {'redraw p50 ms':>13}  {'p95 ms':>7}  {'max Hz':>7}")
+    for name in names:
+        # 启动耗时在新进程中测量（从启动解释器到画出第一帧），避免已导入的模块影响结果
+        env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+        launched = time.time()
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), 'startup', '--backends', name],
+                                capture_output=True, text=True, env=env)
+        first_frame, backend_ms = (float(v) for v in result.stdout.split()[-2:])
+        startup_ms = (first_frame - launched) * 1000
+
+        plot = create_backend(name)
+        lines, markers, image = demo_plot(plot, devices, waterfall)
+        history = Waterfall(waterfall, spectra.shape[1], make_lut(plot.colormap('viridis'))) if waterfall else None
+        plot.widget.resize(*size)
+        plot.widget.show()
+        settle(app, plot)
+        times = np.empty(frames)
+        for i in range(frames):
+            t = time.perf_counter()
+            for j, (line, marker) in enumerate(zip(lines, markers)):
+                k = (i + 7 * j) % len(spectra)
+                line.set_data(x, spectra[k])
+                marker.set_data(peaks[k].position, peaks[k].height)
+            if history is not None:
+                history.add(spectra[i % len(spectra):i % len(spectra) + 1].astype(np.uint16))
+                image.set_data(history.view(max(1, plot.axes[-1].pixel_height())))
+            plot.render()
+            app.processEvents()
+            times[i] = time.perf_counter() - t
+        plot.widget.close()
+        p50, p95 = np.percentile(times, [50, 95]) * 1000
+        print(f"{name:>10}  {startup_ms:>10.1f}  {backend_ms:>10.1f}  {p50:>13.2f}  {p95:>7.2f}  {1000 / p50:>7.0f}")
+
+
+def resize_check(names, steps, interval, max_draws):
+    """模拟拖动：每 interval 毫秒改变一次尺寸并刷新曲线，共 steps 次，尺寸稳定后统计整图重绘次数
+
+    尺寸稳定时像窗口一样重新排版（resizeSettled -> update_layout）。返回是否所有后端都不超过 max_draws。
+    """
+    from PySide6.QtWidgets import QApplication
+    from tsl1401.replay import SyntheticSpectrum
+
+    app = QApplication.instance() or QApplication([])
+    spectra = SyntheticSpectrum(seed=0).read(steps).astype(np.float64)
+    x = np.arange(spectra.shape[1])
+    print(f"{steps} resize steps every {interval} ms, at most {max_draws} full redraw(s) allowed")
+    print(f"{'backend':>10}  {'full draws':>10}  {'drag ms':>8}  {'settle ms':>9}  result")
+    passed = True
+    for name in names:
+        plot = create_backend(name)
+        lines, _, _ = demo_plot(plot)
+        plot.widget.resizeSettled.connect(plot.update_layout)
+        plot.widget.resize(800, 500)
+        plot.widget.show()
+        settle(app, plot)
+        plot.full_draws = 0
+        start = time.perf_counter()
+        for i in range(steps):
+            plot.widget.resize(800 + 10 * i, 500 + 6 * i)
+            lines[0].set_data(x, spectra[i])
+            plot.render()
+            app.processEvents()
+            time.sleep(interval / 1000)
+        dragged = time.perf_counter()
+        settle(app, plot)
+        settled = time.perf_counter()
+        plot.widget.close()
+        ok = plot.full_draws <= max_draws
+        passed = passed and ok
+        print(f"{name:>10}  {plot.full_draws:>10}  {(dragged - start) * 1000:>8.0f}  "
+              f"{(settled - dragged) * 1000:>9.0f}  {'ok' if ok else 'FAIL'}")
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare plot backends: redraw time and startup time")
+    parser.add_argument('mode', nargs='?', default='bench', choices=('bench', 'startup', 'resize'))
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--frames', type=int, default=300, help="redraws to time per backend")
+    parser.add_argument('--devices', type=int, default=1, help="number of traces")
+    parser.add_argument('--waterfall', type=int, default=0, metavar='FRAMES', help="also draw a waterfall")
+    parser.add_argument('--size', type=int, nargs=2, default=[1000, 800], metavar=('W', 'H'),
+                        help="plot size in pixels")
+    parser.add_argument('--steps', type=int, default=30, help="resize: size changes in the simulated drag")
+    parser.add_argument('--interval', type=float, default=16.0, help="resize: milliseconds between size changes")
+    parser.add_argument('--max-draws', type=int, default=1, help="resize: full redraws allowed after the drag")
+    args = parser.parse_args()
+    if args.mode == 'startup':
+        startup(args.backends[0])
+    elif args.mode == 'resize':
+        sys.exit(0 if resize_check(args.backends, args.steps, args.interval, args.max_draws) else 1)
+    else:
+        bench(args.backends, args.frames, args.devices, args.waterfall, args.size)
@@ -0,0 +1,216 @@
+"""matplotlib 绘图后端：Figure + FigureCanvasQTAgg，静态部分缓存为背景，曲线用 blit 重绘
+
+由 plotting.create_backend('matplotlib') 按需导入。
+"""
+import numpy as np
+import matplotlib.ticker as ticker
+from matplotlib import colormaps
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+from PySide6.QtCore import QTimer, Signal
+from PySide6.QtGui import QImage, QPainter
+
+from plotting import FIGURE_DPI, SPINE_COLOR
+
+
+# 绘图画布：拖动调整大小期间推迟重绘
+class SpectrumCanvas(FigureCanvas):
+    resizeSettled = Signal()
+
+    RESIZE_DELAY = 150  # 尺寸停止变化多久后重绘(毫秒)
+
+    def __init__(self, figure):
+        super().__init__(figure)
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(self.RESIZE_DELAY)
+        self.resize_timer.timeout.connect(self.finish_resize)
+
+    @property
+    def resizing(self):
+        return self.resize_timer.isActive()
+
+    def resizeEvent(self, event):
+        self.resize_timer.start()
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        if not self.resizing or not hasattr(self, 'renderer'):
+            super().paintEvent(event)
+            return
+        # 拖动期间把上一次的渲染结果缩放显示，不重新渲染
+        buf = np.asarray(self.renderer.buffer_rgba())
+        height, width = buf.shape[:2]
+        image = QImage(buf.data, width, height, width * 4, QImage.Format_RGBA8888)
+        painter = QPainter(self)
+        painter.eraseRect(self.rect())
+        painter.drawImage(self.rect(), image)
+        painter.end()
+
+    def draw_idle(self):
+        # 尺寸稳定后统一重绘一次
+        if self.resizing:
+            return
+        super().draw_idle()
+
+    def finish_resize(self):
+        """尺寸稳定：先让窗口更新布局，再整图重绘"""
+        self.resizeSettled.emit()
+        self.draw_idle()
+
+
+class MatplotlibBackend:
+    """matplotlib Figure + FigureCanvasQTAgg，曲线用 blit 重绘"""
+
+    name = 'matplotlib'
+
+    def __init__(self):
+        self.figure = Figure(figsize=(8, 5), dpi=FIGURE_DPI)
+        self.figure.patch.set_alpha(0.0)  # 背景透明
+        self.widget = SpectrumCanvas(self.figure)
+        self.widget.mpl_connect('draw_event', self.on_draw)
+        self.axes = []
+        self.animated = []  # (坐标轴, 动态对象)，图像在前
+        self.background = None  # 缓存的静态图表背景（用于 blit）
+        self.font_size = 14
+        self.layout_cache = {}
+        self.full_draws = 0  # 整图重绘次数（调整大小检查用）
+
+    def colormap(self, name):
+        return colormaps[name]
+
+    def clear(self):
+        self.figure.clear()
+        self.axes = []
+        self.animated = []
+        self.background = None
+
+    def add_axes(self, title, xlabel, ylabel, ylim, pixel_ticks=True, height=1):
+        """在已有坐标轴下方加一个坐标轴，height 为相对高度"""
+        self.axes.append(MatplotlibAxes(self, title, xlabel, ylabel, ylim, pixel_ticks, height))
+        heights = [ax.height for ax in self.axes]
+        grid = self.figure.add_gridspec(len(heights), 1, height_ratios=heights)
+        for i, ax in enumerate(self.axes):
+            ax.place(grid[i])
+        return self.axes[-1]
+
+    def set_font_size(self, font_size):
+        self.font_size = font_size
+        for ax in self.axes:
+            ax.style(font_size)
+
+    def update_layout(self):
+        """按 (字号, 画布尺寸, 坐标轴数) 缓存 tight_layout 的结果，命中时直接复用"""
+        key = (self.font_size, self.widget.width(), self.widget.height(), len(self.axes))
+        params = self.layout_cache.get(key)
+        if params is None:
+            self.figure.tight_layout()
+            sp = self.figure.subplotpars
+            params = self.layout_cache[key] = dict(left=sp.left, bottom=sp.bottom, right=sp.right, top=sp.top,
+                                                   hspace=sp.hspace)
+        else:
+            self.figure.subplots_adjust(**params)
+        self.widget.draw_idle()
+
+    def invalidate(self):
+        """静态部分（坐标范围、标题）已变化，下次刷新整图重绘"""
+        self.background = None
+
+    def draw_animated(self):
+        for ax, artist in self.animated:
+            ax.draw_artist(artist)
+
+    def on_draw(self, event):
+        """整图重绘后缓存静态背景，并在其上画出动态对象"""
+        self.full_draws += 1
+        self.background = self.widget.copy_from_bbox(self.figure.bbox)
+        self.draw_animated()
+
+    def render(self):
+        """只重绘动态对象"""
+        if self.widget.resizing:
+            return  # 尺寸稳定后的整图重绘会画出最新数据
+        if self.background is None:
+            self.widget.draw()
+            return
+        self.widget.restore_region(self.background)
+        self.draw_animated()
+        self.widget.blit(self.figure.bbox)
+
+
+class MatplotlibAxes:
+    def __init__(self, backend, title, xlabel, ylabel, ylim, pixel_ticks, height):
+        self.backend = backend
+        self.labels = (title, xlabel, ylabel)
+        self.ylim = ylim
+        self.pixel_ticks = pixel_ticks
+        self.height = height
+        self.ax = None
+
+    def place(self, spec):
+        """放到网格中的位置，新建时设置样式"""
+        if self.ax is not None:
+            self.ax.set_subplotspec(spec)
+            return
+        self.ax = ax = self.backend.figure.add_subplot(spec)
+        title, xlabel, ylabel = self.labels
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        # 设置网格线样式
+        ax.grid(True, linestyle='-', alpha=0.2)
+        for side in ('bottom', 'top', 'right', 'left'):
+            ax.spines[side].set_color(SPINE_COLOR)
+        # 细化X轴刻度
+        if self.pixel_ticks:
+            ax.xaxis.set_major_locator(ticker.MultipleLocator(10))
+            ax.xaxis.set_minor_locator(ticker.MultipleLocator(5))
+        else:
+            ax.xaxis.set_minor_locator(ticker.AutoMinorLocator())
+        ax.set_ylim(*self.ylim)
+        ax.patch.set_alpha(0.0)
+        self.style(self.backend.font_size)
+
+    def style(self, font_size):
+        """设置图表字体为Arial"""
+        ax = self.ax
+        ax.title.set_fontsize(font_size + 2)
+        ax.xaxis.label.set_fontsize(font_size + 1)
+        ax.yaxis.label.set_fontsize(font_size + 1)
+        for text in (ax.title, ax.xaxis.label, ax.yaxis.label):
+            text.set_fontfamily('Arial')
+        ax.tick_params(axis='both', which='major', labelsize=font_size - 1)
+        legend = ax.get_legend()
+        if legend is not None:
+            for text in legend.get_texts():
+                text.set_fontsize(font_size - 2)
+
+    def set_xlim(self, lo, hi):
+        self.ax.set_xlim(lo, hi)
+
+    def set_title(self, title):
+        self.ax.set_title(title, fontname='Arial', fontsize=self.backend.font_size + 2)
+
+    def line(self, color, label=None):
+        line, = self.ax.plot([], [], color, linewidth=1.8, alpha=0.8, animated=True, label=label)
+        self.backend.animated.append((self.ax, line))
+        return line
+
+    def markers(self, color):
+        markers, = self.ax.plot([], [], 'v', color=color, markersize=7, animated=True)
+        self.backend.animated.append((self.ax, markers))
+        return markers
+
+    def image(self, extent):
+        """RGBA 图像，origin 在下方，extent = (左, 右, 下, 上)"""
+        image = self.ax.imshow(np.zeros((1, 1, 4), np.uint8), aspect='auto', interpolation='nearest',
+                               origin='lower', extent=extent, animated=True)
+        self.ax.set_ylim(extent[2], extent[3])
+        self.backend.animated.insert(0, (self.ax, image))
+        return image
+
+    def legend(self):
+        self.ax.legend(loc='upper right', fontsize=self.backend.font_size - 2)
+
+    def pixel_height(self):
+        return int(self.ax.bbox.height)
@@ -0,0 +1,4 @@
+"""TSL1401 采集核心：串口协议、解析、校正、统计、录制与回放，不依赖 Qt 和 matplotlib
+
+图形界面在仓库根目录的 main.py；各子模块按需导入，导入本包本身不加载任何子模块。
+"""
@@ -0,0 +1,42 @@
+"""命令行入口：python -m tsl1401 <命令> [参数]
+
+只导入所选命令的模块，不加载 Qt 和 matplotlib。
+"""
+import argparse
+import importlib
+import sys
+
+# 命令 -> (模块, 入口函数, 说明)
+COMMANDS = {
+    'ports': ('discovery', 'main', "find serial ports running the TSL1401 firmware"),
+    'record': ('acquisition', 'main', "record frames from a serial port or a replay source"),
+    'export': ('recording', 'main', "export a recording to CSV or NPZ"),
+    'serve': ('server', 'main', "serve live frames to TCP / Unix socket subscribers"),
+    'subscribe': ('server', 'subscribe_main', "subscribe to a frame server and report rate and latency"),
+    'parse': ('reader', 'main', "fuzz or benchmark the streaming frame parser"),
+    'replay': ('replay', 'main', "benchmark the host pipeline with replayed or synthetic frames"),
+    'spectral': ('spectral', 'main', "wavelength calibration tools"),
+    'waterfall': ('waterfall', 'main', "benchmark waterfall render cost versus history depth"),
+    'trigger': ('trigger', 'main', "benchmark triggered capture on synthetic flashes"),
+    'exposure': ('exposure', 'main', "auto-exposure step response on an emulated device"),
+    'library': ('library', 'main', "reference spectrum library: add, match and benchmark"),
+    'pipeline': ('pipeline', 'main', "benchmark the processing-stage pipeline versus worker processes"),
+    'fake': ('fakedevice', 'main', "emulate devices on pseudo terminals and benchmark the GUI"),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog='python -m tsl1401', description="Headless TSL1401 tools",
+                                     epilog='\n'.join(f"  {name:<10}{help}" for name, (_, _, help) in COMMANDS.items()),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=list(COMMANDS), metavar='command', help="one of: " + ", ".join(COMMANDS))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="arguments of the command (see <command> --help)")
+    args = parser.parse_args(argv[:1])
+    module, function, _ = COMMANDS[args.command]
+    entry = getattr(importlib.import_module('.' + module, __package__), function)
+    return entry(argv[1:], prog=f"python -m tsl1401 {args.command}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""采集线程：串口批量读取 -> 解析 -> 环形缓冲区 -> 录制/处理链（不依赖 Qt）
+
+界面和命令行共用同一个采集线程，新帧通过回调通知，回调在采集线程中执行。
+不打开界面录制：
+
+    python -m tsl1401 record --port /dev/ttyUSB0 --frames 10000
+    python -m tsl1401 record --replay synthetic --duration 5
+    python -m tsl1401 record --port /dev/ttyUSB0 --duration 3600 --trigger edge:600@60:70
+    python -m tsl1401 record --replay synthetic --speed 0 --frames 100000 --pipeline deconvolve:30 --workers 4 --report
+"""
+import argparse
+import os
+import threading
+import time
+
+import serial
+
+from . import protocol
+from .calibration import Calibration
+from .channel import Channel
+from .exposure import AutoExposure, describe_setting
+from .metrics import Metrics, MetricsExporter
+from .pipeline import Pipeline, parse_pipeline
+from .reader import FrameReader
+from .recording import EXTENSION, RecordingWriter
+from .replay import Pacer, encode_frames, open_source
+from .ringbuffer import FrameRing
+from .timing import StageTimer, format_report
+from .trigger import DEFAULT_POST, DEFAULT_PRE, DEFAULT_WINDOW, TRIGGER_DIR, EventWriter, TriggerCapture, parse_trigger
+
+
+class SerialAcquisition(threading.Thread):
+    """串口采集线程
+
+    帧存放在环形缓冲区，on_frames(start, stop) 只通知序号区间；
+    设置了 channel 时在本线程中直接处理新帧。
+    """
+
+    READ_TIMEOUT = 0.1  # 无数据时阻塞等待的时间(秒)
+
+    def __init__(self, port, wire_format=protocol.WIRE_PACKED10, bulk=True,
+                 ring_capacity=1024, max_pending=1, fast=False, exposure_us=0, auto_exposure=None):
+        super().__init__(daemon=True)
+        self.port = port
+        self.running = True
+        self.capturing = False
+        self.wire_format = wire_format  # 请求的输出格式
+        self.fast = fast  # 请求固件高速模式（版本 2 起支持）
+        self.exposure_us = exposure_us  # 请求的曝光时间，0 为积分时间等于帧周期
+        self.auto_exposure = auto_exposure  # 设置后按新帧自动调整积分时间（exposure.AutoExposure）
+        self.bulk = bulk  # True: 批量读取；False: 逐行轮询（旧方式）
+        self.reader = FrameReader()
+
+        self.ring = FrameRing(ring_capacity)
+        self.max_pending = max_pending  # 最多积压的未处理通知数
+        self.pending = 0
+        self.read_cursor = 0  # 消费方已取走的帧序号
+        self.dropped = 0  # 未被取走就被覆盖的帧数
+        self.coalesced = 0  # 合并到后续通知中的帧数
+        self.notify_lock = threading.Lock()
+        self.recorder = None  # 录制中时为 RecordingWriter
+        self.recording_error = None  # 上次录制的写入错误（OSError），没有错误时为 None
+        self.server = None  # 实时分发时为 server.FrameServer
+        self.notify_time = 0.0  # 最早一个未处理通知的发出时间
+        self.channel = None  # 设置后在本线程中直接处理新帧（channel.Channel）
+        self.on_frames = None  # 新帧回调 (start, stop)
+        self.on_averaging_done = None  # 处理链的暗场/参考帧采够时的回调
+        self.read_time = None  # 最近一次读到数据的时间，随帧交给处理链
+        self.instrument = False  # True 时另外统计串口读取耗时（多一次 in_waiting 查询）
+        self.timings = StageTimer(('read', 'decode', 'publish', 'process', 'exposure', 'notify'))
+
+    @property
+    def active_format(self):
+        return self.reader.active_format
+
+    @property
+    def firmware(self):
+        """固件版本与功能（protocol.FirmwareInfo），版本握手在开始采集时进行"""
+        return self.reader.firmware
+
+    def run(self):
+        try:
+            self.ser = serial.Serial(self.port, protocol.BAUDRATE, timeout=self.READ_TIMEOUT)
+            if self.capturing:
+                self.send_start()  # 打开串口前已经要求开始采集
+            else:
+                self.ser.write(protocol.VERSION_COMMAND)
+            while self.running:
+                if self.bulk:
+                    # 一次读完所有可用数据，无数据时在串口上阻塞
+                    if self.instrument:
+                        if not self.timed_fill():
+                            continue
+                    elif not self.reader.fill(self.ser):
+                        continue
+                    self.read_time = time.perf_counter()
+                    if not self.capturing:
+                        self.reader.decode()  # 只处理命令回复，丢弃停止前还在路上的帧
+                        continue
+                elif self.ser.in_waiting and self.capturing:
+                    if self.active_format == protocol.WIRE_ASCII:
+                        self.reader.feed(self.ser.readline())
+                    else:
+                        self.reader.feed(self.ser.read(self.ser.in_waiting))
+                    self.read_time = time.perf_counter()
+                else:
+                    continue
+
+                self.decode_and_publish()
+        except serial.SerialException as e:
+            print(f"Serial error: {e}")
+        finally:
+            if hasattr(self, 'ser') and self.ser.is_open:
+                self.ser.close()
+
+    def timed_fill(self):
+        """批量读取并记录耗时；只统计已有数据时的读取，不把等待数据的阻塞时间算进去"""
+        waiting = self.ser.in_waiting
+        t = time.perf_counter()
+        got = self.reader.fill(self.ser)
+        if waiting:
+            self.timings.since('read', t)
+        return got
+
+    def decode_and_publish(self):
+        """解析接收缓冲区并发布新帧"""
+        t = time.perf_counter()
+        frames = self.reader.decode()
+        self.timings.since('decode', t)
+        if len(frames):
+            t = time.perf_counter()
+            self.publish(frames)
+            self.timings.since('publish', t)
+            if self.channel is not None:
+                # 在采集线程中处理，吞吐量随设备数增加而不受界面线程限制
+                t = time.perf_counter()
+                if self.channel.process(frames, self.read_time) and self.on_averaging_done:
+                    self.on_averaging_done()
+                self.timings.since('process', t)
+            if self.auto_exposure is not None and self.capturing:
+                t = time.perf_counter()
+                command = self.auto_exposure.update(frames, self.read_time, self.reader.device_state)
+                if command is not None:
+                    self.send_command(command)
+                self.timings.since('exposure', t)
+
+    def publish(self, frames):
+        """写入环形缓冲区、录制文件和分发服务器并通知消费方，已有未处理通知时只合并计数"""
+        start, stop = self.ring.write(frames)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(frames, start)
+        server = self.server
+        if server is not None:
+            server.write(frames, start)
+        if self.on_frames is None:
+            return
+        with self.notify_lock:
+            if self.pending >= self.max_pending:
+                self.coalesced += stop - start
+                return
+            if not self.pending:
+                self.notify_time = time.perf_counter()
+            self.pending += 1
+        self.on_frames(start, stop)
+
+    def take_frames(self):
+        """取出上次以来的所有新帧，并清除待处理通知"""
+        with self.notify_lock:
+            if self.pending:
+                self.timings.since('notify', self.notify_time)
+            self.pending = 0
+            block, start = self.ring.read(self.read_cursor)
+            self.dropped += start - self.read_cursor
+            self.read_cursor = start + len(block)
+        return block
+
+    def start_recording(self, path):
+        """开始把收到的帧写入 path"""
+        recorder = RecordingWriter(path)
+        recorder.start()
+        self.recording_error = None
+        self.recorder = recorder
+
+    def stop_recording(self):
+        """停止录制，写完剩余数据，返回写入的帧数；写入出错时记在 recording_error"""
+        recorder, self.recorder = self.recorder, None
+        if recorder is None:
+            return 0
+        recorder.close()
+        self.recording_error = recorder.error
+        return recorder.frames_written
+
+    def stop(self):
+        """结束线程并停止录制，返回录制的帧数"""
+        self.running = False
+        if self.is_alive():
+            self.join(1.0)
+        return self.stop_recording()
+
+    def start_capture(self):
+        """开始采集数据，串口尚未打开时在打开后发送命令"""
+        # 先进入采集状态，避免固件的格式确认回复被当作空闲数据丢弃
+        self.reader.active_format = protocol.WIRE_ASCII
+        if self.auto_exposure is not None:
+            self.auto_exposure.restart()
+        self.capturing = True
+        if hasattr(self, 'ser') and self.ser.is_open:
+            self.send_start()
+
+    def send_start(self):
+        # 查询版本并协商输出格式和高速模式，旧固件会忽略这些命令并继续发送 ASCII
+        self.ser.write(protocol.VERSION_COMMAND)
+        self.ser.write(protocol.mode_command(self.wire_format))
+        self.ser.write(protocol.fast_command(self.fast))
+        self.ser.write(protocol.exposure_command(self.exposure_us))
+        self.ser.write('S'.encode())
+
+    def send_command(self, command):
+        """串口已打开时发送命令，返回是否已发送"""
+        if hasattr(self, 'ser') and self.ser.is_open:
+            self.ser.write(command)
+            return True
+        return False
+
+    def set_exposure(self, us):
+        """设置曝光时间，高速模式下生效；之后开始采集时也会使用该值"""
+        self.exposure_us = us
+        self.send_command(protocol.exposure_command(us))
+
+    def stop_capture(self):
+        """停止采集数据"""
+        self.capturing = False
+        if hasattr(self, 'ser') and self.ser.is_open:
+            self.ser.write('X'.encode())
+
+
+class ReplayAcquisition(SerialAcquisition):
+    """离线回放：接口与 SerialAcquisition 相同，数据来自录制文件或合成光谱"""
+
+    def __init__(self, source, speed=1.0, wire_format=protocol.WIRE_PACKED10, **kwargs):
+        super().__init__(None, wire_format, **kwargs)
+        self.source = source
+        self.pacer = Pacer(source.rate, speed)
+        # 帧按固件格式编码后走与串口相同的解析流程
+        self.reader.active_format = wire_format
+
+    @property
+    def fps(self):
+        """实际回放帧率"""
+        return self.pacer.fps
+
+    def run(self):
+        seq = 0
+        while self.running:
+            if not self.capturing:
+                time.sleep(0.01)
+                continue
+            n = self.pacer.due()
+            if n <= 0:
+                self.pacer.wait()
+                continue
+            frames = self.source.read(n)
+            if not len(frames):
+                break  # 非循环回放结束
+            self.reader.feed(encode_frames(frames, seq, self.wire_format))
+            self.read_time = time.perf_counter()
+            seq += len(frames)
+            self.pacer.advance(len(frames))
+            self.decode_and_publish()
+
+    def start_capture(self):
+        self.pacer.restart()
+        self.capturing = True
+
+    def stop_capture(self):
+        self.capturing = False
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Record TSL1401 frames without the GUI")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--port', help="serial port, e.g. /dev/ttyUSB0 or COM3")
+    group.add_argument('--replay', metavar='SOURCE', help="recording file or 'synthetic' instead of a device")
+    parser.add_argument('--frames', type=int, help="stop after at least this many frames")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    parser.add_argument('-o', '--output', help="recording file (default recordings/spectrum_<time>.tslrec), "
+                                                f"or with --trigger the event directory (default {TRIGGER_DIR})")
+    parser.add_argument('--format', default=protocol.WIRE_PACKED10, choices=list(protocol.MODE_ARGS),
+                        help="wire format to request from the firmware")
+    parser.add_argument('--calibration', help="dark/flat calibration file for the statistics")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed multiplier, 0 = as fast as possible")
+    parser.add_argument('--fast', action='store_true',
+                        help="firmware high-speed mode (direct port I/O, fast ADC, buffered frames; firmware v2+)")
+    parser.add_argument('--exposure', type=int, default=0, metavar='US',
+                        help="integration time in microseconds in high-speed mode, 0 = frame period")
+    parser.add_argument('--trigger', metavar='SPEC',
+                        help="only save windows around events: <level|edge|deviation>:<threshold>[@pixel|@start:stop], "
+                             "e.g. edge:600@64 (signal is the pixel, the pixel range sum or the frame maximum)")
+    parser.add_argument('--pre', type=int, default=DEFAULT_PRE, help="frames saved before each trigger")
+    parser.add_argument('--post', type=int, default=DEFAULT_POST, help="frames saved from each trigger on")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="rolling baseline frames for 'deviation'")
+    parser.add_argument('--holdoff', type=int, help="frames after a trigger that cannot trigger again (default --post)")
+    parser.add_argument('--auto-exposure', action='store_true',
+                        help="adjust the frame delay (or the exposure time in --fast mode) to keep the p99 level "
+                             "near --target without saturating")
+    parser.add_argument('--target', type=float, default=0.7, help="auto-exposure target as a fraction of full scale")
+    parser.add_argument('--pipeline', metavar='SPEC',
+                        help="processing stages applied before the statistics, e.g. median:5,deconvolve:30,baseline:31")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="worker processes for the heavy pipeline stages, 0 = run them in the acquisition thread")
+    parser.add_argument('--report', action='store_true', help="print per-stage timings at the end")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="periodically write metrics to FILE (.json = JSON, otherwise Prometheus text)")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="metrics export interval (s)")
+    args = parser.parse_args(argv)
+    if args.frames is None and args.duration is None:
+        parser.error("give --frames and/or --duration")
+    capture = None
+    if args.trigger:
+        try:
+            trigger = parse_trigger(args.trigger, args.window, args.holdoff)
+        except ValueError as e:
+            parser.error(str(e))
+        capture = TriggerCapture(trigger, args.pre, args.post, writer=EventWriter(args.output or TRIGGER_DIR))
+        capture.writer.start()
+    pipeline = None
+    if args.pipeline:
+        try:
+            stages = parse_pipeline(args.pipeline)
+        except ValueError as e:
+            parser.error(str(e))
+        # 回放时等待流水线（测吞吐量），串口采集时宁可跳过帧也不能让串口积压；
+        # 触发模式只处理事件窗口，不需要进程池
+        pipeline = Pipeline(stages, args.workers if capture is None else 0, wait=bool(args.replay))
+
+    output = args.output or os.path.join('recordings', time.strftime("spectrum_%Y%m%d_%H%M%S") + EXTENSION)
+    if args.replay:
+        acquisition = ReplayAcquisition(open_source(args.replay, loop=True), args.speed, args.format)
+    else:
+        acquisition = SerialAcquisition(args.port, args.format, fast=args.fast, exposure_us=args.exposure,
+                                        auto_exposure=AutoExposure(args.target) if args.auto_exposure else None)
+    calibration = Calibration.load(args.calibration) if args.calibration else Calibration()
+    channel = acquisition.channel = Channel(args.port or args.replay, calibration, trigger=capture, pipeline=pipeline)
+    exporter = None
+    if args.metrics:
+        acquisition.instrument = True
+        metrics = Metrics()
+        metrics.add_source(args.port or args.replay, acquisition)
+        exporter = MetricsExporter(metrics, args.metrics, interval=args.metrics_interval)
+        exporter.start()
+
+    if capture is None:
+        acquisition.start_recording(output)
+    acquisition.start()
+    acquisition.start_capture()
+    start = last = time.perf_counter()
+    try:
+        while acquisition.is_alive():
+            time.sleep(0.05)
+            now = time.perf_counter()
+            if args.frames and acquisition.ring.count >= args.frames:
+                break
+            if args.duration and now - start >= args.duration:
+                break
+            if now - last >= 1.0:
+                last = now
+                noise, snr = channel.noise()
+                events = f"  {capture.fired} triggers" if capture is not None else ""
+                if acquisition.auto_exposure is not None:
+                    events += f"  {describe_setting(acquisition.reader.device_state)}"
+                print(f"{channel.frames:>9} frames  {channel.frames / (now - start):8.1f} frames/s  "
+                      f"noise {noise:6.2f}  SNR {snr:6.1f}{events}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    acquisition.stop_capture()
+    elapsed = time.perf_counter() - start
+    written = acquisition.stop()
+    channel.close()
+    if exporter is not None:
+        exporter.close()
+    if capture is not None:
+        writer = capture.writer
+        saved = capture.close()
+        dropped = f", {writer.dropped} dropped" if writer.dropped else ""
+        print(f"captured {channel.frames} frames in {elapsed:.1f} s ({channel.frames / elapsed:.1f} frames/s), "
+              f"{capture.fired} triggers ({capture.trigger.describe()}), saved {saved} events{dropped} to {writer.directory}")
+    else:
+        print(f"recorded {written} frames in {elapsed:.1f} s ({written / elapsed:.1f} frames/s) to {output}")
+    if args.port:
+        firmware = acquisition.firmware
+        state = acquisition.reader.device_state
+        print(f"firmware version {firmware.version} ({', '.join(sorted(firmware.features)) or 'no extensions'}), "
+              f"{acquisition.active_format}, fast mode {'on' if state.get('fast') else 'off'}")
+    if pipeline is not None:
+        skipped = f", {pipeline.dropped} frames skipped while busy" if pipeline.dropped else ""
+        print(f"pipeline {pipeline.describe()}{skipped}")
+    if args.report:
+        print(format_report(acquisition.timings, *([pipeline.timings] if pipeline is not None else [])))
+    if acquisition.recording_error is not None:
+        print(f"recording to {output} failed: {acquisition.recording_error}")
+        return 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""主机端帧累加：用帧率换信噪比（不依赖 Qt）"""
+import numpy as np
+
+from .protocol import NPIXELS
+
+AVERAGE_NONE = 'none'
+AVERAGE_BOXCAR = 'boxcar'  # 最近 N 帧的滑动平均
+AVERAGE_EMA = 'ema'  # 指数滑动平均，平滑程度相当于 N 帧
+AVERAGE_MEDIAN = 'median'  # 最近 N 帧的逐像素中值，剔除偶发的异常帧
+AVERAGE_MODES = (AVERAGE_NONE, AVERAGE_BOXCAR, AVERAGE_EMA, AVERAGE_MEDIAN)
+
+
+class FrameIntegrator:
+    """把连续的帧累加为一条积分光谱
+
+    最近 N 帧存放在预分配的环形数组中。boxcar 维护滑动和，每帧只做一次加减，
+    与 N 无关；每绕环一圈重新求和一次，消除浮点累积误差。
+    ema 对整个帧块用闭式权重一次更新。median 只在取结果时计算，
+    因此逐帧开销同样只是写入环形数组。
+    """
+
+    def __init__(self, mode=AVERAGE_NONE, n=10, npixels=NPIXELS):
+        if mode not in AVERAGE_MODES:
+            raise ValueError(f"unknown averaging mode '{mode}'")
+        self.mode = mode
+        self.n = max(int(n), 1)
+        self.npixels = npixels
+        self.alpha = 2.0 / (self.n + 1)  # 与 N 帧滑动平均等效的 EMA 系数
+        self.history = np.zeros((self.n, npixels))
+        self.total = np.zeros(npixels)
+        self.ema = np.zeros(npixels)
+        self.last = None
+        self.count = 0  # 环形数组中的有效帧数
+        self.index = 0  # 下一帧的写入位置
+
+    @property
+    def active(self):
+        return self.mode != AVERAGE_NONE
+
+    def reset(self):
+        self.history[:] = 0
+        self.total[:] = 0
+        self.ema[:] = 0
+        self.last = None
+        self.count = self.index = 0
+
+    def update_block(self, frames):
+        """加入 (k, npixels) 帧块"""
+        k = len(frames)
+        if not k:
+            return
+        self.last = frames[-1]
+        if self.mode == AVERAGE_EMA:
+            self.update_ema(frames)
+        elif self.mode != AVERAGE_NONE:
+            self.update_history(frames)
+
+    def update_ema(self, frames):
+        if not self.count:
+            self.ema[:] = frames[0]
+            frames = frames[1:]
+            self.count = 1
+        k = len(frames)
+        if k:
+            # y_k = (1-a)^k * y_0 + sum_j a * (1-a)^(k-1-j) * x_j
+            decay = 1.0 - self.alpha
+            weights = self.alpha * decay ** np.arange(k - 1, -1, -1)
+            self.ema *= decay ** k
+            self.ema += weights @ frames
+
+    def update_history(self, frames):
+        n, k = self.n, len(frames)
+        if k >= n:
+            # 整个窗口被替换
+            self.history[:] = frames[-n:]
+            self.total[:] = self.history.sum(axis=0)
+            self.count, self.index = n, 0
+            return
+        if self.index + k <= n:
+            rows = slice(self.index, self.index + k)  # 不跨越环尾时用切片，避免花式索引拷贝
+        else:
+            rows = (self.index + np.arange(k)) % n
+        if self.mode == AVERAGE_BOXCAR:
+            # 未填满的槽位为 0，减去它们不影响结果
+            self.total -= self.history[rows].sum(axis=0)
+            self.total += frames.sum(axis=0)
+        self.history[rows] = frames
+        self.count = min(self.count + k, n)
+        wrapped = self.index + k >= n
+        self.index = (self.index + k) % n
+        if wrapped and self.mode == AVERAGE_BOXCAR:
+            self.total[:] = self.history.sum(axis=0)
+
+    def result(self):
+        """当前的积分光谱，还没有数据时返回 None"""
+        if self.last is None:
+            return None
+        if self.mode == AVERAGE_NONE:
+            return self.last
+        if self.mode == AVERAGE_EMA:
+            return self.ema.copy()
+        if self.mode == AVERAGE_BOXCAR:
+            return self.total / self.count
+        return np.median(self.history[:self.count], axis=0)
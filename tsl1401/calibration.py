@@ -0,0 +1,138 @@
+"""暗场/平场校正与像素掩码（不依赖 Qt）"""
+import numpy as np
+
+from .protocol import NPIXELS
+
+# 默认只使用第 13 到第 125 个像素，两端像素受边缘效应影响
+DEFAULT_MASK = '12:125'
+
+
+def parse_mask(spec, npixels=NPIXELS):
+    """把 "12:125" 或 "0:5,12:125" 形式的像素范围解析为布尔掩码，范围左闭右开"""
+    mask = np.zeros(npixels, dtype=bool)
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if ':' in part:
+            start, stop = part.split(':', 1)
+            mask[slice(int(start) if start else None, int(stop) if stop else None)] = True
+        else:
+            mask[int(part)] = True
+    if not mask.any():
+        raise ValueError(f"pixel mask '{spec}' selects no pixels")
+    return mask
+
+
+class FrameAverager:
+    """累加 n 帧原始数据求平均，用于采集暗场和参考帧"""
+
+    def __init__(self, n, npixels=NPIXELS):
+        self.n = n
+        self.total = np.zeros(npixels)
+        self.count = 0
+
+    @property
+    def done(self):
+        return self.count >= self.n
+
+    def add(self, frames):
+        """加入帧块，超出 n 的部分忽略，返回是否已采够"""
+        frames = frames[:self.n - self.count]
+        self.total += frames.sum(axis=0)
+        self.count += len(frames)
+        return self.done
+
+    def mean(self):
+        return self.total / max(self.count, 1)
+
+
+class Calibration:
+    """逐像素校正：corrected = raw * gain - dark * gain，只保留掩码内的像素
+
+    gain 和 dark * gain 在设置校正数据时预先按掩码裁剪好，
+    每个帧块只需一次乘法和一次原地减法。
+    """
+
+    MIN_REFERENCE = 0.05  # 参考帧信号低于峰值的该比例时增益固定为 1
+
+    def __init__(self, mask=DEFAULT_MASK, dark=None, gain=None, npixels=NPIXELS):
+        self.npixels = npixels
+        self.dark = None if dark is None else np.asarray(dark, dtype=np.float64)
+        self.gain = None if gain is None else np.asarray(gain, dtype=np.float64)
+        self.set_mask(mask)
+
+    @property
+    def corrected(self):
+        """是否有暗场或平场数据"""
+        return self.dark is not None or self.gain is not None
+
+    def set_mask(self, mask):
+        """设置像素掩码，可以是范围字符串或布尔数组"""
+        if isinstance(mask, str):
+            mask = parse_mask(mask, self.npixels)
+        self.mask = np.asarray(mask, dtype=bool)
+        self.pixels = np.flatnonzero(self.mask)  # 保留像素的原始序号
+        # 连续范围用切片，得到视图而不是拷贝
+        lo, hi = self.pixels[0], self.pixels[-1] + 1
+        self.select = slice(lo, hi) if hi - lo == len(self.pixels) else self.pixels
+        self.precompute()
+
+    def set_dark(self, dark):
+        self.dark = None if dark is None else np.asarray(dark, dtype=np.float64)
+        self.precompute()
+
+    def set_gain(self, gain):
+        self.gain = None if gain is None else np.asarray(gain, dtype=np.float64)
+        self.precompute()
+
+    def set_reference(self, reference):
+        """由平均参考帧计算平场增益，使掩码内像素的平均增益为 1"""
+        signal = np.asarray(reference, dtype=np.float64)
+        if self.dark is not None:
+            signal = signal - self.dark
+        # 信号太弱的像素不做增益校正，避免把噪声放大
+        peak = signal[self.mask].max()
+        if peak <= 1.0:
+            raise ValueError("reference frame has no signal above the dark level")
+        valid = signal > self.MIN_REFERENCE * peak
+        gain = np.ones(self.npixels)
+        gain[valid] = signal[self.mask & valid].mean() / signal[valid]
+        self.set_gain(gain)
+
+    def clear(self):
+        self.dark = self.gain = None
+        self.precompute()
+
+    def precompute(self):
+        gain = np.ones(self.npixels) if self.gain is None else self.gain
+        dark = np.zeros(self.npixels) if self.dark is None else self.dark
+        self._gain = gain[self.select].astype(np.float32)
+        self._offset = (dark * gain)[self.select].astype(np.float32)
+
+    def apply(self, frames):
+        """校正单帧 (npixels,) 或帧块 (n, npixels)，返回掩码内像素
+
+        没有校正数据时只做掩码选择，返回原始 dtype；否则返回 float32。
+        """
+        selected = frames[..., self.select]
+        if not self.corrected:
+            return selected
+        out = np.multiply(selected, self._gain, dtype=np.float32)
+        out -= self._offset
+        return out
+
+    def save(self, path):
+        arrays = {'mask': self.mask}
+        if self.dark is not None:
+            arrays['dark'] = self.dark
+        if self.gain is not None:
+            arrays['gain'] = self.gain
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            mask = data['mask']
+            return cls(mask, data['dark'] if 'dark' in data else None,
+                       data['gain'] if 'gain' in data else None, len(mask))
@@ -0,0 +1,199 @@
+"""单个设备的处理链：暗场/平场校正 -> 处理阶段 -> 滚动统计 -> 帧累加 / 帧历史 / 触发（不依赖 Qt）
+
+每个设备各有一条处理链，在该设备的采集线程中运行，多个设备互不影响；
+流水线中重的阶段可以在工作进程中运行，结果由流水线的收集线程交回。
+界面线程只按刷新频率取走最新结果。所有公开方法都是线程安全的。
+"""
+import re
+import threading
+from collections import namedtuple
+
+from .averaging import AVERAGE_NONE, FrameIntegrator
+from .calibration import FrameAverager
+from .ringbuffer import FrameRing
+from .stats import RollingStats
+from .waterfall import to_history
+
+
+# data: 光谱；seq: 最新一帧之后的帧序号（已处理的总帧数）；
+# timestamp: 最新一帧从串口读出的时间（time.perf_counter），未知时为 None
+Spectrum = namedtuple('Spectrum', 'data seq timestamp')
+
+
+def safe_name(name):
+    """把设备名（如 /dev/ttyUSB0、COM3）转换为可用作文件名的字符串"""
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'device'
+
+
+class Channel:
+    """一个设备的校正数据、滚动统计与帧累加状态"""
+
+    def __init__(self, name, calibration, stats_window=100, average_mode=AVERAGE_NONE, average_n=10,
+                 history_depth=0, trigger=None, pipeline=None):
+        self.name = name
+        self.calibration = calibration
+        self.stats_window = stats_window
+        self.average_mode = average_mode
+        self.average_n = average_n
+        self.rolling = None  # 逐像素滚动统计，按处理后的帧长度创建
+        self.integrator = None  # 帧累加，按处理后的帧长度创建
+        self.history_depth = history_depth  # 瀑布图保留的帧数，0 为不保留
+        self.history = None  # 处理后帧的 uint16 环形缓冲区，按处理后的帧长度创建
+        self.trigger = trigger  # 触发模式时为 trigger.TriggerCapture，只显示触发事件
+        self.event = None  # 最近一次触发事件（trigger.TriggerEvent）
+        self.event_frame = None  # 处理后的触发帧
+        self.pipeline = pipeline  # 校正后的处理阶段（pipeline.Pipeline），None 为不处理
+        if pipeline is not None:
+            pipeline.on_output = self.deliver
+        self.generation = 0  # 校正或累加设置改变时加一，丢弃流水线中按旧设置处理的帧
+        self.averager = None  # 正在采集暗场/参考帧时为 FrameAverager
+        self.averaging = None  # 'dark' 或 'flat'
+        self.pending = False  # 有尚未绘制的新帧
+        self.frames = 0  # 已处理的总帧数
+        self.timestamp = None  # 最新一块帧的读取时间
+        self.lock = threading.Lock()
+
+    def process(self, frames, timestamp=None):
+        """处理一块原始帧，暗场/参考帧恰好在这一块采够时返回 True
+
+        timestamp 为这块帧从串口读出的时间，随结果一起交给界面，用于统计端到端延迟。
+        """
+        with self.lock:
+            averager = self.averager
+            done = averager is not None and not averager.done and averager.add(frames)
+            processed = self.process_frames(frames)
+            self.frames += len(frames)
+            if self.trigger is not None:
+                self.update_rolling(processed)
+                # 触发检测用原始帧，像素序号和阈值与传感器读数一致
+                for event in self.trigger.process(frames):
+                    self.show_event(event)
+                self.timestamp = timestamp
+                return done
+            if self.pipeline is None:
+                self.consume(processed, timestamp)
+                return done
+            generation = self.generation
+        # 流水线处理完后调用 deliver；不持有锁，等待槽位时不阻塞界面取结果
+        self.pipeline.put(processed, (timestamp, generation))
+        return done
+
+    def deliver(self, frames, tag):
+        """流水线的输出，用进程池时在流水线的收集线程中调用"""
+        timestamp, generation = tag
+        with self.lock:
+            if generation == self.generation:
+                self.consume(frames, timestamp)
+
+    def consume(self, frames, timestamp):
+        """处理后的帧进入滚动统计、帧累加和帧历史，调用方持有锁"""
+        self.update_rolling(frames)
+        self.update_integrator(frames)
+        if self.history_depth:
+            self.update_history(frames)
+        self.timestamp = timestamp
+        self.pending = True
+
+    def process_frames(self, data):
+        """数据处理：暗场/平场校正并只保留掩码内的像素，单帧或帧块均可"""
+        if data.shape[-1] == self.calibration.npixels:
+            return self.calibration.apply(data)
+        return data  # 如果数据长度不是128，则使用原始数据
+
+    def update_rolling(self, frames):
+        """把新帧加入滚动统计，帧长度变化时重新开始"""
+        npixels = frames.shape[-1]
+        if self.rolling is None or self.rolling.npixels != npixels:
+            self.rolling = RollingStats(self.stats_window, npixels)
+        self.rolling.update_block(frames)
+
+    def update_integrator(self, frames):
+        """把新帧加入帧累加，帧长度变化时重新开始"""
+        npixels = frames.shape[-1]
+        if self.integrator is None or self.integrator.npixels != npixels:
+            self.integrator = FrameIntegrator(self.average_mode, self.average_n, npixels)
+        self.integrator.update_block(frames)
+
+    def update_history(self, frames):
+        """以采集速率写入帧历史，帧长度变化时换一个新的缓冲区（读取方据此重建瀑布图）"""
+        npixels = frames.shape[-1]
+        if self.history is None or self.history.frames.shape[1] != npixels:
+            self.history = FrameRing(self.history_depth, npixels)
+        self.history.write(to_history(frames))
+
+    def show_event(self, event):
+        """触发事件交给界面：触发帧作为光谱，整段窗口写入帧历史（瀑布图）"""
+        window = self.process_frames(event.frames)
+        if self.pipeline is not None:
+            window = self.pipeline.apply(window)
+        self.event = event
+        self.event_frame = window[event.index]
+        if self.history_depth:
+            self.update_history(window)
+        self.pending = True
+
+    def take_result(self):
+        """取走上次以来的最新光谱（最新一帧、帧累加结果或触发帧）为 Spectrum，没有新数据时返回 None"""
+        with self.lock:
+            if not self.pending:
+                return None
+            if self.trigger is not None:
+                data = self.event_frame
+            elif self.integrator is not None:
+                data = self.integrator.result()
+            else:
+                return None
+            self.pending = False
+            return Spectrum(data, self.frames, self.timestamp)
+
+    def close(self):
+        """停止流水线的工作进程"""
+        if self.pipeline is not None:
+            self.pipeline.close()
+
+    def noise(self):
+        """(平均噪声, 峰值信噪比)，还没有数据时为 0"""
+        with self.lock:
+            if self.rolling is None:
+                return 0.0, 0.0
+            return self.rolling.mean_noise, self.rolling.peak_snr()
+
+    def set_averaging(self, mode, n):
+        with self.lock:
+            self.average_mode = mode
+            self.average_n = n
+            self.integrator = None
+            self.generation += 1
+
+    def reset(self):
+        """丢弃滚动统计和帧累加的历史数据"""
+        with self.lock:
+            self.rolling = None
+            self.integrator = None
+            self.generation += 1
+
+    def clear_calibration(self):
+        with self.lock:
+            self.calibration.clear()
+            self.rolling = self.integrator = None
+            self.generation += 1
+
+    def start_averaging(self, kind, n):
+        """开始采集 n 帧原始数据求平均，kind 为 'dark' 或 'flat'"""
+        with self.lock:
+            self.averager = FrameAverager(n, self.calibration.npixels)
+            self.averaging = kind
+
+    def finish_averaging(self):
+        """平均完成：更新校正数据，返回 kind；参考帧无效时抛出 ValueError"""
+        with self.lock:
+            kind, mean = self.averaging, self.averager.mean()
+            self.averager = self.averaging = None
+            if kind == 'dark':
+                self.calibration.set_dark(mean)
+            else:
+                self.calibration.set_reference(mean)
+            # 校正前后的数据不能混在同一统计窗口
+            self.rolling = self.integrator = None
+            self.generation += 1
+        return kind
@@ -0,0 +1,178 @@
+"""串口发现：后台并行探测，用握手识别 TSL1401 固件（不依赖 Qt）
+
+候选端口来自可插拔的提供者，默认是系统串口（Windows 的 COMx、Linux 的
+/dev/ttyUSB*、/dev/ttyACM*、macOS 的 /dev/cu.*）；测试时可以注册伪终端或
+loop:// 等虚拟端口。探测结果按 VID/PID/序列号缓存，已识别的端口不再重复握手。
+
+    python -m tsl1401 ports
+    python -m tsl1401 ports --fake 2
+"""
+import argparse
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+import serial.tools.list_ports
+
+from . import protocol
+
+# 端口状态
+TSL1401 = 'tsl1401'      # 握手成功
+UNKNOWN = 'unknown'      # 能打开但没有 TSL1401 回复
+BUSY = 'busy'            # 打不开（被占用或无权限）
+CONNECTED = 'connected'  # 本程序已连接，不再探测
+
+PROBE_TIMEOUT = 2.0  # 等待握手回复的时间(秒)，部分 Arduino 打开串口后会复位约 1.5 秒
+
+# device: 打开用的端口名；key: 缓存键；description: 显示用的说明
+Candidate = namedtuple('Candidate', 'device key description')
+PortInfo = namedtuple('PortInfo', 'device status description')
+
+_SYSTEM_PORT = re.compile(r'^(COM\d+|/dev/(tty(USB|ACM)\d+|cu\..+))$', re.IGNORECASE)
+
+
+def system_ports():
+    """系统串口：USB 转串口或名称符合常见串口的设备"""
+    for port in serial.tools.list_ports.comports():
+        if port.vid is None and not _SYSTEM_PORT.match(port.device):
+            continue  # 如 Linux 上没有接设备的 /dev/ttyS*
+        key = (port.vid, port.pid, port.serial_number, port.device)
+        yield Candidate(port.device, key, port.description or '')
+
+
+def static_provider(devices, description=''):
+    """固定端口列表（伪终端虚拟设备、loop:// 等）的提供者"""
+    devices = list(devices)
+
+    def provider():
+        return [Candidate(device, device, description) for device in devices]
+    return provider
+
+
+PROVIDERS = [system_ports]
+
+
+def register_provider(provider):
+    """注册候选端口提供者：无参数，返回 Candidate 序列"""
+    if provider not in PROVIDERS:
+        PROVIDERS.append(provider)
+
+
+def unregister_provider(provider):
+    if provider in PROVIDERS:
+        PROVIDERS.remove(provider)
+
+
+def probe(device, timeout=PROBE_TIMEOUT):
+    """打开端口发送握手命令，返回端口状态"""
+    ser = serial.serial_for_url(device, do_not_open=True, baudrate=protocol.BAUDRATE, timeout=0.05,
+                                write_timeout=timeout)
+    ser.dtr = False  # 尽量避免打开时复位 Arduino
+    try:
+        ser.open()
+    except (serial.SerialException, OSError, ValueError):
+        return BUSY
+    try:
+        ser.reset_input_buffer()
+        ser.write(protocol.HANDSHAKE)
+        received = b''
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            received += ser.read(max(1, ser.in_waiting))
+            if protocol.HANDSHAKE_REPLY in received:
+                return TSL1401
+            # 设备可能正在输出数据，只保留足够匹配回复的尾部
+            received = received[-256:]
+        return UNKNOWN
+    except (serial.SerialException, OSError):
+        return BUSY
+    finally:
+        ser.close()
+
+
+class PortScanner:
+    """并行探测所有提供者给出的端口，缓存已识别/确认不是 TSL1401 的结果
+
+    缓存键在端口消失后清除，重新插拔的设备会被重新探测。
+    """
+
+    def __init__(self, timeout=PROBE_TIMEOUT, providers=None):
+        self.timeout = timeout
+        self.providers = PROVIDERS if providers is None else providers
+        self.cache = {}  # key -> 状态
+        self.lock = threading.Lock()
+
+    def candidates(self):
+        found = {}
+        for provider in list(self.providers):
+            try:
+                for candidate in provider():
+                    found.setdefault(candidate.device, candidate)
+            except Exception as e:
+                print(f"Port discovery error in {getattr(provider, '__name__', provider)}: {e}")
+        return list(found.values())
+
+    def scan(self, skip=()):
+        """返回 PortInfo 列表，TSL1401 在前；skip 中的端口（已连接）不探测"""
+        candidates = self.candidates()
+        with self.lock:
+            keys = {candidate.key for candidate in candidates}
+            for key in list(self.cache):
+                if key not in keys:
+                    del self.cache[key]
+            cached = dict(self.cache)
+        todo = [c for c in candidates if c.device not in skip and c.key not in cached]
+        if todo:
+            with ThreadPoolExecutor(max_workers=len(todo)) as pool:
+                statuses = list(pool.map(lambda c: probe(c.device, self.timeout), todo))
+            with self.lock:
+                for candidate, status in zip(todo, statuses):
+                    if status != BUSY:
+                        self.cache[candidate.key] = status
+                    cached[candidate.key] = status
+        ports = []
+        for candidate in candidates:
+            status = CONNECTED if candidate.device in skip else cached[candidate.key]
+            ports.append(PortInfo(candidate.device, status, candidate.description))
+        order = {TSL1401: 0, CONNECTED: 0, UNKNOWN: 1, BUSY: 2}
+        ports.sort(key=lambda port: (order[port.status], port.device))
+        return ports
+
+    def scan_async(self, callback, skip=()):
+        """在后台线程中扫描，完成后在该线程中调用 callback(ports)"""
+        skip = set(skip)
+        thread = threading.Thread(target=lambda: callback(self.scan(skip)), daemon=True)
+        thread.start()
+        return thread
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Find serial ports running the TSL1401 firmware")
+    parser.add_argument('--timeout', type=float, default=PROBE_TIMEOUT, help="handshake timeout per port (s)")
+    parser.add_argument('--fake', type=int, default=0, metavar='N', help="also start N pty fake devices")
+    parser.add_argument('--all', action='store_true', help="also list ports without TSL1401 firmware")
+    args = parser.parse_args(argv)
+
+    devices = []
+    if args.fake:
+        from .fakedevice import start_devices
+        devices = start_devices(args.fake, 100.0)
+        register_provider(static_provider([device.port for device in devices], "TSL1401 fake device"))
+    try:
+        start = time.perf_counter()
+        ports = PortScanner(args.timeout).scan()
+        elapsed = time.perf_counter() - start
+    finally:
+        for device in devices:
+            device.close()
+    for port in ports:
+        if args.all or port.status == TSL1401:
+            print(f"{port.device:<20} {port.status:<8} {port.description}")
+    print(f"probed {len(ports)} port(s) in {elapsed:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""自动曝光：按饱和像素数和高分位数闭环调整积分时间（不依赖 Qt）
+
+每 interval 秒取最新一块帧的最后几帧，用 np.partition 求高分位数（如 p99）并数
+饱和像素，与目标电平比较后通过已有的命令通道调整：
+
+    delay     T 命令：积分时间约等于帧周期 = 读出/发送时间 + 帧间隔，
+              光强时缩短帧间隔，帧率随之提高
+    exposure  E 命令：固件版本 2 的高速模式下直接设置曝光时间
+
+目标电平附近有 ±tolerance 的不调整区（滞回），每次改变不超过 max_step 倍；
+命令发出后等固件确认，再丢弃 settle_frames 帧（确认前已开始积分的帧），然后才重新测量。
+
+在模拟曝光和饱和的虚拟设备上测试阶跃响应（仅 POSIX）：
+
+    python -m tsl1401 exposure sim --light 0.3 3 1 --step 5
+    python -m tsl1401 record --port /dev/ttyUSB0 --duration 60 --auto-exposure
+"""
+import argparse
+import time
+
+import numpy as np
+
+from . import protocol
+
+EXPOSURE_DELAY = 'delay'
+EXPOSURE_TIME = 'exposure'
+DEFAULT_DELAY_MS = 20  # 固件上电时的帧间隔
+
+
+def frame_levels(frames, percentile=99, saturation=protocol.ADC_MAX):
+    """每帧的 (高分位数, 饱和像素数)，np.partition 只做部分排序"""
+    k = int(round(percentile / 100 * (frames.shape[1] - 1)))
+    high = np.partition(frames, k, axis=1)[:, k]
+    saturated = np.count_nonzero(frames >= saturation, axis=1)
+    return high, saturated
+
+
+def method_for(state):
+    """固件支持且已开启高速模式时用 E 命令，否则用 T 命令"""
+    firmware = state.get('version', protocol.LEGACY_FIRMWARE)
+    if protocol.FEATURE_EXPOSURE in firmware.features and state.get('fast'):
+        return EXPOSURE_TIME
+    return EXPOSURE_DELAY
+
+
+def describe_setting(state):
+    """固件回复的当前积分设置，如 "T 12 ms"、"E 800 us"，未知时为 "--" """
+    if method_for(state) == EXPOSURE_TIME and state.get('exposure_us'):
+        return f"E {state['exposure_us']} us"
+    if 'delay_ms' in state:
+        return f"T {state['delay_ms']} ms"
+    return "--"
+
+
+class AutoExposure:
+    """自动曝光控制器，在采集线程中对每块新帧调用 update()
+
+    target 为高分位数的目标电平（扣除 dark 后占满量程的比例），
+    超过 max_saturated 个像素饱和时不看分位数，直接按饱和程度减小积分时间。
+    """
+
+    def __init__(self, target=0.7, tolerance=0.15, percentile=99, max_saturated=0, dark=0.0,
+                 interval=0.3, settle_frames=2, max_step=4.0, sample=8, min_frames=3,
+                 delay_range=(0, 1000), exposure_range=(20, 1000000), reply_timeout=1.0):
+        self.target = target
+        self.tolerance = tolerance
+        self.percentile = percentile
+        self.max_saturated = max_saturated
+        self.dark = dark  # 暗电平，电平比较前扣除
+        self.interval = interval  # 两次判断的最短间隔(秒)，其间的帧只计数
+        self.settle_frames = settle_frames
+        self.max_step = max_step
+        self.sample = sample  # 每块只看最后几帧
+        self.min_frames = min_frames  # 测量帧周期至少需要的帧数
+        self.delay_range = delay_range  # 帧间隔范围(ms)，与固件一致
+        self.exposure_range = exposure_range  # 曝光时间范围(us)
+        self.reply_timeout = reply_timeout  # 固件未确认时，超过此时间(秒)按已生效处理
+        self.level = None  # 最近的高分位数
+        self.saturated = 0  # 最近的饱和像素数
+        self.adjustments = 0
+        self.last_check = -np.inf
+        self.restart()
+
+    def restart(self):
+        """重新开始测量（如重新开始采集）"""
+        self.pending = None  # 等待固件确认的 (状态键, 值, 发送时间)
+        self.settle = 0  # 还要丢弃的帧数
+        self.window_start = None  # 帧周期测量的起点
+        self.window_frames = 0
+
+    def update(self, frames, now, state):
+        """加入一块原始帧，需要调整时返回要发送的命令，否则返回 None
+
+        now 为这块帧的读取时间（time.perf_counter），state 为 FrameReader.device_state。
+        """
+        if self.pending is not None:
+            key, value, sent = self.pending
+            if state.get(key) != value and now - sent < self.reply_timeout:
+                return None
+            self.pending = None
+            self.settle = self.settle_frames
+            self.window_start = None
+        if self.settle > 0:
+            drop = min(self.settle, len(frames))
+            self.settle -= drop
+            frames = frames[drop:]
+        if not len(frames):
+            return None
+        if self.window_start is None:
+            self.window_start = now  # 从下一块起计数，帧周期 = 经过时间 / 帧数
+            self.window_frames = 0
+        else:
+            self.window_frames += len(frames)
+        if now - self.last_check < self.interval or self.window_frames < self.min_frames:
+            return None
+
+        self.last_check = now
+        high, saturated = frame_levels(frames[-self.sample:], self.percentile)
+        self.level = float(np.median(high))
+        self.saturated = int(np.median(saturated))
+        factor = self.correction()
+        if factor is None:
+            return None
+        return self.adjust(factor, now, state)
+
+    def correction(self):
+        """积分时间应乘的倍数，在不调整区内时返回 None"""
+        if self.saturated > self.max_saturated:
+            # 饱和后真实强度未知：少量饱和减半，大量饱和按最大步长减小
+            return 1 / self.max_step if self.saturated > 4 * (self.max_saturated + 1) else 0.5
+        level = max(self.level - self.dark, 1.0)
+        ratio = level / (self.target * (protocol.ADC_MAX - self.dark))
+        if abs(ratio - 1) <= self.tolerance:
+            return None
+        return float(np.clip(1 / ratio, 1 / self.max_step, self.max_step))
+
+    def period_ms(self, now):
+        return (now - self.window_start) / self.window_frames * 1000
+
+    def adjust(self, factor, now, state):
+        if method_for(state) == EXPOSURE_TIME:
+            current = state.get('exposure_us') or self.period_ms(now) * 1000  # 0 表示积分时间等于帧周期
+            value = int(round(np.clip(current * factor, *self.exposure_range)))
+            key, command = 'exposure_us', protocol.exposure_command(value)
+        else:
+            # 帧周期 = 固定开销（读出、发送）+ 帧间隔，只有帧间隔可调
+            period = self.period_ms(now)
+            overhead = max(period - state.get('delay_ms', DEFAULT_DELAY_MS), 0.0)
+            value = int(round(np.clip(period * factor - overhead, *self.delay_range)))
+            key, command = 'delay_ms', protocol.delay_command(value)
+        if value == state.get(key):
+            return None  # 已到调节范围的边界
+        self.pending = (key, value, now)
+        self.adjustments += 1
+        return command
+
+
+def simulate(lights, step, fps, fast, target, wire_format):
+    """虚拟设备按 lights 依次改变光强（每 step 秒一次），打印控制器的响应"""
+    from .acquisition import SerialAcquisition
+    from .fakedevice import FakeDevice
+
+    device = FakeDevice(fps, seed=0, light=lights[0])
+    device.start()
+    controller = AutoExposure(target=target)
+    acquisition = SerialAcquisition(device.port, wire_format, fast=fast, auto_exposure=controller)
+    acquisition.start()
+    acquisition.start_capture()
+    low, high = (target * (1 - controller.tolerance), target * (1 + controller.tolerance))
+    print(f"target p{controller.percentile} {target:.0%} of full scale (band {low:.0%}-{high:.0%})")
+    print(f"{'time s':>7}{'light':>7}{'setting':>12}{'p99':>7}{'sat':>5}{'frames/s':>10}")
+    start = time.perf_counter()
+    try:
+        for light in lights:
+            device.set_light(light)
+            changed = time.perf_counter()
+            frames0, t0, settled = acquisition.ring.count, changed, None
+            while time.perf_counter() - changed < step:
+                time.sleep(0.5)
+                now = time.perf_counter()
+                frames = acquisition.ring.count
+                level = controller.level if controller.level is not None else float('nan')
+                if settled is None and controller.saturated <= controller.max_saturated and \
+                        abs(level / protocol.ADC_MAX - target) <= target * controller.tolerance:
+                    settled = now - changed
+                print(f"{now - start:>7.1f}{light:>7.2f}{describe_setting(acquisition.reader.device_state):>12}"
+                      f"{level:>7.0f}{controller.saturated:>5}{(frames - frames0) / (now - t0):>10.1f}", flush=True)
+                frames0, t0 = frames, now
+            print(f"light {light:g}: " + (f"in band after {settled:.1f} s" if settled is not None else "not settled"))
+    finally:
+        acquisition.stop_capture()
+        acquisition.stop()
+        device.close()
+    print(f"{controller.adjustments} adjustments")
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Auto-exposure step response on an emulated device")
+    parser.add_argument('mode', choices=['sim'])
+    parser.add_argument('--light', type=float, nargs='+', default=[0.3, 3.0, 1.0],
+                        help="light levels to step through (1 = default synthetic spectrum at --fps)")
+    parser.add_argument('--step', type=float, default=5.0, help="seconds per light level")
+    parser.add_argument('--fps', type=float, default=100.0, help="initial frame rate of the fake device")
+    parser.add_argument('--fast', action='store_true', help="use fast mode and the E command instead of T")
+    parser.add_argument('--target', type=float, default=0.7, help="target high percentile as a fraction of full scale")
+    parser.add_argument('--format', default=protocol.WIRE_PACKED10, choices=list(protocol.MODE_ARGS))
+    args = parser.parse_args(argv)
+    simulate(args.light, args.step, args.fps, args.fast, args.target, args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""虚拟 TSL1401 设备：在伪终端(pty)上模拟固件的串口命令和数据输出（仅 POSIX，不依赖 Qt）
+
+启动几个虚拟设备，把打印出的端口传给 main.py --connect：
+
+    python -m tsl1401 fake --count 2 --fps 500
+
+多设备基准测试：依次用 1、2、4 个虚拟设备运行界面，统计总帧率和 CPU 占用：
+
+    python -m tsl1401 fake bench --counts 1 2 4 --fps 1000 --duration 10
+
+端到端自检：对每种线格式和固件版本，经 pty 和 pyserial 用 SerialAcquisition 采集，
+比对收到的帧与设备发出的帧，并检查格式协商、版本握手和 T 命令，失败时返回非零：
+
+    python -m tsl1401 fake selftest --fps 1000 --duration 1
+
+界面延迟与重绘率：一个虚拟设备，依次用不同重绘频率无界面运行 main.py，打印各阶段耗时报告
+（帧从读出到绘制完成的 latency、每次重绘的 render 等）、实际重绘率，以及界面线程上
+绘制、统计面板刷新（flush_stats）和库匹配平均到每个输入帧的耗时：
+
+    python -m tsl1401 fake latency --fps 1000 --refresh 30 60 1000 --duration 10
+"""
+import argparse
+import os
+import pty
+import re
+import select
+import subprocess
+import sys
+import threading
+import time
+import tty
+
+from . import protocol
+from .replay import Pacer, SyntheticSpectrum, encode_frames
+
+
+class FakeDevice(threading.Thread):
+    """模拟固件的 S/X/T/B 命令，采集时按 fps 输出合成光谱
+
+    version 为 2 时还模拟 V（版本握手）、F（高速模式）和 E（曝光时间）命令；
+    为 1 时像旧固件一样忽略它们，用于测试主机端的回退。
+
+    光谱强度与光强 light 和积分时间成正比，超过 ADC 满量程时截断：
+    积分时间通常等于帧周期（初始为 1/fps，T 命令改为帧间隔），
+    高速模式下设置了曝光时间时等于曝光时间，帧周期再加上曝光时间。
+    """
+
+    BATCH = 16  # 每次写入的最多帧数
+    VERSION = 2
+
+    def __init__(self, fps=100.0, seed=None, version=VERSION, light=1.0):
+        super().__init__(daemon=True)
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave  # 保持打开，主机未连接时写入也不会出错
+        self.source = SyntheticSpectrum(rate=fps, seed=seed)
+        self.pacer = Pacer(fps, 1.0, self.BATCH)
+        self.wire_format = protocol.WIRE_ASCII  # 固件上电默认 ASCII
+        self.version = version
+        self.fast = False
+        self.exposure_us = 0
+        self.reference_ms = 1000.0 / fps  # light 为 1 时此积分时间下的强度与 SyntheticSpectrum 默认相同
+        self.delay_ms = None  # 收到 T 命令之前帧周期为 1/fps
+        self.light = light
+        self.source.exposure = light
+        self.capturing = False
+        self.running = True
+        self.command = b''
+        self.frame_seq = 0  # 与固件的 frameSeq 一样上电后一直累加，不随 S/T 命令重置
+        self.sent = None  # 设为列表时记录发出的帧块，供自检与主机收到的帧比对
+
+    def frame_period_ms(self):
+        period = self.reference_ms if self.delay_ms is None else max(self.delay_ms, 1)
+        if self.fast and self.exposure_us:
+            period += self.exposure_us / 1000
+        return period
+
+    def integration_ms(self):
+        if self.fast and self.exposure_us:
+            return self.exposure_us / 1000
+        return self.frame_period_ms()
+
+    def set_light(self, light):
+        """改变光强，从下一帧起生效"""
+        self.light = light
+        self.source.exposure = light * self.integration_ms() / self.reference_ms
+
+    def apply_timing(self):
+        """帧间隔、高速模式或曝光时间改变后更新帧率和信号强度"""
+        self.pacer = Pacer(1000.0 / self.frame_period_ms(), 1.0, self.BATCH)
+        self.set_light(self.light)
+
+    def reply(self, text):
+        os.write(self.master, b'CMD: ' + text.encode() + b'\r\n')
+
+    def handle(self, data):
+        """按固件的方式处理命令，T/B/F/E 的参数读到换行为止，T 的参数（含换行）不足 3 个字节时被忽略"""
+        self.command += data
+        extended = self.version >= 2
+        while self.command:
+            cmd = self.command[:1]
+            if cmd in (b'T', b'B') or extended and cmd in (b'F', b'E'):
+                if b'\n' not in self.command:
+                    return
+                if cmd == b'T' and self.command.index(b'\n') < 3:
+                    # 固件的 setFrameDelay() 只在 T 之后至少有 3 个字节时读取参数，否则忽略，
+                    # 剩下的字节再被当作单字符命令丢弃
+                    self.command = self.command[1:]
+                    continue
+                arg, self.command = self.command[1:].split(b'\n', 1)
+                value = int(re.match(rb'\s*(\d*)', arg).group(1) or 0)  # 与固件的 toInt() 一样忽略非数字
+                if cmd == b'T':
+                    if 0 <= value <= 1000:
+                        self.delay_ms = value
+                        self.apply_timing()
+                        self.reply(f"Frame delay set to {value}ms")
+                elif cmd == b'F':
+                    self.fast = value != 0
+                    self.apply_timing()
+                    self.reply(f"Fast mode {'on' if self.fast else 'off'}")
+                elif cmd == b'E':
+                    if 0 <= value <= 1000000:
+                        self.exposure_us = value
+                        self.apply_timing()
+                        self.reply(f"Exposure set to {value}us")
+                else:
+                    self.wire_format = {16: protocol.WIRE_BINARY16, 10: protocol.WIRE_PACKED10}.get(
+                        value, protocol.WIRE_ASCII)
+                    self.reply(f"Output mode {self.wire_format}")
+                continue
+            self.command = self.command[1:]
+            if cmd == b'S':
+                self.capturing = True
+                self.pacer.restart()
+                self.reply("Continuous capture started")
+            elif cmd == b'X':
+                self.capturing = False
+                self.reply("Capture stopped")
+            elif cmd == b'V' and extended:
+                self.reply(f"Version {self.version} {protocol.FEATURE_FAST} {protocol.FEATURE_EXPOSURE}")
+
+    def run(self):
+        while self.running:
+            timeout = 0.0 if self.capturing else 0.05
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                try:
+                    self.handle(os.read(self.master, 256))
+                except OSError:
+                    break
+            if not self.capturing:
+                continue
+            n = self.pacer.due()
+            if n <= 0:
+                self.pacer.wait()
+                continue
+            frames = self.source.read(n)
+            if self.sent is not None:
+                self.sent.append(frames)
+            os.write(self.master, encode_frames(frames, self.frame_seq, self.wire_format))
+            self.frame_seq += n
+            self.pacer.advance(n)
+
+    def close(self):
+        self.running = False
+        self.join(1.0)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def start_devices(count, fps, seed=None, version=FakeDevice.VERSION, light=1.0):
+    devices = [FakeDevice(fps, None if seed is None else seed + i, version, light) for i in range(count)]
+    for device in devices:
+        device.start()
+    return devices
+
+
+def run_gui(ports, duration, layout='overlay', extra=()):
+    """无界面运行 main.py 采集 duration 秒，返回 (总帧率, CPU 百分比, 完整报告)，extra 为附加的命令行参数"""
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    main = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+    result = subprocess.run([sys.executable, main, '--connect', *ports, '--layout', layout,
+                             '--duration', str(duration), *extra], env=env, capture_output=True, text=True)
+    report = result.stdout
+    match = re.search(r"aggregate ([\d.]+) frames/s .*CPU (\d+)%", report)
+    if not match:
+        raise RuntimeError(f"no performance report from main.py:\n{report}{result.stderr}")
+    return float(match.group(1)), int(match.group(2)), report
+
+
+def bench(counts, fps, duration, layout):
+    print(f"{'devices':>7}  {'target':>9}  {'frames/s':>9}  {'per device':>10}  {'CPU':>5}")
+    for count in counts:
+        devices = start_devices(count, fps, seed=0)
+        try:
+            rate, cpu, _ = run_gui([device.port for device in devices], duration, layout)
+        finally:
+            for device in devices:
+                device.close()
+        print(f"{count:>7}  {count * fps:>9.0f}  {rate:>9.1f}  {rate / count:>10.1f}  {cpu:>4}%")
+
+
+def latency(rates, fps, duration, layout, plot):
+    """一个虚拟设备、不同重绘频率下运行界面，打印每次的阶段耗时报告和汇总，汇总含每帧界面线程耗时
+
+    latency 为帧从串口读出到绘制完成的时间；帧率和重绘频率都设得很高时，实际 redraws/s 即界面能持续的最高重绘率。
+    """
+    rows = []
+    for rate in rates:
+        device = FakeDevice(fps, seed=0)
+        device.start()
+        try:
+            frames, cpu, report = run_gui([device.port], duration, layout,
+                                          ('--refresh-rate', str(rate), '--plot', plot))
+        finally:
+            device.close()
+        print(f"--- refresh {rate:g} Hz ---\n{report}", flush=True)
+        redraws = float(re.search(r"([\d.]+) redraws/s", report).group(1))
+        stages = {m.group(1): m.groups()[1:] for m in re.finditer(
+            r"^(latency|render)\s+\d+\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)", report, re.M)}
+        ui = re.search(r"UI thread ([\d.]+) ms/frame .*stats ([\d.]+)", report)
+        rows.append((rate, frames, redraws, stages.get('latency', ('-',) * 3), stages.get('render', ('-',) * 3),
+                     ui.groups() if ui else ('-', '-'), cpu))
+
+    print(f"{'refresh':>7}  {'frames/s':>8}  {'redraws/s':>9}  {'latency p50':>11}  {'p95':>7}  "
+          f"{'render mean':>11}  {'UI ms/frame':>11}  {'stats':>6}  {'CPU':>5}")
+    for rate, frames, redraws, (_, p50, p95), (mean, _, _), (ui, stats), cpu in rows:
+        print(f"{rate:>7g}  {frames:>8.1f}  {redraws:>9.1f}  {p50:>11}  {p95:>7}  {mean:>11}  {ui:>11}  "
+              f"{stats:>6}  {cpu:>4}%")
+
+
+def selftest(fps, duration, delay_ms=8):
+    """逐个组合运行虚拟设备 + SerialAcquisition，返回是否全部通过"""
+    import numpy as np
+
+    from .acquisition import SerialAcquisition
+
+    print(f"{'firmware':>8}  {'format':>9}  {'sent':>6}  {'received':>8}  {'frames/s':>8}  result")
+    passed = True
+    for version in (1, FakeDevice.VERSION):
+        for wire_format in protocol.MODE_ARGS:
+            device = FakeDevice(fps, seed=0, version=version)
+            device.sent = []
+            device.start()
+            # 缓冲区容纳全部帧，便于逐帧比对
+            acquisition = SerialAcquisition(device.port, wire_format, ring_capacity=int(fps * duration * 2) + 1024,
+                                            fast=version >= 2)
+            acquisition.start()
+            acquisition.start_capture()
+            time.sleep(duration)
+            rate = acquisition.ring.count / duration
+            acquisition.send_command(protocol.delay_command(delay_ms))
+            time.sleep(0.2)
+            acquisition.stop_capture()
+            time.sleep(0.2)
+            acquisition.stop()
+            device.close()
+
+            received, _ = acquisition.ring.read(0)
+            sent = np.concatenate(device.sent) if device.sent else np.empty((0, protocol.NPIXELS), np.uint16)
+            counters = acquisition.reader.counters()
+            state = acquisition.reader.device_state
+            problems = []
+            if acquisition.active_format != wire_format:
+                problems.append(f"format {acquisition.active_format}")
+            expected = protocol.LEGACY_FIRMWARE.version if version < 2 else version
+            if acquisition.firmware.version != expected:
+                problems.append(f"firmware version {acquisition.firmware.version}")
+            if len(received) < fps * duration / 2:
+                problems.append("too few frames")
+            # 停止后还在路上的帧会被主机丢弃，所以收到的帧应是发出帧的前缀
+            if len(received) > len(sent) or not np.array_equal(received, sent[:len(received)]):
+                problems.append("frames differ from sent")
+            errors = [f"{key} {counters[key]}" for key in ('malformed', 'truncated', 'out_of_range', 'missing')
+                      if counters[key]]
+            problems += errors
+            if device.delay_ms != delay_ms or state.get('delay_ms') != delay_ms:
+                problems.append(f"T command not applied (device {device.delay_ms}, host {state.get('delay_ms')})")
+            passed = passed and not problems
+            print(f"{version:>8}  {wire_format:>9}  {len(sent):>6}  {len(received):>8}  "
+                  f"{rate:>8.0f}  {'; '.join(problems) or 'ok'}")
+    return passed
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Emulate TSL1401 devices on pseudo terminals")
+    parser.add_argument('mode', nargs='?', default='serve', choices=('serve', 'bench', 'latency', 'selftest'),
+                        help="serve: start devices and print their ports; bench: measure main.py with 1..N devices; "
+                             "latency: per-stage GUI latency and redraw rate at several refresh rates; "
+                             "selftest: check the serial reader end to end against every wire format and firmware")
+    parser.add_argument('--count', type=int, default=1, help="number of devices to serve")
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 2, 4], help="device counts to benchmark")
+    parser.add_argument('--fps', type=float, default=100.0, help="frames per second per device")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per benchmark or selftest run")
+    parser.add_argument('--layout', default='overlay', choices=('overlay', 'tiled'))
+    parser.add_argument('--refresh', type=float, nargs='+', default=[30.0, 60.0, 1000.0],
+                        help="GUI refresh rates (Hz) for the latency benchmark")
+    parser.add_argument('--plot', default='matplotlib', choices=('matplotlib', 'qt'),
+                        help="plot backend for the latency benchmark")
+    parser.add_argument('--seed', type=int, help="random seed for synthetic spectra")
+    parser.add_argument('--firmware-version', type=int, default=FakeDevice.VERSION, choices=(1, 2),
+                        help="firmware version to emulate; 1 ignores the V/F/E commands")
+    parser.add_argument('--light', type=float, default=1.0,
+                        help="light level; the signal scales with light times integration time and clips at 1023")
+    args = parser.parse_args(argv)
+
+    if args.mode == 'bench':
+        bench(args.counts, args.fps, args.duration, args.layout)
+        return
+    if args.mode == 'latency':
+        latency(args.refresh, args.fps, args.duration, args.layout, args.plot)
+        return
+    if args.mode == 'selftest':
+        if not selftest(args.fps, args.duration):
+            sys.exit(1)
+        return
+    devices = start_devices(args.count, args.fps, args.seed, args.firmware_version, args.light)
+    for device in devices:
+        print(device.port, flush=True)
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""参考光谱库：按形状识别样品，整块帧与整个库一次矩阵乘法打分（不依赖 Qt）
+
+库是一个目录：spectra.npy 为逐行 L2 归一化的 float32 矩阵，centered.npy 为
+先减去均值再归一化的矩阵（相关系数用），meta.json 为名称和元数据。打开时两个
+矩阵都用 np.memmap 映射，大库也能立即打开。掩码后重新归一化的像素子矩阵第一次用到时
+生成，并以 view-<摘要>.npy 保存在库目录中，之后直接映射；library add 会预先生成
+--mask（默认为校正的默认掩码）对应的子矩阵，界面第一次匹配时不必在界面线程上计算。
+
+打分方式：
+
+    cosine       余弦相似度（与整体亮度无关）
+    correlation  皮尔逊相关系数（还与基线偏移无关）
+    unmix        先按余弦取候选，再对候选做非负最小二乘分解，分数为各成分所占比例
+
+    python -m tsl1401 library add library mercury recordings/hg.tslrec --meta lamp=Hg
+    python -m tsl1401 library match library recordings/sample.tslrec --top 3
+    python -m tsl1401 library bench --sizes 100 1000 10000 100000
+    python main.py --replay synthetic --library library --match correlation
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .calibration import DEFAULT_MASK, parse_mask
+from .protocol import NPIXELS
+
+FORMAT_VERSION = 1
+METHODS = ('cosine', 'correlation', 'unmix')
+SHORTLIST = 8  # unmix 的候选数
+
+# index/score: (帧数, k)，按分数从高到低；residual: (帧数,) 最佳拟合的相对残差
+Matches = namedtuple('Matches', 'index score residual')
+
+
+def _stamp(path):
+    """spectra.npy 的 inode、修改时间和大小，库被重写后掩码子矩阵的文件名随之改变"""
+    st = os.stat(os.path.join(path, 'spectra.npy'))
+    return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}".encode()
+
+
+def _normalize(rows, center=False):
+    """逐行（可先减去均值）L2 归一化为 float32，全零行保持为零"""
+    rows = np.asarray(rows, dtype=np.float32)
+    if center:
+        rows = rows - rows.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(rows, axis=-1, keepdims=True)
+    rows = rows / np.where(norm > 0, norm, 1)
+    # 极小的分量（如高斯峰的远端）与帧相乘会得到次正规数，使矩阵乘法慢数倍；
+    # 单位范数下低于 1e-10 的分量远小于 float32 的精度，归零对分数没有影响
+    rows[np.abs(rows) < 1e-10] = 0
+    return rows
+
+
+def _top(scores, k):
+    """每行最高的 k 个分数的 (下标, 分数)，按分数从高到低"""
+    k = min(k, scores.shape[1])
+    index = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part = np.take_along_axis(scores, index, axis=1)
+    order = np.argsort(-part, axis=1)
+    return np.take_along_axis(index, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+def _save_array(path, array):
+    """写临时文件再替换，正在映射旧文件的进程不受影响"""
+    tmp = f"{path}.{os.getpid()}.tmp.npy"  # 几个进程同时写同一文件时各用各的临时文件
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+class SpectralLibrary:
+    """参考光谱库，entries[i] 为第 i 行的元数据（至少有 'name'）"""
+
+    def __init__(self, spectra, centered, entries, npixels=NPIXELS, path=None, stamp=None):
+        self.spectra = spectra  # (n, npixels) float32，逐行单位范数
+        self.centered = centered
+        self.entries = entries
+        self.npixels = npixels
+        self.path = path
+        self.stamp = stamp  # 矩阵与目录中一致时为 _stamp(path)，否则为 None（子矩阵不写入目录）
+        self.views = {}  # 像素选择 -> (spectra, centered)，掩码后重新归一化
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def names(self):
+        return [entry['name'] for entry in self.entries]
+
+    @classmethod
+    def build(cls, spectra, entries, npixels=NPIXELS):
+        spectra = np.asarray(spectra, dtype=np.float32).reshape(-1, npixels)
+        if len(spectra) != len(entries):
+            raise ValueError(f"{len(spectra)} spectra but {len(entries)} metadata entries")
+        return cls(_normalize(spectra), _normalize(spectra, center=True), [dict(e) for e in entries], npixels)
+
+    @classmethod
+    def open(cls, path):
+        """打开库目录，矩阵按需从磁盘映射；目录不存在时返回空库"""
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            library = cls.build(np.zeros((0, NPIXELS)), [])
+            library.path = path
+            return library
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported library version {meta.get('version')}")
+        npixels = meta['npixels']
+        entries = meta['entries']
+        stamp = None
+        if entries:
+            spectra = np.load(os.path.join(path, 'spectra.npy'), mmap_mode='r')
+            centered = np.load(os.path.join(path, 'centered.npy'), mmap_mode='r')
+            stamp = _stamp(path)
+        else:
+            spectra = centered = np.zeros((0, npixels), np.float32)
+        if spectra.shape != (len(entries), npixels) or centered.shape != spectra.shape:
+            raise ValueError(f"{path}: matrices do not match meta.json")
+        return cls(spectra, centered, entries, npixels, path, stamp)
+
+    def save(self, path=None):
+        """写入库目录；先写矩阵再写 meta.json，中断时旧的 meta.json 仍与旧矩阵一致"""
+        path = path or self.path
+        os.makedirs(path, exist_ok=True)
+        _save_array(os.path.join(path, 'spectra.npy'), np.ascontiguousarray(self.spectra))
+        _save_array(os.path.join(path, 'centered.npy'), np.ascontiguousarray(self.centered))
+        meta = {'version': FORMAT_VERSION, 'npixels': self.npixels, 'entries': self.entries}
+        tmp = os.path.join(path, 'meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, os.path.join(path, 'meta.json'))
+        # 旧矩阵的掩码子矩阵已经无用
+        for old in glob.glob(os.path.join(path, 'view-*.npy')):
+            try:
+                os.remove(old)
+            except OSError:
+                pass  # Windows 上仍被映射的文件留到下次保存时再删
+        self.path = path
+        self.stamp = _stamp(path)
+
+    def add(self, name, spectrum, **metadata):
+        """加入一条参考光谱 (npixels,)，同名的条目被替换"""
+        spectrum = np.asarray(spectrum, dtype=np.float32).reshape(1, self.npixels)
+        if not np.any(spectrum):
+            raise ValueError(f"reference '{name}' has no signal")
+        keep = [i for i, entry in enumerate(self.entries) if entry['name'] != name]
+        self.spectra = np.concatenate((self.spectra[keep], _normalize(spectrum)))
+        self.centered = np.concatenate((self.centered[keep], _normalize(spectrum, center=True)))
+        self.entries = [self.entries[i] for i in keep] + [dict(metadata, name=name)]
+        self.stamp = None
+        self.views = {}
+
+    def view(self, pixels=None):
+        """只含 pixels（传感器像素序号）列并重新归一化的 (spectra, centered)，按像素选择缓存"""
+        if pixels is None or len(pixels) == self.npixels:
+            return self.spectra, self.centered
+        key = np.asarray(pixels).tobytes()
+        view = self.views.get(key)
+        if view is None:
+            view = self.views[key] = self.load_view(pixels)
+        return view
+
+    def load_view(self, pixels):
+        """映射目录中保存的掩码子矩阵；没有时计算，库与目录一致时写入目录供以后直接映射"""
+        pixels = np.asarray(pixels, dtype=np.int64)
+        paths = None
+        if self.stamp is not None:
+            digest = hashlib.sha1(self.stamp + pixels.tobytes()).hexdigest()[:16]
+            base = os.path.join(self.path, f"view-{digest}")
+            paths = (base + '.npy', base + '-centered.npy')
+            try:
+                view = tuple(np.load(path, mmap_mode='r') for path in paths)
+                if all(array.shape == (len(self), len(pixels)) for array in view):
+                    return view
+            except (OSError, ValueError):
+                pass
+        spectra = self.spectra[:, pixels]
+        view = (_normalize(spectra), _normalize(spectra, True))
+        if paths is not None:
+            try:
+                for path, array in zip(paths, view):
+                    _save_array(path, array)
+            except OSError:
+                pass  # 目录只读时只缓存在内存中
+        return view
+
+    def match(self, frames, k=3, method='cosine', pixels=None, shortlist=SHORTLIST):
+        """对 (n, p) 帧块或单帧 (p,) 打分，返回 Matches；pixels 为各列对应的传感器像素
+
+        cosine/correlation 的分数在 [-1, 1]，unmix 的分数为各成分所占比例。
+        """
+        if method not in METHODS:
+            raise ValueError(f"unknown match method '{method}'")
+        frames = np.atleast_2d(np.asarray(frames, dtype=np.float32))
+        if not len(self):
+            empty = np.zeros((len(frames), 0))
+            return Matches(empty.astype(np.intp), empty, np.ones(len(frames)))
+        spectra, centered = self.view(pixels)
+        if method == 'correlation':
+            scores = _normalize(frames, center=True) @ centered.T
+        else:
+            scores = _normalize(frames) @ spectra.T
+        if method == 'unmix':
+            return self.unmix(frames, spectra, scores, k, shortlist)
+        index, score = _top(scores, k)
+        # 单一参考的最小二乘拟合：相对残差 = sqrt(1 - 相似度²)
+        residual = np.sqrt(np.clip(1 - score[:, 0].astype(np.float64) ** 2, 0, None))
+        return Matches(index, score, residual)
+
+    def unmix(self, frames, spectra, scores, k, shortlist):
+        """在余弦最高的候选上做非负最小二乘，整块帧一起解（逐步剔除负系数）"""
+        candidates, _ = _top(scores, max(k, shortlist))
+        basis = spectra[candidates]  # (n, m, p)
+        gram = np.einsum('nip,njp->nij', basis, basis, dtype=np.float64)
+        rhs = np.einsum('nip,np->ni', basis, frames, dtype=np.float64)
+        m = basis.shape[1]
+        active = np.ones(rhs.shape, dtype=bool)
+        eye = np.eye(m)
+        for _ in range(m):
+            mask = active[:, :, None] & active[:, None, :]
+            # 剔除的成分对应单位行，解为 0
+            system = np.where(mask, gram, 0) + eye * ~active[:, :, None]
+            coef = np.linalg.solve(system + eye * 1e-9, (rhs * active)[..., None])[..., 0]
+            negative = active & (coef < 0)
+            if not negative.any():
+                break
+            active &= ~negative
+        coef = np.where(active, coef, 0)
+        total = coef.sum(axis=1, keepdims=True)
+        fraction = coef / np.where(total > 0, total, 1)
+        fit = np.einsum('ni,nip->np', coef, basis)
+        norm = np.linalg.norm(frames, axis=1)
+        residual = np.linalg.norm(frames - fit, axis=1) / np.where(norm > 0, norm, 1)
+        order, score = _top(fraction, k)
+        return Matches(np.take_along_axis(candidates, order, axis=1), score, residual)
+
+
+def synthetic_library(n, seed=0, npixels=NPIXELS):
+    """n 条由 1-4 个随机高斯峰组成的参考光谱（基准测试用）"""
+    rng = np.random.default_rng(seed)
+    x = np.arange(npixels)
+    spectra = np.zeros((n, npixels), np.float32)
+    for j in range(4):
+        present = rng.random(n) < (1.0 if j == 0 else 0.5)
+        center = rng.uniform(5, npixels - 5, n)
+        width = rng.uniform(1.5, 8.0, n)
+        height = rng.uniform(100, 900, n) * present
+        spectra += (height[:, None] * np.exp(-0.5 * ((x - center[:, None]) / width[:, None]) ** 2)).astype(np.float32)
+    return SpectralLibrary.build(spectra, [{'name': f"ref{i:06d}"} for i in range(n)], npixels)
+
+
+def bench(sizes, batches, methods, k, seconds):
+    """每个库大小与帧块大小：每秒匹配的帧数，以及从磁盘打开库的时间"""
+    import tempfile
+    rng = np.random.default_rng(1)
+    print(f"{'library':>8}{'open ms':>9}{'method':>13}{'batch':>7}{'frames/s':>11}{'top-1 ok':>10}")
+    for size in sizes:
+        library = synthetic_library(size)
+        with tempfile.TemporaryDirectory() as path:
+            library.save(path)
+            t = time.perf_counter()
+            library = SpectralLibrary.open(path)
+            opened = (time.perf_counter() - t) * 1000
+            for method in methods:
+                for batch in batches:
+                    # 带噪声和亮度变化的库中光谱作为测量帧
+                    truth = rng.integers(0, size, batch)
+                    frames = np.asarray(library.spectra[truth]) * rng.uniform(200, 2000, (batch, 1)).astype(np.float32)
+                    frames += rng.normal(0, 5, frames.shape).astype(np.float32) + 40 * (method == 'correlation')
+                    library.match(frames, k, method)  # 第一次调用时映射的页面载入内存
+                    count = 0
+                    start = time.perf_counter()
+                    while time.perf_counter() - start < seconds:
+                        matches = library.match(frames, k, method)
+                        count += 1
+                    rate = count * batch / (time.perf_counter() - start)
+                    correct = np.mean(matches.index[:, 0] == truth)
+                    print(f"{size:>8}{opened:>9.2f}{method:>13}{batch:>7}{rate:>11.0f}{correct:>10.0%}", flush=True)
+            del library  # 关闭映射后才能删除 Windows 上的临时目录
+
+
+def _load_frames(path, frames=None):
+    """录制文件中的帧（可用 "start:stop" 选择范围）"""
+    from .recording import Recording
+    recording = Recording(path)
+    pixels = recording.pixels
+    if frames:
+        start, _, stop = frames.partition(':')
+        pixels = pixels[int(start or 0):int(stop) if stop else None]
+    if not len(pixels):
+        raise ValueError(f"{path}: no frames selected")
+    return pixels
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Reference spectrum library")
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="add the mean of a recording as a reference spectrum")
+    add.add_argument('library', help="library directory (created if missing)")
+    add.add_argument('name')
+    add.add_argument('recording', help=".tslrec file")
+    add.add_argument('--frames', metavar='START:STOP', help="frames of the recording to average")
+    add.add_argument('--meta', nargs='*', default=[], metavar='KEY=VALUE', help="metadata stored with the reference")
+    add.add_argument('--mask', nargs='*', default=[DEFAULT_MASK], metavar='SPEC',
+                     help="pixel masks whose renormalized matrices are prebuilt for matching, e.g. '12:125'")
+    match = sub.add_parser('match', help="match the frames of a recording against the library")
+    match.add_argument('library')
+    match.add_argument('recording')
+    match.add_argument('--frames', metavar='START:STOP')
+    match.add_argument('--method', default='cosine', choices=METHODS)
+    match.add_argument('--top', type=int, default=3)
+    show = sub.add_parser('list', help="list the references in a library")
+    show.add_argument('library')
+    synth = sub.add_parser('synth', help="write a synthetic library for testing")
+    synth.add_argument('library')
+    synth.add_argument('--size', type=int, default=1000)
+    run = sub.add_parser('bench', help="matches per second versus library size")
+    run.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    run.add_argument('--batches', type=int, nargs='+', default=[1, 64])
+    run.add_argument('--methods', nargs='+', default=list(METHODS), choices=METHODS)
+    run.add_argument('--top', type=int, default=3)
+    run.add_argument('--seconds', type=float, default=0.5, help="time per measurement")
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        bench(args.sizes, args.batches, args.methods, args.top, args.seconds)
+    elif args.command == 'synth':
+        synthetic_library(args.size).save(args.library)
+        print(f"wrote {args.size} synthetic references to {args.library}")
+    elif args.command == 'list':
+        library = SpectralLibrary.open(args.library)
+        for entry in library.entries:
+            extra = ', '.join(f"{key}={value}" for key, value in entry.items() if key != 'name')
+            print(f"{entry['name']:<24} {extra}")
+        print(f"{len(library)} references")
+    elif args.command == 'add':
+        library = SpectralLibrary.open(args.library)
+        metadata = dict(item.split('=', 1) for item in args.meta)
+        pixels = _load_frames(args.recording, args.frames)
+        library.add(args.name, pixels.mean(axis=0), source=os.path.basename(args.recording),
+                    frames=len(pixels), **metadata)
+        library.save()
+        for spec in args.mask:
+            library.view(np.flatnonzero(parse_mask(spec, library.npixels)))
+        print(f"added '{args.name}' ({len(pixels)} frames averaged), {len(library)} references in {args.library}")
+    else:
+        library = SpectralLibrary.open(args.library)
+        pixels = _load_frames(args.recording, args.frames)
+        t = time.perf_counter()
+        matches = library.match(pixels, args.top, args.method)
+        elapsed = time.perf_counter() - t
+        names = library.names
+        best, counts = np.unique(matches.index[:, 0], return_counts=True)
+        for i in np.argsort(-counts):
+            score = matches.score[:, 0][matches.index[:, 0] == best[i]].mean()
+            print(f"{names[best[i]]:<24} best for {counts[i]:>7} frames, mean score {score:.4f}")
+        print(f"{len(pixels)} frames against {len(library)} references ({args.method}) "
+              f"in {elapsed * 1000:.1f} ms ({len(pixels) / elapsed:.0f} frames/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""运行指标：帧率、串口字节率、丢帧/坏帧计数与各阶段 p50/p99 延迟（不依赖 Qt）
+
+指标只在取快照时从采集线程的计数器和 StageTimer 汇总，采集线程本身只多记几个时间戳；
+不开启性能面板和导出时没有额外开销。快照可以显示在界面上，也可以定期写成
+JSON 或 Prometheus 文本格式的文件（供 node_exporter 的 textfile 收集器等读取）：
+
+    python -m tsl1401 record --port /dev/ttyUSB0 --duration 3600 --metrics tsl1401.prom
+    python main.py --metrics tsl1401.json --metrics-interval 5
+"""
+import json
+import os
+import threading
+import time
+
+FORMATS = ('prometheus', 'json')
+PREFIX = 'tsl1401'
+
+# 设备计数器：快照中的键 -> (Prometheus 指标名, 类型, 说明)
+DEVICE_METRICS = {
+    'frames': ('frames_total', 'counter', "Frames received"),
+    'fps': ('frames_per_second', 'gauge', "Frames per second since the previous snapshot"),
+    'bytes': ('serial_bytes_total', 'counter', "Bytes read from the serial port"),
+    'bytes_per_s': ('serial_bytes_per_second', 'gauge', "Serial bytes per second since the previous snapshot"),
+    'missing': ('missing_frames_total', 'counter', "Frames lost on the wire (sequence number gaps)"),
+    'malformed': ('malformed_frames_total', 'counter', "Frames rejected by the CRC check or for invalid characters"),
+    'truncated': ('truncated_frames_total', 'counter', "Frames cut short by lost bytes"),
+    'out_of_range': ('out_of_range_frames_total', 'counter', "Well-formed frames with values outside the ADC range"),
+    'skipped_bytes': ('skipped_bytes_total', 'counter', "Bytes discarded while resynchronizing"),
+    'replies': ('replies_total', 'counter', "Firmware command replies received"),
+    'overflow_bytes': ('overflow_bytes_total', 'counter', "Bytes discarded because the receive buffer was full"),
+    'dropped': ('dropped_frames_total', 'counter', "Frames overwritten in the ring buffer before being consumed"),
+    'pipeline_dropped': ('pipeline_dropped_frames_total', 'counter', "Frames skipped because the processing pipeline was busy"),
+}
+
+
+def format_for(path):
+    """按扩展名选择导出格式：.json 为 JSON，其他为 Prometheus 文本"""
+    return 'json' if path.lower().endswith('.json') else 'prometheus'
+
+
+class Metrics:
+    """汇总若干采集线程（按设备名）和界面的 StageTimer
+
+    帧率和字节率按同一使用方（consumer，如性能面板或导出线程）相邻两次快照之间的增量计算，
+    各使用方的基线互不影响。
+    """
+
+    def __init__(self, timers=None):
+        self.sources = {}  # 设备名 -> SerialAcquisition
+        self.timers = dict(timers or {})  # 来源名（如 'gui'）-> StageTimer
+        self.added = {}  # 设备名 -> 加入时的 (时间, 帧数, 字节数)
+        self.previous = {}  # 使用方 -> {设备名: 上次快照的 (时间, 帧数, 字节数)}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def add_source(self, name, acquisition):
+        with self.lock:
+            self.sources[name] = acquisition
+            self.added[name] = (time.perf_counter(), acquisition.ring.count, acquisition.reader.bytes_read)
+            for previous in self.previous.values():
+                previous.pop(name, None)
+
+    def remove_source(self, name):
+        with self.lock:
+            self.sources.pop(name, None)
+            self.added.pop(name, None)
+            for previous in self.previous.values():
+                previous.pop(name, None)
+
+    def snapshot(self, consumer=None):
+        """当前指标：{'time', 'uptime_s', 'devices': {设备: 计数器}, 'stages': {来源: {阶段: 延迟}}}
+
+        consumer 为任意可哈希的键，帧率和字节率相对该使用方的上一次快照计算。
+        """
+        with self.lock:
+            now = time.perf_counter()
+            previous = self.previous.setdefault(consumer, {})
+            devices = {}
+            stages = {}
+            for name, acquisition in self.sources.items():
+                reader = acquisition.reader
+                pipeline = acquisition.channel.pipeline if acquisition.channel is not None else None
+                frames = acquisition.ring.count
+                t0, frames0, bytes0 = previous.get(name, self.added[name])
+                elapsed = now - t0
+                devices[name] = dict(
+                    reader.counters(),
+                    frames=frames,
+                    fps=(frames - frames0) / elapsed if elapsed > 0 else 0.0,
+                    bytes_per_s=(reader.bytes_read - bytes0) / elapsed if elapsed > 0 else 0.0,
+                    corrupt=reader.errors,
+                    dropped=acquisition.dropped,
+                    pipeline_dropped=pipeline.dropped if pipeline is not None else 0,
+                )
+                previous[name] = (now, frames, reader.bytes_read)
+                stages[name] = stage_latencies(acquisition.timings)
+                if pipeline is not None:
+                    stages[f"{name} pipeline"] = stage_latencies(pipeline.timings)
+            for name, timer in self.timers.items():
+                stages[name] = stage_latencies(timer)
+        return {'time': time.time(), 'uptime_s': time.time() - self.started, 'devices': devices, 'stages': stages}
+
+
+def stage_latencies(timer):
+    """StageTimer 最近窗口内的 {阶段: {'count', 'p50_ms', 'p99_ms'}}"""
+    return {stage: {'count': count, 'p50_ms': p50, 'p99_ms': p99}
+            for stage, (count, _, p50, _, p99, _) in timer.summary().items()}
+
+
+def format_overlay(snapshot):
+    """性能面板用的等宽文本"""
+    lines = [f"{'device':<16}{'fps':>9}{'kB/s':>9}{'missing':>9}{'corrupt':>9}{'dropped':>9}"]
+    for name, device in snapshot['devices'].items():
+        lines.append(f"{name[-16:]:<16}{device['fps']:>9.1f}{device['bytes_per_s'] / 1000:>9.1f}"
+                     f"{device['missing']:>9}{device['corrupt']:>9}{device['dropped']:>9}")
+    lines.append('')
+    lines.append(f"{'stage (ms)':<16}{'p50':>9}{'p99':>9}")
+    for source, stages in snapshot['stages'].items():
+        for stage, latency in stages.items():
+            label = stage if len(snapshot['stages']) == 1 else f"{source[-8:]} {stage}"
+            lines.append(f"{label[-16:]:<16}{latency['p50_ms']:>9.3f}{latency['p99_ms']:>9.3f}")
+    return '\n'.join(lines)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(snapshot):
+    """Prometheus 文本格式（text/plain; version=0.0.4）"""
+    lines = []
+    for key, (name, kind, help) in DEVICE_METRICS.items():
+        lines.append(f"# HELP {PREFIX}_{name} {help}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for device, values in snapshot['devices'].items():
+            lines.append(f'{PREFIX}_{name}{{device="{_label(device)}"}} {values[key]:g}')
+    name = f"{PREFIX}_stage_latency_seconds"
+    lines.append(f"# HELP {name} Per-stage latency over the recent window")
+    lines.append(f"# TYPE {name} summary")
+    for source, stages in snapshot['stages'].items():
+        for stage, latency in stages.items():
+            labels = f'source="{_label(source)}",stage="{_label(stage)}"'
+            lines.append(f'{name}{{{labels},quantile="0.5"}} {latency["p50_ms"] / 1000:.9g}')
+            lines.append(f'{name}{{{labels},quantile="0.99"}} {latency["p99_ms"] / 1000:.9g}')
+            lines.append(f'{name}_count{{{labels}}} {latency["count"]}')
+    lines.append(f"# HELP {PREFIX}_uptime_seconds Seconds since the metrics started")
+    lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+    lines.append(f"{PREFIX}_uptime_seconds {snapshot['uptime_s']:.3f}")
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(snapshot):
+    return json.dumps(snapshot, indent=1) + '\n'
+
+
+def write_snapshot(path, snapshot, fmt):
+    """写入临时文件再替换，读取方不会读到写了一半的文件"""
+    text = to_json(snapshot) if fmt == 'json' else to_prometheus(snapshot)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class MetricsExporter(threading.Thread):
+    """每 interval 秒把快照写入 path，close() 时再写一次最终结果"""
+
+    def __init__(self, metrics, path, fmt=None, interval=10.0):
+        super().__init__(daemon=True)
+        if fmt is not None and fmt not in FORMATS:
+            raise ValueError(f"unknown metrics format: {fmt}")
+        self.metrics = metrics
+        self.path = path
+        self.fmt = fmt or format_for(path)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            write_snapshot(self.path, self.metrics.snapshot(consumer=self), self.fmt)
+            self.error = None
+        except OSError as e:
+            if self.error is None:
+                print(f"Metrics export error: {e}")  # 只报告一次，恢复后重新报告
+            self.error = e
+
+    def close(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join(1.0)
+        self.export()
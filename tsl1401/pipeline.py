@@ -0,0 +1,417 @@
+"""处理阶段流水线：校正后的帧块依次经过若干处理阶段，重的阶段可放到进程池（不依赖 Qt）
+
+流水线用字符串声明，阶段之间用逗号分隔，每个阶段为 "名称[:参数[/参数]][@pool|@local]"：
+
+    smooth:7          Savitzky-Golay 平滑（二次多项式，窗口 7 像素）
+    median:5          中值滤波，去除单像素尖峰（重）
+    baseline:31       减去 31 像素窗口的形态学开运算基线
+    deconvolve:30/1.5 Richardson-Lucy 反卷积 30 次，高斯 PSF 的 sigma 为 1.5 像素（重）
+
+阶段逐帧独立、输入输出形状相同，不保留跨帧块的状态。workers > 0 时，重的阶段（或加了
+@pool 的阶段）在工作进程中运行：帧块写入 multiprocessing.shared_memory 中预分配的槽位，
+进程之间只传递槽位号和帧数，不序列化帧数据。不同帧块由不同进程并行处理，吞吐量随进程数
+（CPU 核数）增加，结果按提交顺序交出。槽位数限制在途的帧块（背压）：槽位用完时 put()
+等待（wait=True，如录制回放）或丢弃这一块并计入 dropped（实时显示，采集线程不能停）。
+
+    python main.py --replay synthetic --pipeline median:5,deconvolve:30,baseline:31 --workers 2
+    python -m tsl1401 record --port /dev/ttyUSB0 --duration 60 --pipeline deconvolve:30 --workers 4
+    python -m tsl1401 pipeline bench --pipeline median:5,deconvolve:30 --workers 0 1 2 4
+"""
+import argparse
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .protocol import NPIXELS
+from .replay import SyntheticSpectrum
+from .timing import StageTimer, format_report
+
+DTYPE = np.float32  # 流水线内部和共享内存中的帧类型
+DEFAULT_BLOCK = 256  # 每个共享内存槽位的帧数，更大的帧块分段提交
+DIFF_TOLERANCE = 1e-3  # bench 核对时与同步处理结果允许的最大差值（ADC 计数）
+
+
+def _windows(frames, window):
+    """每个像素两侧各 window // 2 个像素的滑动窗口 (n, p, window)，边缘重复端点"""
+    half = window // 2
+    padded = np.pad(frames, ((0, 0), (half, half)), mode='edge')
+    return sliding_window_view(padded, 2 * half + 1, axis=1)
+
+
+def _odd(window, minimum=3):
+    window = max(int(window), minimum)
+    return window | 1
+
+
+class Stage:
+    """处理阶段：输入 (n, p) float32 帧块，返回同形状的帧块"""
+
+    name = None
+    heavy = False  # workers > 0 时默认放到工作进程，可用 @pool / @local 改变
+
+    def describe(self):
+        return self.name
+
+    def process(self, frames):
+        raise NotImplementedError
+
+
+class Smooth(Stage):
+    """Savitzky-Golay 平滑：窗口内二次多项式拟合的中心值，保持峰高比滑动平均好"""
+
+    name = 'smooth'
+
+    def __init__(self, window=7):
+        self.window = _odd(window)
+        half = self.window // 2
+        basis = np.vander(np.arange(-half, half + 1), 3, increasing=True)
+        self.coefficients = np.linalg.pinv(basis)[0].astype(DTYPE)
+
+    def describe(self):
+        return f"smooth {self.window} px"
+
+    def process(self, frames):
+        return _windows(frames, self.window) @ self.coefficients
+
+
+class Median(Stage):
+    """中值滤波：去除单像素尖峰（如宇宙射线、坏像素）"""
+
+    name = 'median'
+    heavy = True
+
+    def __init__(self, window=5):
+        self.window = _odd(window)
+
+    def describe(self):
+        return f"median {self.window} px"
+
+    def process(self, frames):
+        return np.median(_windows(frames, self.window), axis=-1).astype(DTYPE)
+
+
+class Baseline(Stage):
+    """减去形态学开运算（先取窗口最小值再取最大值）得到的基线，保留比窗口窄的峰"""
+
+    name = 'baseline'
+
+    def __init__(self, window=31):
+        self.window = _odd(window)
+
+    def describe(self):
+        return f"baseline {self.window} px"
+
+    def process(self, frames):
+        baseline = _windows(_windows(frames, self.window).min(axis=-1), self.window).max(axis=-1)
+        return frames - baseline
+
+
+class Deconvolve(Stage):
+    """Richardson-Lucy 反卷积：按高斯 PSF 迭代锐化谱线，负值先截为 0"""
+
+    name = 'deconvolve'
+    heavy = True
+
+    def __init__(self, iterations=30, sigma=1.5):
+        self.iterations = max(int(iterations), 1)
+        self.sigma = float(sigma)
+        half = max(int(np.ceil(3 * self.sigma)), 1)
+        psf = np.exp(-0.5 * (np.arange(-half, half + 1) / self.sigma) ** 2)
+        self.psf = (psf / psf.sum()).astype(DTYPE)  # 对称，转置卷积与卷积相同
+
+    def describe(self):
+        return f"deconvolve {self.iterations}x sigma {self.sigma:g}"
+
+    def process(self, frames):
+        observed = np.maximum(frames, 0).astype(DTYPE)
+        estimate = observed.copy()
+        window = len(self.psf)
+        tiny = np.finfo(DTYPE).tiny
+        for _ in range(self.iterations):
+            blurred = _windows(estimate, window) @ self.psf
+            ratio = observed / np.maximum(blurred, tiny)
+            estimate *= _windows(ratio, window) @ self.psf
+        return estimate
+
+
+STAGES = {cls.name: cls for cls in (Smooth, Median, Baseline, Deconvolve)}
+
+
+def register_stage(cls):
+    """注册自定义阶段；放到工作进程的阶段对象会被序列化，类必须定义在可导入的模块中"""
+    STAGES[cls.name] = cls
+    return cls
+
+
+def parse_pipeline(spec):
+    """解析 "名称[:参数[/参数]][@pool|@local],..."，返回阶段列表"""
+    stages = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        item, _, where = item.partition('@')
+        name, _, params = item.partition(':')
+        if name not in STAGES:
+            raise ValueError(f"unknown stage '{name}', expected one of: {', '.join(STAGES)}")
+        if where not in ('', 'pool', 'local'):
+            raise ValueError(f"stage '{item}@{where}' must end in @pool or @local")
+        try:
+            stage = STAGES[name](*params.split('/')) if params else STAGES[name]()
+        except (TypeError, ValueError):
+            raise ValueError(f"bad parameters for stage '{item}'") from None
+        if where:
+            stage.heavy = where == 'pool'
+        stages.append(stage)
+    if not stages:
+        raise ValueError(f"pipeline '{spec}' has no stages")
+    return stages
+
+
+def _labels(stages):
+    """计时用的阶段名，同名的阶段加上序号"""
+    labels = []
+    for stage in stages:
+        label, n = stage.name, 2
+        while label in labels:
+            label, n = f"{stage.name}{n}", n + 1
+        labels.append(label)
+    return labels
+
+
+def _worker(name, shape, stages, tasks, results):
+    """工作进程：映射共享内存，就地处理槽位中的帧块，回报每个阶段的耗时"""
+    shm = shared_memory.SharedMemory(name=name)
+    buffer = np.ndarray(shape, dtype=DTYPE, buffer=shm.buf)
+    view = None
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            number, slot, n, npixels = task
+            view = buffer[slot, :n * npixels].reshape(n, npixels)
+            frames, times = view, []
+            try:
+                for stage in stages:
+                    t = time.perf_counter()
+                    frames = stage.process(frames)
+                    times.append(time.perf_counter() - t)
+                view[...] = frames
+                results.put((number, times, None))
+            except Exception as e:
+                results.put((number, None, f"{type(e).__name__}: {e}"))
+    finally:
+        del view, buffer
+        shm.close()
+
+
+class Pipeline:
+    """按顺序运行的处理阶段，输出通过 on_output(frames, tag) 交出
+
+    不用进程池时 put() 在调用线程中跑完所有阶段并直接回调。用进程池时，第一个到最后一个
+    放到工作进程的阶段之间的部分（包括其间的轻阶段）整段在工作进程中运行，之前的阶段在
+    调用线程，之后的阶段和回调在收集线程中运行。tag 原样随帧块交出（如读取时间）。
+    """
+
+    def __init__(self, stages, workers=0, on_output=None, block=DEFAULT_BLOCK, slots=None,
+                 wait=False, npixels=NPIXELS):
+        self.stages = list(stages)
+        self.labels = _labels(self.stages)
+        pooled = [i for i, stage in enumerate(self.stages) if stage.heavy] if workers > 0 else []
+        first, last = (pooled[0], pooled[-1] + 1) if pooled else (len(self.stages),) * 2
+        self.head = range(first)  # 调用线程中运行的阶段
+        self.remote = range(first, last)  # 工作进程中运行的阶段
+        self.tail = range(last, len(self.stages))  # 收集线程中运行的阶段
+        self.workers = workers if pooled else 0
+        self.on_output = on_output
+        self.block = block
+        self.wait = wait  # True: 槽位用完时等待；False: 丢弃
+        self.dropped = 0  # 槽位用完而丢弃的帧数
+        self.errors = 0  # 工作进程中出错的帧块数
+        self.closed = False
+        # pool: 帧块从提交到工作进程处理完的时间（含排队）
+        self.timings = StageTimer(self.labels + (['pool'] if self.workers else []))
+        if self.workers:
+            self.start_pool(slots or 2 * self.workers + 2, npixels)
+
+    def describe(self):
+        return ' -> '.join(stage.describe() + (' [pool]' if i in self.remote else '')
+                           for i, stage in enumerate(self.stages))
+
+    def start_pool(self, slots, npixels):
+        # spawn 在各平台行为一致，也不会把界面和采集线程的状态复制到子进程
+        context = multiprocessing.get_context('spawn')
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * self.block * npixels * np.dtype(DTYPE).itemsize)
+        self.buffer = np.ndarray((slots, self.block * npixels), dtype=DTYPE, buffer=self.shm.buf)
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.submitted = {}  # 任务号 -> (槽位, 帧数, 像素数, tag, 提交时间)
+        self.finished = {}  # 已处理完、等待前面的任务的 任务号 -> (帧块或 None, tag)
+        self.next_task = 0
+        self.next_output = 0
+        self.lock = threading.Lock()
+        stages = [self.stages[i] for i in self.remote]
+        self.processes = [context.Process(target=_worker, daemon=True,
+                                          args=(self.shm.name, self.buffer.shape, stages, self.tasks, self.results))
+                          for _ in range(self.workers)]
+        for process in self.processes:
+            process.start()
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def run(self, indices, frames):
+        for i in indices:
+            t = time.perf_counter()
+            frames = self.stages[i].process(frames)
+            self.timings.since(self.labels[i], t)
+        return frames
+
+    def apply(self, frames):
+        """在调用线程中同步跑完所有阶段，单帧或帧块均可"""
+        frames = np.asarray(frames, dtype=DTYPE)
+        if frames.ndim == 1:
+            return self.apply(frames[None])[0]
+        return self.run(range(len(self.stages)), frames)
+
+    def put(self, frames, tag=None):
+        """提交一块 (n, p) 帧；不用进程池时处理完才返回"""
+        frames = self.run(self.head, np.asarray(frames, dtype=DTYPE))
+        if not self.workers:
+            self.on_output(frames, tag)
+            return
+        for i in range(0, len(frames), self.block):
+            self.submit(frames[i:i + self.block], tag)
+
+    def submit(self, frames, tag):
+        n, npixels = frames.shape
+        while True:
+            try:
+                slot = self.free.get(self.wait, 0.1)
+                break
+            except queue.Empty:
+                if not self.wait or self.closed:
+                    self.dropped += n
+                    return
+        np.copyto(self.buffer[slot, :n * npixels].reshape(n, npixels), frames)
+        with self.lock:
+            number = self.next_task
+            self.next_task += 1
+            self.submitted[number] = (slot, n, npixels, tag, time.perf_counter())
+        self.tasks.put((number, slot, n, npixels))
+
+    def collect(self):
+        """收集线程：取回处理完的槽位，按提交顺序运行其余阶段并交出"""
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            number, times, error = result
+            with self.lock:
+                slot, n, npixels, tag, sent = self.submitted.pop(number)
+            frames = None
+            if error is None:
+                frames = self.buffer[slot, :n * npixels].reshape(n, npixels).copy()
+                self.timings.since('pool', sent)
+                for i, seconds in zip(self.remote, times):
+                    self.timings.add(self.labels[i], seconds)
+            else:
+                if not self.errors:
+                    print(f"Pipeline error: {error}")  # 只报告第一次
+                self.errors += 1
+            self.free.put(slot)
+            self.finished[number] = (frames, tag)
+            while self.next_output in self.finished:
+                frames, tag = self.finished.pop(self.next_output)
+                self.next_output += 1
+                if frames is not None:
+                    self.on_output(self.run(self.tail, frames), tag)
+
+    def close(self):
+        """处理完已提交的帧块，停止工作进程并释放共享内存"""
+        if self.closed:
+            return
+        self.closed = True
+        if not self.workers:
+            return
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(5.0)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self.collector.join()
+        self.buffer = None  # 释放对共享内存的引用后才能关闭
+        self.shm.close()
+        self.shm.unlink()
+
+
+def bench(spec, worker_counts, frames, block):
+    """不同工作进程数下的吞吐量（帧/秒）与各阶段中位耗时，并核对全部输出与同步处理一致
+
+    帧块以起始帧号为 tag 提交，输出的帧数、顺序或数值与同步处理不一致时返回 False。
+    """
+    data = SyntheticSpectrum(seed=0).read(frames).astype(DTYPE)
+    reference = Pipeline(parse_pipeline(spec)).apply(data)
+    expected = list(range(0, frames, block))
+    stages = ' -> '.join(stage.describe() + (' [pool]' if stage.heavy else '') for stage in parse_pipeline(spec))
+    print(f"{frames} frames in blocks of {block}: {stages}")
+    print(f"{'workers':>7}{'frames/s':>11}{'speedup':>9}{'max diff':>10}  stage p50 (ms)")
+    base = None
+    passed = True
+    for workers in worker_counts:
+        outputs = []  # (tag, 帧块)
+        ready = threading.Event()
+        pipeline = Pipeline(parse_pipeline(spec), workers, block=block, wait=True,
+                            on_output=lambda out, tag: (outputs.append((tag, out)), ready.set()))
+        pipeline.put(data[:block], 'warmup')  # 等工作进程启动完成，不计入时间也不参与核对
+        ready.wait()
+        outputs.clear()
+        pipeline.timings.reset()
+        t = time.perf_counter()
+        for i in expected:
+            pipeline.put(data[i:i + block], i)
+        pipeline.close()
+        rate = frames / (time.perf_counter() - t)
+        base = base or rate
+        tags = [tag for tag, _ in outputs]
+        result = np.concatenate([out for _, out in outputs]) if outputs else data[:0]
+        stages = '  '.join(f"{stage} {p50:.2f}" for stage, (_, _, p50, _, _, _) in pipeline.timings.summary().items())
+        if tags != expected or result.shape != reference.shape:
+            passed = False
+            print(f"{workers:>7}{rate:>11.0f}{rate / base:>8.2f}x{'FAIL':>10}  {len(result)} of {frames} frames, "
+                  f"blocks {'in order' if tags == sorted(tags) else 'out of order'}", flush=True)
+            continue
+        diff = float(np.abs(result - reference).max())
+        passed = passed and diff <= DIFF_TOLERANCE
+        print(f"{workers:>7}{rate:>11.0f}{rate / base:>8.2f}x{diff:>10.2g}  {stages}", flush=True)
+    print(format_report(pipeline.timings))
+    return passed
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Benchmark the processing pipeline versus worker processes")
+    parser.add_argument('mode', choices=['bench'])
+    parser.add_argument('--pipeline', default='median:5,deconvolve:30,baseline:31',
+                        help=f"stages, e.g. smooth:7,deconvolve:30/1.5@pool (stages: {', '.join(STAGES)})")
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4], help="worker process counts to compare")
+    parser.add_argument('--frames', type=int, default=20000, help="frames to process per run")
+    parser.add_argument('--block', type=int, default=DEFAULT_BLOCK, help="frames per block")
+    args = parser.parse_args(argv)
+    try:
+        parse_pipeline(args.pipeline)
+    except ValueError as e:
+        parser.error(str(e))
+    if not bench(args.pipeline, args.workers, args.frames, args.block):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+"""TSL1401 串口协议：ASCII 行帧与二进制帧的编解码"""
+import binascii
+import re
+from collections import namedtuple
+
+import numpy as np
+
+NPIXELS = 128  # 128像素传感器
+ADC_MAX = 1023  # 10 位 ADC
+BAUDRATE = 115200
+
+# 输出格式
+WIRE_ASCII = 'ascii'          # "v0,v1,...,v127\r\n"
+WIRE_BINARY16 = 'binary16'    # 每像素 2 字节小端
+WIRE_PACKED10 = 'packed10'    # 每 4 像素 5 字节：4 个低 8 位 + 1 个高 2 位字节
+
+# 固件 'B' 命令的参数
+MODE_ARGS = {WIRE_ASCII: b'0', WIRE_BINARY16: b'16', WIRE_PACKED10: b'10'}
+REPLY_PREFIX = b'CMD:'  # 固件的命令回复行
+MODE_REPLY = b'CMD: Output mode '
+# 握手：停止命令无副作用，所有固件版本都会回复
+HANDSHAKE = b'X'
+HANDSHAKE_REPLY = b'CMD: Capture stopped'
+# 版本查询：回复 "CMD: Version <n> <功能>..."，版本 1 的固件不回复
+VERSION_COMMAND = b'V'
+FEATURE_FAST = 'fast'  # F 命令：端口直接读写 + 快速 ADC，整帧缓冲后发送
+FEATURE_EXPOSURE = 'exposure'  # E 命令：曝光时间与读出解耦（高速模式下有效）
+FirmwareInfo = namedtuple('FirmwareInfo', 'version features')
+LEGACY_FIRMWARE = FirmwareInfo(1, frozenset())
+
+# 固件回复 -> 状态键和值的转换
+_REPLIES = (
+    (re.compile(rb'CMD: Output mode (\w+)'), 'mode', lambda m: m.decode()),
+    (re.compile(rb'CMD: Version (\d+)(.*)'), 'version',
+     lambda m, rest: FirmwareInfo(int(m), frozenset(rest.decode('ascii', 'ignore').split()))),
+    (re.compile(rb'CMD: Fast mode (on|off)'), 'fast', lambda m: m == b'on'),
+    (re.compile(rb'CMD: Exposure set to (\d+)us'), 'exposure_us', int),
+    (re.compile(rb'CMD: Frame delay set to (\d+)ms'), 'delay_ms', int),
+    (re.compile(rb'CMD: (Continuous capture started|Capture stopped)'), 'capturing',
+     lambda m: m != b'Capture stopped'),
+)
+
+# 二进制帧：同步字(2) + 序号(2, 小端) + 像素数据 + CRC16(2, 小端)
+SYNC = b'\xA5\x5A'
+HEADER_SIZE = 4
+CRC_SIZE = 2
+CRC_INIT = 0xFFFF  # CRC-16/CCITT-FALSE，与 avr-libc 的 _crc_xmodem_update 一致
+PAYLOAD_SIZE = {
+    WIRE_BINARY16: NPIXELS * 2,
+    WIRE_PACKED10: NPIXELS * 10 // 8,
+}
+
+MAX_REPLY = 128  # 命令回复行的最大长度
+MAX_LINE = 1024  # ASCII 帧行的最大长度（128 个 4 位数 + 逗号约 640 字节）
+
+# 一次解析的结果：frames 为 (n, 128) uint16，seq 为 (n,) uint16 帧序号（ASCII 为空），
+# reply 为遇到的命令回复行（没有则为 None），consumed 为可以从缓冲区头部丢弃的字节数；
+# 其余为本次丢弃的损坏帧、截断帧、数值超出 ADC 范围的帧数和不属于有效帧/回复的字节数
+Decoded = namedtuple('Decoded', 'frames seq reply consumed malformed truncated out_of_range skipped')
+
+_PACKED_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint16)
+
+
+def frame_size(wire_format):
+    """一个二进制帧的总字节数"""
+    return HEADER_SIZE + PAYLOAD_SIZE[wire_format] + CRC_SIZE
+
+
+def mode_command(wire_format):
+    """切换固件输出格式的命令"""
+    return b'B' + MODE_ARGS[wire_format] + b'\n'
+
+
+def fast_command(enabled):
+    """打开/关闭固件高速模式的命令，旧固件会忽略"""
+    return b'F1\n' if enabled else b'F0\n'
+
+
+def exposure_command(us):
+    """设置曝光时间(微秒)的命令，0 表示积分时间等于帧周期"""
+    return b'E%d\n' % int(us)
+
+
+def delay_command(ms):
+    """设置帧间隔(毫秒)的命令，补零到 3 位：固件收到 T 后至少要有 3 个字节才读取参数"""
+    return b'T%03d\n' % int(ms)
+
+
+def parse_reply(line):
+    """解析固件的命令回复为 (状态键, 值)，不认识的回复返回 (None, None)
+
+    状态键：mode、version（FirmwareInfo）、fast、exposure_us、delay_ms、capturing。
+    """
+    if isinstance(line, str):
+        line = line.encode('ascii', 'ignore')
+    line = line.strip()
+    for pattern, key, convert in _REPLIES:
+        match = pattern.fullmatch(line)
+        if match:
+            value = convert(*match.groups())
+            if key == 'mode' and value not in MODE_ARGS:
+                return None, None
+            return key, value
+    return None, None
+
+
+def parse_mode_reply(line):
+    """解析固件的格式确认回复，不是确认回复时返回 None"""
+    if isinstance(line, str):
+        line = line.encode('ascii', 'ignore')
+    line = line.strip()
+    if not line.startswith(MODE_REPLY):
+        return None
+    name = line[len(MODE_REPLY):].decode('ascii', 'ignore')
+    return name if name in MODE_ARGS else None
+
+
+def _unpack_payload(raw, wire_format):
+    """(n, frame_size) 的原始字节 -> (n, 128) uint16"""
+    n = len(raw)
+    payload = raw[:, HEADER_SIZE:HEADER_SIZE + PAYLOAD_SIZE[wire_format]]
+    if wire_format == WIRE_BINARY16:
+        return np.ascontiguousarray(payload).view('<u2').astype(np.uint16, copy=False)
+
+    groups = payload.reshape(n, NPIXELS // 4, 5)
+    low = groups[..., :4].astype(np.uint16)
+    high = (groups[..., 4:5].astype(np.uint16) >> _PACKED_SHIFTS) & 0x3
+    return (low | (high << 8)).reshape(n, NPIXELS)
+
+
+def _empty():
+    return np.empty((0, NPIXELS), dtype=np.uint16)
+
+
+def _no_seq():
+    return np.empty(0, dtype=np.uint16)
+
+
+def _find_sync(raw):
+    """向量化查找所有同步字位置"""
+    return np.flatnonzero((raw[:-1] == SYNC[0]) & (raw[1:] == SYNC[1]))
+
+
+def _find_replies(raw):
+    """向量化查找所有命令回复前缀 "CMD:" 的位置"""
+    # 先找首字节，再只检查这些位置的后续字节
+    found = np.flatnonzero(raw[:max(len(raw) - len(REPLY_PREFIX) + 1, 0)] == REPLY_PREFIX[0])
+    for k in range(1, len(REPLY_PREFIX)):
+        found = found[raw[found + k] == REPLY_PREFIX[k]]
+    return found
+
+
+def _partial_tail(raw):
+    """末尾可能是同步字或 "CMD:" 开头一部分的字节数，留到收到后续数据再判断"""
+    for k in range(min(len(REPLY_PREFIX) - 1, len(raw)), 0, -1):
+        if bytes(raw[-k:]) == REPLY_PREFIX[:k]:
+            return k
+    return 1 if len(raw) and raw[-1] == SYNC[0] else 0
+
+
+def _reply_line(raw, start):
+    """start 处的命令回复行
+
+    返回 (回复, 行尾之后的位置)；行还没收完时返回 (None, start)；
+    不是可打印的回复行（数据中碰巧出现 "CMD:"）时返回 None。
+    """
+    line = raw[start:start + MAX_REPLY]
+    newline = np.flatnonzero(line == ord('\n'))
+    text = line[:newline[0]] if newline.size else line
+    if not ((text >= 0x20) & (text < 0x7F) | (text == ord('\r'))).all():
+        return None
+    if not newline.size:
+        return None if len(line) >= MAX_REPLY else (None, int(start))
+    return bytes(text).strip(), int(start + newline[0]) + 1
+
+
+def decode_binary(buf, wire_format=WIRE_BINARY16):
+    """把缓冲区里所有完整的二进制帧一次性解码
+
+    buf 可以是 bytes/bytearray/memoryview，返回 Decoded，seq 为各帧的 uint16 序号。
+    同步字错位或 CRC 错误时从下一个同步字重新对齐：CRC 错误的帧内又出现同步字时
+    计为截断帧（中间丢了字节），否则计为损坏帧。帧之间的 "CMD:" 行作为命令回复返回，
+    解析停在该行之后，由调用方处理（如切换格式）后继续。
+    """
+    size = frame_size(wire_format)
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    end = len(raw)
+    candidates = _find_sync(raw)
+    blocks = []
+    block_starts = []  # 各帧块的 (起点, 帧数)
+    bad_frames = []  # (位置, 是否截断)
+
+    def next_sync(start):
+        i = np.searchsorted(candidates, start)
+        return int(candidates[i]) if i < len(candidates) else -1
+
+    with memoryview(buf) as view:
+        view = view.cast('B')
+        pos = next_sync(0)
+        while pos != -1 and pos + size <= end:
+            n = (end - pos) // size
+            run = raw[pos:pos + n * size].reshape(n, size)
+
+            # 连续帧的同步字必须都在固定步长上
+            synced = (run[:, 0] == SYNC[0]) & (run[:, 1] == SYNC[1])
+            if not synced.all():
+                n = int(np.argmin(synced))
+                run = run[:n]
+
+            expected = run[:, -2].astype(np.uint16) | (run[:, -1].astype(np.uint16) << 8)
+            actual = np.fromiter(
+                (binascii.crc_hqx(view[s + 2:s + size - CRC_SIZE], CRC_INIT)
+                 for s in range(pos, pos + n * size, size)),
+                dtype=np.uint16, count=n,
+            )
+            crc_ok = actual == expected
+            good = n if crc_ok.all() else int(np.argmin(crc_ok))
+            if good:
+                blocks.append(run[:good])
+                block_starts.append((pos, good))
+            pos += good * size
+
+            if good < n:
+                # CRC 错误：可能是假同步字，从下一个字节开始重新搜索
+                bad = pos
+                pos = next_sync(bad + 1)
+                bad_frames.append((bad, pos != -1 and pos < bad + size))
+            elif pos + size <= end:
+                # 同步字错位，重新对齐
+                pos = next_sync(pos + 1)
+
+    if pos == -1:
+        # 末尾可能是半个同步字或半个回复前缀
+        consumed = end - _partial_tail(raw)
+    else:
+        consumed = pos
+
+    frames_raw = np.concatenate(blocks) if blocks else np.empty((0, size), dtype=np.uint8)
+    reply = None
+    reply_size = 0
+    limit = end  # 回复行之后的数据留到下次解析
+    replies = _find_replies(raw).tolist()
+    if replies:
+        starts = np.concatenate([p + size * np.arange(n) for p, n in block_starts] + [np.empty(0, np.intp)])
+    for start in replies:
+        k = np.searchsorted(starts, start, 'right') - 1
+        if k >= 0 and start < starts[k] + size:
+            continue  # 在校验通过的帧内，是像素数据
+        line = _reply_line(raw, start)
+        if line is None:
+            continue
+        reply, after = line
+        if reply is None:
+            consumed = min(consumed, after)  # 回复行还没收完
+        else:
+            consumed = after
+            reply_size = after - start
+        limit = start
+        keep = starts < start
+        frames_raw, starts = frames_raw[keep], starts[keep]
+        break
+    truncated = sum(1 for at, cut in bad_frames if at < limit and cut)
+    malformed = sum(1 for at, cut in bad_frames if at < limit and not cut)
+
+    seq = frames_raw[:, 2].astype(np.uint16) | (frames_raw[:, 3].astype(np.uint16) << 8)
+    frames = _unpack_payload(frames_raw, wire_format) if len(frames_raw) else _empty()
+    out_of_range = 0
+    if wire_format == WIRE_BINARY16 and len(frames):
+        valid = (frames <= ADC_MAX).all(axis=1)
+        if not valid.all():
+            out_of_range = int(np.count_nonzero(~valid))
+            frames, seq = frames[valid], seq[valid]
+    skipped = consumed - len(frames_raw) * size - reply_size
+    return Decoded(frames, seq, reply, consumed, malformed, truncated, out_of_range, skipped)
+
+
+def decode_ascii(buf):
+    """把缓冲区里所有完整的 ASCII 行一次性解码，返回 Decoded（seq 为空）
+
+    行边界、逗号和数字都用 NumPy 向量化查找，不逐行调用 int()。
+    遇到 "CMD:" 命令回复时停在该行之后。其余非空行中：含其他字符的为损坏帧，
+    只有数字和逗号但个数不对的为截断帧，格式正确但数值超出 ADC 范围的单独计数。
+    超过 MAX_LINE 仍没有换行的数据当作损坏帧丢弃，乱码不会占满接收缓冲区。
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(raw == ord('\n'))
+    reply = None
+    reply_size = 0
+    consumed = int(ends[-1]) + 1 if ends.size else 0
+    malformed = 0
+    for start in _find_replies(raw).tolist():
+        line = _reply_line(raw, start)
+        if line is None:
+            continue
+        ends = ends[ends < start]
+        consumed = int(ends[-1]) + 1 if ends.size else 0
+        if line[0] is not None:
+            # 回复行之前同一行里的残片
+            if (raw[consumed:start] > ord(' ')).any():
+                malformed += 1
+            reply, consumed = line
+            reply_size = consumed - start
+        break
+    else:
+        if len(raw) - consumed > MAX_LINE:
+            malformed += 1
+            consumed = len(raw)
+
+    if not ends.size:
+        return Decoded(_empty(), _no_seq(), reply, consumed, malformed, 0, 0, consumed - reply_size)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    seg = raw[:ends[-1] + 1]
+    digit = (seg >= ord('0')) & (seg <= ord('9'))
+    comma = seg == ord(',')
+    other = ~(digit | comma | (seg == ord('\r')) | (seg == ord('\n')))
+    first_digit = digit & ~np.concatenate(([False], digit[:-1]))
+    tok_start = np.flatnonzero(first_digit)
+    tok_end = np.flatnonzero(digit & ~np.concatenate((digit[1:], [False])))
+
+    n_tokens = np.add.reduceat(first_digit, starts, dtype=np.intp)
+    n_commas = np.add.reduceat(comma, starts, dtype=np.intp)
+    n_other = np.add.reduceat(other, starts, dtype=np.intp)
+
+    # 按位累加每个数字，最多 5 位
+    length = tok_end - tok_start + 1
+    values = np.zeros(len(tok_start), dtype=np.uint32)
+    for k in range(min(int(length.max(initial=0)), 5)):
+        has = length > k
+        values[has] = values[has] * 10 + (seg[tok_start[has] + k] - ord('0'))
+    bad_token = (length > 4) | (values > ADC_MAX)
+    line_of_token = np.repeat(np.arange(len(starts)), n_tokens)
+    bad_line = np.bincount(line_of_token[bad_token], minlength=len(starts)) > 0
+
+    shaped = (n_tokens == NPIXELS) & (n_commas == NPIXELS - 1) & (n_other == 0)
+    good = shaped & ~bad_line
+    blank = ends - starts <= 1  # 空行或只有 '\r'
+    malformed += int(np.count_nonzero(n_other > 0))
+    truncated = int(np.count_nonzero(~shaped & (n_other == 0) & ~blank))
+    out_of_range = int(np.count_nonzero(shaped & bad_line))
+    skipped = consumed - reply_size - int((ends - starts + 1)[good].sum())
+
+    frames = values[np.repeat(good, n_tokens)].astype(np.uint16).reshape(-1, NPIXELS)
+    return Decoded(frames, _no_seq(), reply, consumed, malformed, truncated, out_of_range, skipped)
+
+
+def encode_binary(frames, seq_start=0, wire_format=WIRE_BINARY16):
+    """把 (n, 128) 帧编码为固件相同格式的二进制数据"""
+    frames = np.atleast_2d(np.asarray(frames, dtype=np.uint16))
+    n = len(frames)
+    size = frame_size(wire_format)
+    out = np.empty((n, size), dtype=np.uint8)
+    out[:, 0] = SYNC[0]
+    out[:, 1] = SYNC[1]
+    seq = (seq_start + np.arange(n)) & 0xFFFF
+    out[:, 2] = seq & 0xFF
+    out[:, 3] = seq >> 8
+
+    payload = out[:, HEADER_SIZE:HEADER_SIZE + PAYLOAD_SIZE[wire_format]]
+    if wire_format == WIRE_BINARY16:
+        payload[:] = frames.astype('<u2').view(np.uint8)
+    else:
+        values = (frames & 0x3FF).reshape(n, NPIXELS // 4, 4)
+        groups = payload.reshape(n, NPIXELS // 4, 5)
+        groups[..., :4] = values & 0xFF
+        groups[..., 4] = ((values >> 8) << _PACKED_SHIFTS).sum(axis=-1)
+
+    for row in out:
+        crc = binascii.crc_hqx(row[2:-CRC_SIZE].tobytes(), CRC_INIT)
+        row[-2] = crc & 0xFF
+        row[-1] = crc >> 8
+    return out.tobytes()
+
+
+def encode_ascii(frame):
+    """按固件 ASCII 格式编码一帧"""
+    return ','.join(str(int(v)) for v in frame).encode('ascii') + b'\r\n'
@@ -0,0 +1,413 @@
+"""串口批量读取：预分配接收缓冲区 + 每次唤醒解析多帧
+
+解析器可以用随机字节流做模糊测试，并测量解析吞吐量：
+
+    python -m tsl1401 parse fuzz --seconds 60
+    python -m tsl1401 parse bench --corrupt 0 0.01 0.1
+
+还可以经伪终端比较旧的逐行读取和批量读取：两者收到同一个虚拟设备（同一随机种子）的
+ASCII 字节流，报告帧率和主机进程的 CPU 占用（仅 POSIX）：
+
+    python -m tsl1401 parse serial --fps 200 100000 --duration 5
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from . import protocol
+
+
+class StreamBuffer:
+    """预分配的接收缓冲区
+
+    读写指针在同一块内存中循环使用，空间不够时把未解析数据搬回开头，
+    仍然不够则丢弃最旧的字节（计入 overflow）。
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.head = 0  # 未解析数据起点
+        self.tail = 0  # 下一次写入位置
+        self.overflow = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def clear(self):
+        self.head = self.tail = 0
+
+    def reserve(self, n):
+        """保证尾部至少有 n 字节可写空间，返回实际可写字节数"""
+        n = min(n, self.capacity)
+        if self.tail + n <= self.capacity:
+            return n
+        size = len(self)
+        if size + n > self.capacity:
+            # 缓冲区满：丢弃最旧的数据
+            drop = size + n - self.capacity
+            self.overflow += drop
+            self.head += drop
+            size -= drop
+        self.buffer[:size] = self.buffer[self.head:self.tail]
+        self.head, self.tail = 0, size
+        return n
+
+    def feed(self, data):
+        """写入一段已读取的数据"""
+        data = data[-self.capacity:]
+        n = self.reserve(len(data))
+        self.buffer[self.tail:self.tail + n] = data
+        self.tail += n
+
+    def fill(self, ser):
+        """从串口读取当前所有可用数据
+
+        没有数据时阻塞在串口上直到超时，而不是空转轮询。返回读取的字节数。
+        """
+        n = self.reserve(max(ser.in_waiting, 1))
+        with memoryview(self.buffer) as view:
+            got = ser.readinto(view[self.tail:self.tail + n])
+        self.tail += got
+        return got
+
+    def view(self):
+        """未解析数据的只读视图"""
+        return memoryview(self.buffer)[self.head:self.tail]
+
+    def consume(self, n):
+        self.head += n
+        if self.head == self.tail:
+            self.clear()
+
+
+class FrameReader:
+    """把接收缓冲区中的数据批量解析为 (n, 128) 帧块（不依赖 Qt）
+
+    流式状态机：状态为当前输出格式和未解析的数据，任意切分的字节流都得到相同结果。
+    数据帧和命令回复分开处理，遇到乱码时在下一个帧边界重新同步，不会抛出异常。
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.stream = StreamBuffer(capacity)
+        self.active_format = protocol.WIRE_ASCII  # 固件确认后的实际格式
+        self.frames = 0  # 解析出的有效帧数
+        self.malformed = 0  # 校验失败或含非法字符的帧数
+        self.truncated = 0  # 中途丢了字节的帧数
+        self.out_of_range = 0  # 格式正确但数值超出 ADC 范围的帧数
+        self.skipped = 0  # 重新同步时丢弃的字节数
+        self.missing = 0  # 按二进制帧序号推算的线路上丢失的帧数（含损坏后被丢弃的帧）
+        self.last_seq = None
+        self.replies = 0  # 收到的命令回复行数
+        self.last_reply = None
+        self.device_state = {}  # 固件回复报告的状态，如 {'version': FirmwareInfo, 'fast': True}
+        self.bytes_read = 0
+
+    @property
+    def errors(self):
+        """被丢弃的损坏/截断/超范围帧总数"""
+        return self.malformed + self.truncated + self.out_of_range
+
+    @property
+    def firmware(self):
+        """版本握手的结果，没有回复（旧固件或尚未回复）时为 LEGACY_FIRMWARE"""
+        return self.device_state.get('version', protocol.LEGACY_FIRMWARE)
+
+    def counters(self):
+        return {
+            'frames': self.frames,
+            'malformed': self.malformed,
+            'truncated': self.truncated,
+            'out_of_range': self.out_of_range,
+            'missing': self.missing,
+            'skipped_bytes': self.skipped,
+            'overflow_bytes': self.stream.overflow,
+            'replies': self.replies,
+            'bytes': self.bytes_read,
+        }
+
+    def fill(self, ser):
+        got = self.stream.fill(ser)
+        self.bytes_read += got
+        return got
+
+    def feed(self, data):
+        self.bytes_read += len(data)
+        self.stream.feed(data)
+
+    def clear(self):
+        self.stream.clear()
+        self.last_seq = None  # 丢弃的数据不算丢帧
+
+    def count_missing(self, seq):
+        """按帧序号统计丢失的帧，序号为 16 位、会回绕"""
+        if not len(seq):
+            return
+        seq = seq.astype(np.int64)
+        if self.last_seq is not None:
+            self.missing += (int(seq[0]) - self.last_seq - 1) & 0xFFFF
+        if len(seq) > 1:
+            self.missing += int(((np.diff(seq) - 1) & 0xFFFF).sum())
+        self.last_seq = int(seq[-1])
+
+    def decode(self):
+        """解析缓冲区中所有完整帧，遇到格式确认回复时切换解析方式"""
+        blocks = []
+        while True:
+            with self.stream.view() as data:
+                if self.active_format == protocol.WIRE_ASCII:
+                    decoded = protocol.decode_ascii(data)
+                else:
+                    decoded = protocol.decode_binary(data, self.active_format)
+                    self.count_missing(decoded.seq)
+            self.stream.consume(decoded.consumed)
+            self.malformed += decoded.malformed
+            self.truncated += decoded.truncated
+            self.out_of_range += decoded.out_of_range
+            self.skipped += decoded.skipped
+            if len(decoded.frames):
+                self.frames += len(decoded.frames)
+                blocks.append(decoded.frames)
+            if decoded.reply is None:
+                break
+            self.replies += 1
+            self.last_reply = decoded.reply
+            key, value = protocol.parse_reply(decoded.reply)
+            if key is not None:
+                self.device_state[key] = value
+            if key == 'mode':
+                self.active_format = value
+
+        if not blocks:
+            return np.empty((0, protocol.NPIXELS), dtype=np.uint16)
+        return blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+
+def _mutate(rng, data):
+    """对一帧的字节做一次随机破坏：翻转字节、丢失字节或插入乱码"""
+    data = bytearray(data)
+    kind = rng.integers(3)
+    at = int(rng.integers(len(data)))
+    if kind == 0:
+        data[at] ^= int(rng.integers(1, 256))
+    elif kind == 1:
+        del data[at:at + int(rng.integers(1, 32))]
+    else:
+        data[at:at] = rng.integers(0, 256, int(rng.integers(1, 32)), dtype=np.uint8).tobytes()
+    return bytes(data)
+
+
+def _garbage(rng, n):
+    """偏向同步字、换行、数字、逗号和 "CMD:" 的随机字节"""
+    alphabet = np.frombuffer(protocol.SYNC + b'\r\n0123456789,' + protocol.REPLY_PREFIX, dtype=np.uint8)
+    data = rng.integers(0, 256, n, dtype=np.uint8)
+    biased = rng.random(n) < 0.5
+    data[biased] = rng.choice(alphabet, int(biased.sum()))
+    return data.tobytes()
+
+
+def _chunks(pieces, rng):
+    """把数据切成随机长度的块；一部分用例按消息边界切（像设备逐条写入那样），再随机细分"""
+    if rng.random() < 0.3:
+        for piece in pieces:
+            cuts = np.sort(rng.integers(0, len(piece) + 1, int(rng.integers(3))))
+            yield from (piece[i:j] for i, j in zip([0, *cuts], [*cuts, len(piece)]) if j > i)
+        return
+    data = b''.join(pieces)
+    pos = 0
+    while pos < len(data):
+        n = int(rng.integers(1, 600 if rng.random() < 0.8 else 8))  # 也测试很小的分块
+        yield data[pos:pos + n]
+        pos += n
+
+
+def _parse_chunks(pieces, rng, wire_format=protocol.WIRE_ASCII):
+    """分块送入新的 FrameReader，返回 (reader, 帧)"""
+    reader = FrameReader()
+    reader.active_format = wire_format
+    blocks = []
+    for chunk in _chunks(pieces, rng):
+        reader.feed(chunk)
+        blocks.append(reader.decode())
+    return reader, np.concatenate(blocks) if blocks else np.empty((0, protocol.NPIXELS), np.uint16)
+
+
+def fuzz_case(rng):
+    """一个随机用例，不满足不变量时返回错误说明
+
+    流 = 格式确认回复 + 若干帧（部分被破坏）+ 穿插的其他回复；另有纯乱码流。
+    不变量：不抛异常；输出总是 (n, 128) 且不超出 ADC 范围；未破坏的流完整还原且不计错误；
+    每处破坏最多损失两帧；二进制帧不会凭空出现，丢帧计数与序号缺口一致。
+    """
+    formats = list(protocol.MODE_ARGS)
+    wire_format = formats[int(rng.integers(len(formats)))]
+    if rng.random() < 0.1:
+        reader, out = _parse_chunks([_garbage(rng, int(rng.integers(1, 20000)))], rng, wire_format)
+        if out.ndim != 2 or out.shape[1] != protocol.NPIXELS or (out > protocol.ADC_MAX).any():
+            return "garbage stream produced an invalid frame block"
+        return None
+
+    n = int(rng.integers(1, 200))
+    frames = rng.integers(0, protocol.ADC_MAX + 1, (n, protocol.NPIXELS), dtype=np.uint16)
+    seq0 = int(rng.integers(1 << 16))
+    rate = [0.0, 0.01, 0.1][int(rng.integers(3))]
+    pieces = [protocol.MODE_REPLY + wire_format.encode() + b'\r\n']
+    mutated = 0
+    replies = 1
+    for i, frame in enumerate(frames):
+        if wire_format == protocol.WIRE_ASCII:
+            data = protocol.encode_ascii(frame)
+        else:
+            data = protocol.encode_binary(frame, seq0 + i, wire_format)
+        if rng.random() < rate:
+            data = _mutate(rng, data)
+            mutated += 1
+        pieces.append(data)
+        if rng.random() < 0.02:
+            pieces.append(b'CMD: Frame delay set to 20ms\r\n')
+            replies += 1
+    if rng.random() < 0.5:
+        pieces.append(protocol.HANDSHAKE_REPLY + b'\r\n')  # 停止采集后的回复，后面没有帧
+        replies += 1
+    reader, out = _parse_chunks(pieces, rng)
+
+    if out.ndim != 2 or out.shape[1] != protocol.NPIXELS or (out > protocol.ADC_MAX).any():
+        return "invalid frame block"
+    if reader.active_format != wire_format:
+        return f"format not switched to {wire_format}"
+    if not mutated:
+        if len(out) != n or not (out == frames).all():
+            return f"clean stream: {len(out)} of {n} frames"
+        if reader.errors or reader.skipped or reader.missing:
+            return f"clean stream counted errors: {reader.counters()}"
+        if reader.replies != replies:
+            return f"clean stream: {reader.replies} of {replies} replies"
+        return None
+    if len(out) < n - 2 * mutated or len(out) > n:
+        return f"{mutated} corruptions lost {n - len(out)} of {n} frames"
+    if wire_format != protocol.WIRE_ASCII and len(out):
+        # 输出必须是输入的子序列
+        index = []
+        k = 0
+        for frame in out:
+            while k < n and not (frames[k] == frame).all():
+                k += 1
+            if k == n:
+                return "binary frame not in the input"
+            index.append(k)
+            k += 1
+        if reader.missing != index[-1] - index[0] + 1 - len(out):
+            return f"missing {reader.missing} does not match sequence gaps"
+    return None
+
+
+def fuzz(seconds, seed):
+    """运行随机用例 seconds 秒，返回失败数"""
+    rng = np.random.default_rng(seed)
+    deadline = time.perf_counter() + seconds
+    cases = failures = 0
+    while time.perf_counter() < deadline:
+        state = rng.bit_generator.state
+        try:
+            error = fuzz_case(rng)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        cases += 1
+        if error:
+            failures += 1
+            print(f"case {cases} (state {state['state']['state']}): {error}")
+    print(f"{cases} cases, {failures} failures (seed {seed})")
+    return failures
+
+
+def bench(wire_format, nframes, corrupt, chunk, seed=0):
+    """解析吞吐量，与串口链路能传输的最高帧率比较"""
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, protocol.ADC_MAX + 1, (nframes, protocol.NPIXELS), dtype=np.uint16)
+    if wire_format == protocol.WIRE_ASCII:
+        pieces = [protocol.encode_ascii(frame) for frame in frames]
+    else:
+        pieces = [protocol.encode_binary(frames[i:i + 1024], i, wire_format) for i in range(0, nframes, 1024)]
+        pieces = b''.join(pieces)
+        size = protocol.frame_size(wire_format)
+        pieces = [pieces[i:i + size] for i in range(0, len(pieces), size)]
+    bad = rng.random(nframes) < corrupt
+    data = b''.join(_mutate(rng, piece) if b else piece for piece, b in zip(pieces, bad))
+
+    reader = FrameReader()
+    reader.active_format = wire_format
+    start = time.perf_counter()
+    for pos in range(0, len(data), chunk):
+        reader.feed(data[pos:pos + chunk])
+        reader.decode()
+    elapsed = time.perf_counter() - start
+    link = protocol.BAUDRATE / 10 / (len(data) / nframes)  # 8N1：每字节 10 位
+    print(f"{wire_format:<9} {corrupt:>6.1%} corrupt  {reader.frames / elapsed:>10.0f} frames/s  "
+          f"{len(data) / elapsed / 1e6:>6.1f} MB/s  ({reader.frames / elapsed / link:>6.0f}x the "
+          f"{link:.0f} frames/s link)  errors {reader.errors}  missing {reader.missing}")
+
+
+def serial_bench(rates, duration):
+    """逐行读取（bulk=False）与批量读取（bulk=True）经 pty 接收同一字节流的帧率和 CPU 占用
+
+    虚拟设备在子进程中运行，CPU 占用只计主机端的读取线程所在进程。
+    """
+    from .acquisition import SerialAcquisition
+
+    print(f"{'device fps':>10}  {'reader':>6}  {'frames/s':>9}  {'CPU':>5}  {'errors':>6}")
+    for fps in rates:
+        for bulk in (False, True):
+            device = subprocess.Popen([sys.executable, '-m', 'tsl1401', 'fake', '--fps', str(fps), '--seed', '0'],
+                                      stdout=subprocess.PIPE, text=True)
+            try:
+                port = device.stdout.readline().strip()
+                acquisition = SerialAcquisition(port, protocol.WIRE_ASCII, bulk=bulk,
+                                                ring_capacity=1 << 16)
+                acquisition.start()
+                acquisition.start_capture()
+                time.sleep(0.5)  # 跳过串口打开和开始采集的过渡
+                frames0, cpu0, t0 = acquisition.ring.count, time.process_time(), time.perf_counter()
+                time.sleep(duration)
+                frames, cpu, elapsed = (acquisition.ring.count - frames0, time.process_time() - cpu0,
+                                        time.perf_counter() - t0)
+                acquisition.stop_capture()
+                acquisition.stop()
+            finally:
+                device.terminate()
+                device.wait()
+            print(f"{fps:>10.0f}  {'bulk' if bulk else 'line':>6}  {frames / elapsed:>9.1f}  "
+                  f"{cpu / elapsed:>5.0%}  {acquisition.reader.errors:>6}")
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Fuzz or benchmark the streaming frame parser")
+    parser.add_argument('mode', choices=('fuzz', 'bench', 'serial'),
+                        help="fuzz: random streams; bench: in-memory throughput; "
+                             "serial: line vs bulk reader over a pty fake device")
+    parser.add_argument('--seconds', type=float, default=10.0, help="fuzz duration")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--formats', nargs='+', default=list(protocol.MODE_ARGS), choices=list(protocol.MODE_ARGS),
+                        help="wire formats to benchmark")
+    parser.add_argument('--frames', type=int, default=20000, help="frames per benchmark run")
+    parser.add_argument('--corrupt', type=float, nargs='+', default=[0.0, 0.01],
+                        help="fractions of corrupted frames to benchmark")
+    parser.add_argument('--chunk', type=int, default=4096, help="bytes per read in the benchmark")
+    parser.add_argument('--fps', type=float, nargs='+', default=[200.0, 100000.0],
+                        help="fake device frame rates for the serial benchmark; a huge rate is effectively unthrottled")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per serial benchmark run")
+    args = parser.parse_args(argv)
+    if args.mode == 'fuzz':
+        return 1 if fuzz(args.seconds, args.seed) else 0
+    if args.mode == 'serial':
+        serial_bench(args.fps, args.duration)
+        return
+    for wire_format in args.formats:
+        for corrupt in args.corrupt:
+            bench(wire_format, args.frames, corrupt, args.chunk, args.seed)
+
+
+if __name__ == '__main__':
+    main()
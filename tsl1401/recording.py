@@ -0,0 +1,261 @@
+"""帧录制：追加写入的二进制帧文件，回读为 np.memmap
+
+把录制导出为 CSV 和/或 NPZ（分块流式写出，不整体载入内存）：
+
+    python -m tsl1401 export recordings/spectrum_20240101_120000.tslrec --csv out.csv --npz out.npz
+"""
+import argparse
+import os
+import queue
+import struct
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from .protocol import NPIXELS
+
+# 文件头：魔数、版本、像素数、文件头长度、记录长度、创建时间，补齐到 64 字节
+MAGIC = b'TSL1401R'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIId36x')
+EXTENSION = '.tslrec'
+
+
+def record_dtype(npixels=NPIXELS):
+    """每帧一条定长记录：时间戳 + 帧序号 + 像素数据"""
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('seq', '<u8'),
+        ('pixels', '<u2', (npixels,)),
+    ])
+
+
+def write_header(f, npixels=NPIXELS):
+    f.write(HEADER.pack(MAGIC, VERSION, npixels, HEADER.size, record_dtype(npixels).itemsize, time.time()))
+
+
+def save_frames(path, frames, first_seq, timestamps):
+    """把一段连续的帧一次写成录制文件，timestamps 为每帧的时间戳"""
+    npixels = frames.shape[1]
+    records = np.empty(len(frames), dtype=record_dtype(npixels))
+    records['timestamp'] = timestamps
+    records['seq'] = np.arange(first_seq, first_seq + len(frames))
+    records['pixels'] = frames
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as f:
+        write_header(f, npixels)
+        records.tofile(f)
+
+
+class RecordingWriter(threading.Thread):
+    """后台写入线程
+
+    采集线程调用 write() 只把帧块放入有界队列，写线程批量合并后一次写入磁盘。
+    队列满时丢弃新帧并计入 dropped，不阻塞采集。
+    """
+
+    def __init__(self, path, npixels=NPIXELS, batch_frames=1024, flush_interval=1.0, max_queue=256):
+        super().__init__(daemon=True)
+        self.path = path
+        self.dtype = record_dtype(npixels)
+        self.batch_frames = batch_frames
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queue)
+        self.frames_written = 0
+        self.dropped = 0
+        self.error = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'wb')
+        write_header(self.file, npixels)
+
+    def write(self, frames, first_seq, timestamp=None):
+        """提交 (n, pixels) 帧块，first_seq 为第一帧的序号"""
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            self.queue.put_nowait((frames, first_seq, timestamp))
+        except queue.Full:
+            self.dropped += len(frames)
+
+    def close(self):
+        """写完队列中剩余的帧并关闭文件，写入出错时 error 为该 OSError
+
+        写线程已因错误退出时队列不再被取走，所以不能阻塞在 put 上。
+        """
+        while self.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+            except queue.Full:
+                continue
+            self.join()
+
+    def run(self):
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = ()
+                batch, done = [], item is None
+                if item:
+                    batch.append(item)
+                # 合并队列中已有的帧块，一次写入
+                count = sum(len(b[0]) for b in batch)
+                while not done and count < self.batch_frames:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        done = True
+                    else:
+                        batch.append(item)
+                        count += len(item[0])
+
+                if batch:
+                    self.write_batch(batch, count)
+                now = time.monotonic()
+                if done or now - last_flush >= self.flush_interval:
+                    self.file.flush()
+                    last_flush = now
+                if done:
+                    break
+        except OSError as e:
+            self.error = e
+            print(f"Recording error: {e}")
+        finally:
+            try:
+                self.file.close()  # 关闭时写出缓冲区中剩余的数据，同样可能出错
+            except OSError as e:
+                if self.error is None:
+                    self.error = e
+                    print(f"Recording error: {e}")
+
+    def write_batch(self, batch, count):
+        records = np.empty(count, dtype=self.dtype)
+        i = 0
+        for frames, first_seq, timestamp in batch:
+            n = len(frames)
+            records['timestamp'][i:i + n] = timestamp
+            records['seq'][i:i + n] = np.arange(first_seq, first_seq + n)
+            records['pixels'][i:i + n] = frames
+            i += n
+        records.tofile(self.file)
+        self.frames_written += count
+
+
+class Recording:
+    """只读打开录制文件，帧数据按需从磁盘映射而不载入内存"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path}: truncated header")
+        magic, self.version, self.npixels, header_size, record_size, self.created = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a TSL1401 recording")
+        if self.version != VERSION:
+            raise ValueError(f"{path}: unsupported recording version {self.version}")
+
+        self.dtype = record_dtype(self.npixels)
+        if record_size != self.dtype.itemsize:
+            raise ValueError(f"{path}: unexpected record size {record_size}")
+
+        # 文件末尾不完整的记录（例如异常中断）直接忽略
+        n = (os.path.getsize(path) - header_size) // record_size
+        if n > 0:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=header_size, shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def pixels(self):
+        """(n_frames, npixels) uint16"""
+        return self.records['pixels']
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    @property
+    def seq(self):
+        return self.records['seq']
+
+    def chunks(self, chunk_frames=65536):
+        """按块遍历记录"""
+        for start in range(0, len(self), chunk_frames):
+            yield self.records[start:start + chunk_frames]
+
+
+def export_csv(recording, path, chunk_frames=65536):
+    """分块流式导出为 CSV：timestamp, seq, p0..pN"""
+    columns = ['timestamp', 'seq'] + [f'p{i}' for i in range(recording.npixels)]
+    fmt = ['%.6f', '%d'] + ['%d'] * recording.npixels
+    with open(path, 'w', newline='') as f:
+        f.write(','.join(columns) + '\n')
+        for chunk in recording.chunks(chunk_frames):
+            table = np.empty((len(chunk), recording.npixels + 2))
+            table[:, 0] = chunk['timestamp']
+            table[:, 1] = chunk['seq']
+            table[:, 2:] = chunk['pixels']
+            np.savetxt(f, table, fmt=fmt, delimiter=',')
+
+
+def export_npz(recording, path, chunk_frames=65536):
+    """分块流式导出为 NPZ（timestamps / seq / pixels 三个数组），不整体载入内存"""
+    n = len(recording)
+    fields = [
+        ('timestamps', 'timestamp', np.dtype('<f8'), (n,)),
+        ('seq', 'seq', np.dtype('<u8'), (n,)),
+        ('pixels', 'pixels', np.dtype('<u2'), (n, recording.npixels)),
+    ]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, field, dtype, shape in fields:
+            with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape}
+                np.lib.format.write_array_header_2_0(f, header)
+                for chunk in recording.chunks(chunk_frames):
+                    f.write(np.ascontiguousarray(chunk[field], dtype=dtype).tobytes())
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Export a .tslrec recording to CSV or NPZ")
+    parser.add_argument('recording', help="recording file (.tslrec)")
+    parser.add_argument('--csv', metavar='OUT', help="write timestamp, seq and pixel columns as CSV")
+    parser.add_argument('--npz', metavar='OUT', help="write timestamps / seq / pixels arrays as NPZ")
+    args = parser.parse_args(argv)
+    if args.csv is None and args.npz is None:
+        parser.error("give --csv and/or --npz")
+
+    try:
+        recording = Recording(args.recording)
+    except (OSError, ValueError) as e:
+        print(e)
+        return 1
+    for path, export in ((args.csv, export_csv), (args.npz, export_npz)):
+        if path is None:
+            continue
+        t0 = time.perf_counter()
+        try:
+            export(recording, path)
+        except OSError as e:
+            print(f"export to {path} failed: {e}")
+            return 1
+        print(f"{len(recording)} frames -> {path} ({time.perf_counter() - t0:.2f} s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""离线回放：录制文件或合成光谱，按实时/倍速/不限速送入处理流水线（不依赖 Qt）
+
+命令行运行时不打开界面，测量 编码 -> 解析 -> 环形缓冲区 -> 校正 -> 累加 -> 统计 -> 寻峰 的吞吐量：
+
+    python -m tsl1401 replay synthetic --frames 20000 --speed 0
+    python -m tsl1401 replay recordings/spectrum_xxx.tslrec --speed 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from . import protocol
+from .averaging import AVERAGE_MODES, AVERAGE_NONE, FrameIntegrator
+from .calibration import Calibration
+from .protocol import NPIXELS
+from .reader import FrameReader
+from .recording import Recording
+from .ringbuffer import FrameRing
+from .spectral import find_peaks
+from .stats import RollingStats, frame_stats
+from .timing import StageTimer, format_report
+
+# 合成光谱的默认峰：(中心像素, 幅度, 宽度)，中间的峰会饱和
+DEFAULT_PEAKS = ((35, 700.0, 2.5), (64, 1200.0, 4.0), (96, 450.0, 3.0))
+
+
+class SyntheticSpectrum:
+    """合成光谱发生器：高斯峰 + 暗电流 + 读出噪声/散粒噪声 + 光强抖动 + 饱和截断"""
+
+    def __init__(self, peaks=DEFAULT_PEAKS, dark=40.0, read_noise=4.0, shot_gain=0.3,
+                 flicker=0.02, saturation=1023, rate=100.0, npixels=NPIXELS, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.rate = rate  # 标称帧率，实时回放时使用
+        self.npixels = npixels
+        x = np.arange(npixels)
+        self.profile = np.zeros(npixels)
+        for center, amplitude, width in peaks:
+            self.profile += amplitude * np.exp(-0.5 * ((x - center) / width) ** 2)
+        # 暗电流带有固定的逐像素偏差
+        self.dark = dark + self.rng.normal(0.0, dark * 0.1, npixels)
+        self.read_noise = read_noise
+        self.shot_gain = shot_gain
+        self.flicker = flicker
+        self.saturation = saturation
+        self.exposure = 1.0  # 光强 × 积分时间相对默认值的倍数，峰值按比例缩放
+
+    def read(self, n):
+        """生成 n 帧 (n, npixels) uint16"""
+        gain = 1.0 + self.flicker * self.rng.standard_normal((n, 1))
+        signal = self.profile * (gain * self.exposure) + self.dark
+        sigma = np.sqrt(self.read_noise ** 2 + self.shot_gain * signal)
+        signal += sigma * self.rng.standard_normal((n, self.npixels))
+        np.clip(signal, 0, self.saturation, out=signal)
+        return np.rint(signal).astype(np.uint16)
+
+
+class RecordingSource:
+    """从录制文件依次读取帧，loop 为 True 时读完后从头开始"""
+
+    def __init__(self, path, loop=True):
+        self.recording = Recording(path)
+        if not len(self.recording):
+            raise ValueError(f"{path}: recording is empty")
+        self.npixels = self.recording.npixels
+        self.loop = loop
+        self.position = 0
+
+        # 按录制时间估计标称帧率（同一批帧共用时间戳，只看首尾）
+        t = self.recording.timestamps
+        span = float(t[-1] - t[0]) if len(t) > 1 else 0.0
+        self.rate = (len(t) - 1) / span if span > 0 else 100.0
+
+    def read(self, n):
+        """读取最多 n 帧，非循环模式读完后返回空数组"""
+        pixels = self.recording.pixels
+        if self.position >= len(pixels):
+            if not self.loop:
+                return pixels[:0].copy()
+            self.position = 0
+        block = np.array(pixels[self.position:self.position + n])
+        self.position += len(block)
+        return block
+
+
+def open_source(name, loop=True, seed=None):
+    """'synthetic' 返回合成光谱发生器，否则按录制文件路径打开"""
+    if name == 'synthetic':
+        return SyntheticSpectrum(seed=seed)
+    return RecordingSource(name, loop)
+
+
+def encode_frames(frames, seq_start, wire_format):
+    """按固件输出格式编码帧块"""
+    if wire_format == protocol.WIRE_ASCII:
+        return b''.join(protocol.encode_ascii(frame) for frame in frames)
+    return protocol.encode_binary(frames, seq_start, wire_format)
+
+
+class Pacer:
+    """按 rate * speed 帧/秒计算每次应送出的帧数，speed 为 0 表示不限速"""
+
+    def __init__(self, rate, speed=1.0, max_batch=64):
+        self.rate = rate
+        self.speed = speed
+        self.max_batch = max_batch
+        self.restart()
+
+    def restart(self):
+        self.start = time.perf_counter()
+        self.sent = 0
+
+    def due(self):
+        """当前应送出的帧数"""
+        if not self.speed:
+            return self.max_batch
+        target = int((time.perf_counter() - self.start) * self.rate * self.speed)
+        return min(target - self.sent, self.max_batch)
+
+    def wait(self):
+        """休眠到下一帧到期"""
+        if self.speed:
+            next_time = self.start + (self.sent + 1) / (self.rate * self.speed)
+            time.sleep(max(next_time - time.perf_counter(), 0.0))
+
+    def advance(self, n):
+        self.sent += n
+
+    @property
+    def fps(self):
+        """实际送出的帧率"""
+        elapsed = time.perf_counter() - self.start
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+
+def run_pipeline(source, frames, speed=0.0, wire_format=protocol.WIRE_PACKED10, window=100,
+                 calibration=None, average=AVERAGE_NONE, average_n=10):
+    """不经过界面跑完整的解析/校正/累加/统计/寻峰流程，返回 (实际帧率, StageTimer)"""
+    timings = StageTimer(('source', 'encode', 'decode', 'ring', 'calibrate', 'integrate', 'stats', 'peaks'))
+    if calibration is None:
+        calibration = Calibration(npixels=source.npixels)
+    pacer = Pacer(source.rate, speed)
+    reader = FrameReader()
+    reader.active_format = wire_format
+    ring = FrameRing()
+    rolling = RollingStats(window, len(calibration.pixels))
+    integrator = FrameIntegrator(average, average_n, len(calibration.pixels))
+
+    while pacer.sent < frames:
+        n = min(pacer.due(), frames - pacer.sent)
+        if n <= 0:
+            pacer.wait()
+            continue
+        t = time.perf_counter()
+        block = source.read(n)
+        if not len(block):
+            break
+        timings.since('source', t)
+
+        t = time.perf_counter()
+        reader.feed(encode_frames(block, pacer.sent, wire_format))
+        timings.since('encode', t)
+
+        t = time.perf_counter()
+        decoded = reader.decode()
+        timings.since('decode', t)
+
+        t = time.perf_counter()
+        ring.write(decoded)
+        timings.since('ring', t)
+
+        t = time.perf_counter()
+        corrected = calibration.apply(decoded)
+        timings.since('calibrate', t)
+
+        t = time.perf_counter()
+        integrator.update_block(corrected)
+        spectrum = integrator.result()
+        timings.since('integrate', t)
+
+        t = time.perf_counter()
+        rolling.update_block(corrected)
+        frame_stats(spectrum)
+        timings.since('stats', t)
+
+        t = time.perf_counter()
+        find_peaks(corrected)  # 按整块测量，代表最坏情况
+        timings.since('peaks', t)
+        pacer.advance(len(block))
+
+    return pacer.fps, timings
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description="Replay TSL1401 frames through the host pipeline without hardware")
+    parser.add_argument('source', nargs='?', default='synthetic',
+                        help="recording file, or 'synthetic' for generated spectra")
+    parser.add_argument('--frames', type=int, default=10000, help="number of frames to replay")
+    parser.add_argument('--speed', type=float, default=0.0, help="playback speed multiplier, 0 = as fast as possible")
+    parser.add_argument('--format', default=protocol.WIRE_PACKED10, choices=list(protocol.MODE_ARGS),
+                        help="wire format to encode and decode")
+    parser.add_argument('--seed', type=int, help="random seed for synthetic spectra")
+    parser.add_argument('--calibration', help="dark/flat calibration file to apply")
+    parser.add_argument('--average', default=AVERAGE_NONE, choices=AVERAGE_MODES, help="host-side frame averaging")
+    parser.add_argument('--average-n', type=int, default=10, help="number of frames to average")
+    args = parser.parse_args(argv)
+
+    source = open_source(args.source, seed=args.seed)
+    calibration = Calibration.load(args.calibration) if args.calibration else None
+    fps, timings = run_pipeline(source, args.frames, args.speed, args.format, calibration=calibration,
+                                average=args.average, average_n=args.average_n)
+    print(f"achieved {fps:.1f} frames/s ({args.format})")
+    print(format_report(timings))
+
+
+if __name__ == '__main__':
+    main()
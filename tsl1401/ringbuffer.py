@@ -0,0 +1,57 @@
+"""预分配的帧环形缓冲区，采集线程写入、GUI 线程读取"""
+import threading
+
+import numpy as np
+
+from .protocol import NPIXELS
+
+
+class FrameRing:
+    """(capacity, 128) 的 uint16 帧环形缓冲区
+
+    帧用单调递增的绝对序号定位：第 i 帧存放在 frames[i % capacity]，
+    只有最近 capacity 帧可读，更早的已被覆盖。
+    """
+
+    def __init__(self, capacity=1024, npixels=NPIXELS, dtype=np.uint16):
+        self.frames = np.zeros((capacity, npixels), dtype=dtype)
+        self.capacity = capacity
+        self.count = 0  # 已写入的总帧数
+        self.lock = threading.Lock()
+
+    def write(self, block):
+        """写入 (n, npixels) 帧块，返回其绝对序号区间 (start, stop)"""
+        n = len(block)
+        if n > self.capacity:
+            block = block[-self.capacity:]
+        m = len(block)
+        with self.lock:
+            stop = self.count + n
+            i = (stop - m) % self.capacity
+            first = min(m, self.capacity - i)
+            self.frames[i:i + first] = block[:first]
+            self.frames[:m - first] = block[first:]
+            self.count = stop
+        return stop - n, stop
+
+    def read(self, start, stop=None):
+        """复制 [start, stop) 中仍在缓冲区内的帧，返回 (block, 实际起点)
+
+        start 为负数（如写入不足 n 帧时的 latest(n)）时从第 0 帧开始，不会读到未写入的槽位。
+        """
+        with self.lock:
+            stop = self.count if stop is None else min(stop, self.count)
+            start = max(start, 0, self.count - self.capacity)
+            if start >= stop:
+                return self.frames[:0].copy(), stop
+            i = start % self.capacity
+            j = stop % self.capacity or self.capacity
+            if i < j:
+                block = self.frames[i:j].copy()
+            else:
+                block = np.concatenate((self.frames[i:], self.frames[:j]))
+        return block, start
+
+    def latest(self, n=1):
+        """最近 n 帧，已写入的帧不足 n 帧时只返回已写入的帧"""
+        return self.read(self.count - n)[0]
@@ -0,0 +1,485 @@
+"""实时帧分发：采集线程把帧块交给 asyncio 服务器，广播给任意多个 TCP / Unix socket 订阅者（不依赖 Qt）
+
+每个订阅者有独立的有界队列，满时丢弃最旧的帧块，慢客户端不会拖慢采集或其他客户端。
+订阅时可要求服务器端抽取 / 帧累加。
+
+连接后客户端先发送一行 JSON 订阅参数（可为 {}）：
+
+    {"decimate": 10, "average": "boxcar", "n": 10}
+
+服务器回复一行 JSON（出错时为 {"error": ...}），之后连续发送帧块：
+BLOCK 头 + nframes * npixels 个小端像素值（原始帧为 uint16，累加结果为 float32）。
+
+    python -m tsl1401 serve --replay synthetic --listen 127.0.0.1:8765
+    python -m tsl1401 subscribe --connect 127.0.0.1:8765 --decimate 10 --duration 5
+    python -m tsl1401 serve bench --clients 1 10 100 --fps 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from .averaging import AVERAGE_MODES, AVERAGE_NONE, FrameIntegrator
+from .protocol import NPIXELS
+
+# 帧块头：魔数、第一帧序号、采集时间戳、该订阅者累计丢弃的帧数、帧数、像素数、数据类型
+BLOCK = struct.Struct('<4sQdIHHB3x')
+BLOCK_MAGIC = b'TSLB'
+DTYPES = (np.dtype('<u2'), np.dtype('<f4'))  # 数据类型代码 -> dtype
+DEFAULT_ADDRESS = ('127.0.0.1', 8765)
+
+# 客户端收到的帧块
+Block = namedtuple('Block', ['seq', 'timestamp', 'dropped', 'frames'])
+
+
+class _Published:
+    """一个采集帧块，原始字节只在第一次需要时编码，所有不做处理的订阅者共用"""
+
+    __slots__ = ('frames', 'seq', 'timestamp', '_raw')
+
+    def __init__(self, frames, seq, timestamp):
+        self.frames = frames
+        self.seq = seq
+        self.timestamp = timestamp
+        self._raw = None
+
+    def raw(self):
+        if self._raw is None:
+            self._raw = self.frames.astype('<u2', copy=False).tobytes()
+        return self._raw
+
+
+class Subscription:
+    """一个订阅者：有界队列（超过 queue_frames 帧时丢弃最旧的帧块）+ 抽取/帧累加状态
+
+    帧块大小随合并程度变化，队列按帧数而不是块数限制，积压的时间才有上限。
+    """
+
+    def __init__(self, writer, decimate=1, average=AVERAGE_NONE, n=10, queue_frames=256, npixels=NPIXELS):
+        if int(decimate) < 1:
+            raise ValueError("decimate must be >= 1")
+        self.writer = writer
+        self.decimate = int(decimate)
+        self.integrator = FrameIntegrator(average, n, npixels) if average != AVERAGE_NONE else None
+        self.queue = deque()
+        self.queue_frames = queue_frames
+        self.queued = 0  # 队列中的帧数
+        self.ready = asyncio.Event()
+        self.phase = 0  # 距下一个输出帧还需的帧数
+        self.sent = 0  # 已发送的帧数
+        self.dropped = 0  # 因队列满丢弃的原始帧数
+
+    @property
+    def dtype_code(self):
+        return 0 if self.integrator is None else 1
+
+    def put(self, block):
+        self.queue.append(block)
+        self.queued += len(block.frames)
+        while self.queued > self.queue_frames and len(self.queue) > 1:
+            n = len(self.queue.popleft().frames)
+            self.queued -= n
+            self.dropped += n
+        self.ready.set()
+
+    def take(self):
+        block = self.queue.popleft()
+        self.queued -= len(block.frames)
+        return block
+
+    def encode(self, block):
+        """按订阅参数处理一个帧块并编码，没有输出帧时返回 None"""
+        frames = block.frames
+        k = self.decimate
+        # 本块中输出帧的下标
+        index = np.arange(self.phase, len(frames), k)
+        self.phase = (self.phase - len(frames)) % k
+        if not len(index):
+            if self.integrator is not None:
+                self.integrator.update_block(frames)
+            return None
+
+        if self.integrator is None:
+            if k == 1:
+                payload = block.raw()
+            else:
+                payload = frames[index].astype('<u2', copy=False).tobytes()
+        else:
+            out = np.empty((len(index), frames.shape[1]), dtype='<f4')
+            start = 0
+            for i, stop in enumerate(index + 1):
+                self.integrator.update_block(frames[start:stop])
+                out[i] = self.integrator.result()
+                start = stop
+            self.integrator.update_block(frames[start:])
+            payload = out.tobytes()
+        self.sent += len(index)
+        header = BLOCK.pack(BLOCK_MAGIC, block.seq + int(index[0]), block.timestamp, self.dropped & 0xFFFFFFFF,
+                            len(index), frames.shape[1], self.dtype_code)
+        return header + payload
+
+
+class FrameServer(threading.Thread):
+    """在后台线程运行 asyncio 事件循环的帧分发服务器
+
+    write() 与 RecordingWriter.write 接口相同，由采集线程调用，
+    只把帧块转交给事件循环，不做编码也不等待网络。
+    事件循环忙时到达的帧块在下一次分发时合并为一块，订阅者越多合并越多，
+    每块的固定开销不会随订阅者数成倍增加。
+    """
+
+    HANDSHAKE_TIMEOUT = 5.0
+    # 限制内核和 asyncio 的发送缓冲区：否则积压的数据停留在缓冲区里而不进入丢弃策略，延迟随之增加
+    SEND_BUFFER = 1 << 14
+
+    def __init__(self, address=DEFAULT_ADDRESS, unix_path=None, queue_frames=256, npixels=NPIXELS):
+        super().__init__(daemon=True)
+        self.address = address  # (host, port)，为 None 时不监听 TCP
+        self.unix_path = unix_path
+        self.queue_frames = queue_frames
+        self.npixels = npixels
+        self.subscriptions = set()
+        self.published = 0  # 已收到的帧数
+        self.pending = []  # 等待分发的 (frames, first_seq, timestamp)
+        self.pending_lock = threading.Lock()
+        self.loop = None
+        self.servers = []
+        self.error = None
+        self.started = threading.Event()
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.listen())
+        except OSError as e:
+            self.error = e
+        finally:
+            self.started.set()
+        if self.error is None:
+            self.loop.run_forever()
+        for server in self.servers:
+            server.close()
+        # 断开仍在服务的客户端，等待各自的任务结束
+        for subscription in list(self.subscriptions):
+            subscription.writer.close()
+            subscription.ready.set()
+        tasks = asyncio.all_tasks(self.loop)
+        if tasks:
+            self.loop.run_until_complete(asyncio.wait(tasks, timeout=1.0))
+        self.loop.close()
+
+    async def listen(self):
+        if self.address is not None:
+            server = await asyncio.start_server(self.handle_client, *self.address)
+            self.address = server.sockets[0].getsockname()[:2]  # 端口为 0 时取实际端口
+            self.servers.append(server)
+        if self.unix_path is not None:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.servers.append(await asyncio.start_unix_server(self.handle_client, self.unix_path))
+
+    def wait_ready(self, timeout=5.0):
+        """等待开始监听，监听失败时抛出 OSError"""
+        self.started.wait(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def write(self, frames, first_seq, timestamp=None):
+        """提交 (n, pixels) 帧块，first_seq 为第一帧的序号"""
+        if timestamp is None:
+            timestamp = time.time()
+        self.published += len(frames)
+        if not self.subscriptions:
+            return
+        with self.pending_lock:
+            self.pending.append((frames, first_seq, timestamp))
+            if len(self.pending) > 1:
+                return  # 已安排分发
+        self.loop.call_soon_threadsafe(self.broadcast)
+
+    def broadcast(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        # 采集线程的帧序号连续，合并后时间戳取最早一块的
+        frames = pending[0][0] if len(pending) == 1 else np.concatenate([p[0] for p in pending])
+        block = _Published(frames, pending[0][1], pending[0][2])
+        for subscription in self.subscriptions:
+            subscription.put(block)
+
+    def close(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join(1.0)
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    def stats(self):
+        """[(已发送帧数, 丢弃帧数, 队列中的帧数)]，每个订阅者一项"""
+        return [(s.sent, s.dropped, s.queued) for s in list(self.subscriptions)]
+
+    async def handle_client(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.HANDSHAKE_TIMEOUT)
+            options = json.loads(line or b'{}')
+            if options.get('average', AVERAGE_NONE) not in AVERAGE_MODES:
+                raise ValueError(f"unknown averaging mode '{options['average']}'")
+            subscription = Subscription(writer, options.get('decimate', 1), options.get('average', AVERAGE_NONE),
+                                        options.get('n', 10), self.queue_frames, self.npixels)
+        except (asyncio.TimeoutError, ValueError, TypeError, AttributeError) as e:
+            writer.write(json.dumps({'error': str(e) or type(e).__name__}).encode() + b'\n')
+            writer.close()
+            return
+        writer.write(json.dumps({'npixels': self.npixels, 'dtype': DTYPES[subscription.dtype_code].str,
+                                 'decimate': subscription.decimate,
+                                 'average': options.get('average', AVERAGE_NONE)}).encode() + b'\n')
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SEND_BUFFER)
+        writer.transport.set_write_buffer_limits(high=self.SEND_BUFFER)
+        self.subscriptions.add(subscription)
+        watcher = asyncio.ensure_future(self.watch(reader, subscription))
+        try:
+            await self.pump(subscription)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.subscriptions.discard(subscription)
+            watcher.cancel()
+            writer.close()
+
+    async def watch(self, reader, subscription):
+        """客户端订阅后不再发送数据，读到 EOF 即已断开"""
+        try:
+            await reader.read()
+        except (ConnectionError, OSError):
+            pass
+        subscription.writer.close()
+        subscription.ready.set()
+
+    async def pump(self, subscription):
+        """把订阅者队列中的帧块写入 socket，等待发送期间新帧块继续进入队列"""
+        writer = subscription.writer
+        while True:
+            await subscription.ready.wait()
+            subscription.ready.clear()
+            if writer.is_closing():
+                return
+            # 积压的帧块合并为一次写入
+            chunks = []
+            while subscription.queue:
+                data = subscription.encode(subscription.take())
+                if data is not None:
+                    chunks.append(data)
+            if chunks:
+                writer.write(b''.join(chunks))
+                await writer.drain()
+
+
+async def subscribe(address, receive_buffer=None, **options):
+    """连接服务器并发送订阅参数，返回 (reader, writer, 服务器回复)
+
+    address 为 (host, port) 或 Unix socket 路径。需要低延迟时用 receive_buffer
+    限制接收缓冲区，处理不过来时由服务器丢弃旧帧，而不是在内核缓冲区里排队。
+    """
+    # asyncio 的读缓冲区上限同样限制为 receive_buffer
+    kwargs = {'limit': receive_buffer} if receive_buffer else {}
+    if isinstance(address, str):
+        reader, writer = await asyncio.open_unix_connection(address, **kwargs)
+    else:
+        reader, writer = await asyncio.open_connection(*address, **kwargs)
+    if receive_buffer:
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    writer.write(json.dumps(options).encode() + b'\n')
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    if 'error' in reply:
+        writer.close()
+        raise ValueError(reply['error'])
+    return reader, writer, reply
+
+
+async def read_block(reader):
+    """读取一个帧块"""
+    magic, seq, timestamp, dropped, nframes, npixels, code = BLOCK.unpack(await reader.readexactly(BLOCK.size))
+    if magic != BLOCK_MAGIC:
+        raise ValueError("stream out of sync")
+    dtype = DTYPES[code]
+    payload = await reader.readexactly(nframes * npixels * dtype.itemsize)
+    return Block(seq, timestamp, dropped, np.frombuffer(payload, dtype).reshape(nframes, npixels))
+
+
+def parse_address(text):
+    """"host:port" 或 "port" -> (host, port)"""
+    host, _, port = text.rpartition(':')
+    return host or DEFAULT_ADDRESS[0], int(port)
+
+
+async def _receive(address, options, duration, delay=0.0, receive_buffer=None):
+    """订阅 duration 秒，返回 (帧数, 字节数, 延迟列表, 服务器报告的丢弃帧数)"""
+    reader, writer, _ = await subscribe(address, receive_buffer, **options)
+    frames = nbytes = dropped = 0
+    latencies = []
+    end = time.perf_counter() + duration
+    try:
+        while time.perf_counter() < end:
+            block = await asyncio.wait_for(read_block(reader), max(end - time.perf_counter(), 0.001))
+            latencies.append(time.time() - block.timestamp)
+            frames += len(block.frames)
+            nbytes += BLOCK.size + block.frames.nbytes
+            dropped = block.dropped
+            if delay:
+                await asyncio.sleep(delay)  # 模拟慢客户端
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+    return frames, nbytes, latencies, dropped
+
+
+async def _receive_all(address, options, clients, duration, slow=0, delay=0.05, receive_buffer=None):
+    tasks = [_receive(address, options, duration, delay if i < slow else 0.0, receive_buffer)
+             for i in range(clients)]
+    return await asyncio.gather(*tasks)
+
+
+def subscribe_main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Subscribe to a TSL1401 frame server")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--connect', default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}", help="server HOST:PORT")
+    target.add_argument('--unix', help="server Unix socket path")
+    parser.add_argument('--decimate', type=int, default=1, help="keep every Nth frame")
+    parser.add_argument('--average', default=AVERAGE_NONE, choices=AVERAGE_MODES, help="server-side frame averaging")
+    parser.add_argument('--n', type=int, default=10, help="number of frames to average")
+    parser.add_argument('--clients', type=int, default=1, help="number of concurrent subscriptions")
+    parser.add_argument('--slow', type=int, default=0, help="how many of the clients sleep 50 ms after each block")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds to receive")
+    parser.add_argument('--rcvbuf', type=int, default=1 << 14,
+                        help="socket receive buffer in bytes, 0 = system default (bounds latency when overloaded)")
+    parser.add_argument('--json', action='store_true', help="print a machine-readable summary")
+    args = parser.parse_args(argv)
+
+    address = args.unix or parse_address(args.connect)
+    options = {'decimate': args.decimate, 'average': args.average, 'n': args.n}
+    results = asyncio.run(_receive_all(address, options, args.clients, args.duration, args.slow,
+                                       receive_buffer=args.rcvbuf))
+    frames = [r[0] for r in results]
+    latencies = np.array([x for r in results for x in r[2]]) * 1000
+    p50, p95 = np.percentile(latencies, [50, 95]) if len(latencies) else (0.0, 0.0)
+    summary = {
+        'clients': args.clients,
+        'frames_per_s': sum(frames) / args.duration,
+        'min_client_frames_per_s': min(frames[args.slow:] or frames) / args.duration,  # 不含慢客户端
+        'mbytes_per_s': sum(r[1] for r in results) / args.duration / 1e6,
+        'latency_p50_ms': float(p50),
+        'latency_p95_ms': float(p95),
+        'dropped': sum(r[3] for r in results),
+    }
+    if args.json:
+        print(json.dumps(summary))
+        return
+    print(f"{args.clients} client(s): {summary['frames_per_s']:.1f} frames/s total "
+          f"({summary['mbytes_per_s']:.2f} MB/s), slowest normal client {summary['min_client_frames_per_s']:.1f} frames/s")
+    print(f"latency p50 {p50:.2f} ms, p95 {p95:.2f} ms, dropped {summary['dropped']} frames")
+
+
+def bench(clients_list, fps, duration, decimate, slow):
+    """虚拟设备 -> 串口采集线程 -> 服务器 -> 子进程中的 N 个订阅者"""
+    from .acquisition import SerialAcquisition
+    from .fakedevice import FakeDevice
+
+    device = FakeDevice(fps, seed=0)
+    device.start()
+    acquisition = SerialAcquisition(device.port)
+    server = acquisition.server = FrameServer(('127.0.0.1', 0))
+    server.start()
+    server.wait_ready()
+    acquisition.start()
+    acquisition.start_capture()
+    print(f"{'clients':>7}  {'frames/s':>10}  {'min client':>10}  {'MB/s':>7}  {'p50 ms':>7}  {'p95 ms':>7}  "
+          f"{'dropped':>7}")
+    try:
+        for clients in clients_list:
+            cmd = [sys.executable, '-m', 'tsl1401', 'subscribe', '--connect', '%s:%d' % server.address,
+                   '--clients', str(clients), '--duration', str(duration), '--decimate', str(decimate),
+                   '--slow', str(min(slow, clients)), '--json']
+            cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=cwd)
+            if result.returncode:
+                raise RuntimeError(result.stderr)
+            s = json.loads(result.stdout)
+            print(f"{clients:>7}  {s['frames_per_s']:>10.1f}  {s['min_client_frames_per_s']:>10.1f}  "
+                  f"{s['mbytes_per_s']:>7.2f}  {s['latency_p50_ms']:>7.2f}  {s['latency_p95_ms']:>7.2f}  "
+                  f"{s['dropped']:>7}")
+    finally:
+        acquisition.stop()
+        server.close()
+        device.close()
+    print(f"source {acquisition.ring.count / max(device.pacer.sent, 1) * 100:.1f}% of "
+          f"{device.pacer.sent} emulated frames received by the acquisition thread")
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Serve live TSL1401 frames to many subscribers")
+    parser.add_argument('mode', nargs='?', default='serve', choices=('serve', 'bench'),
+                        help="serve: acquire and serve frames; bench: fan-out benchmark with a fake device")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--port', help="serial port to acquire from")
+    source.add_argument('--replay', metavar='SOURCE', help="recording file or 'synthetic' instead of a device")
+    parser.add_argument('--listen', default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}",
+                        help="TCP HOST:PORT to listen on, 'none' to disable")
+    parser.add_argument('--unix', help="also listen on this Unix socket path")
+    parser.add_argument('--queue', type=int, default=256, help="frames queued per subscriber before dropping the oldest")
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 100], help="bench: subscriber counts")
+    parser.add_argument('--fps', type=float, default=1000.0, help="bench: fake device frame rate")
+    parser.add_argument('--duration', type=float, default=5.0, help="bench: seconds per run")
+    parser.add_argument('--decimate', type=int, default=1, help="bench: decimation requested by subscribers")
+    parser.add_argument('--slow', type=int, default=0, help="bench: number of deliberately slow subscribers")
+    args = parser.parse_args(argv)
+
+    if args.mode == 'bench':
+        bench(args.clients, args.fps, args.duration, args.decimate, args.slow)
+        return
+    if not (args.port or args.replay):
+        parser.error("give --port or --replay")
+
+    from .acquisition import ReplayAcquisition, SerialAcquisition
+    from .replay import open_source
+    if args.replay:
+        acquisition = ReplayAcquisition(open_source(args.replay))
+    else:
+        acquisition = SerialAcquisition(args.port)
+    address = None if args.listen == 'none' else parse_address(args.listen)
+    server = acquisition.server = FrameServer(address, args.unix, args.queue)
+    server.start()
+    server.wait_ready()
+    acquisition.start()
+    acquisition.start_capture()
+    print(f"serving on {' and '.join(filter(None, ['%s:%d' % server.address if address else None, args.unix]))}",
+          flush=True)
+    try:
+        while acquisition.is_alive():
+            time.sleep(1.0)
+            stats = server.stats()
+            print(f"{server.published:>9} frames  {len(stats)} client(s)  "
+                  f"dropped {sum(s[1] for s in stats)}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        acquisition.stop()
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""光谱定标与峰值分析：像素 -> 波长多项式、整块帧的向量化多峰检测（不依赖 Qt）
+
+由参考谱线拟合波长定标：
+
+    python -m tsl1401 spectral fit 35=435.83 64=546.07 96=611.0 --degree 2 -o wavelength.json
+"""
+import argparse
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from .protocol import NPIXELS
+
+# 多峰检测结果，每个字段都是 (峰数,) 数组，position/fwhm 为输入数组下标单位（可为小数）
+Peaks = namedtuple('Peaks', ['frame', 'index', 'position', 'height', 'fwhm'])
+
+REFINE_METHODS = ('parabolic', 'gaussian', 'centroid')
+
+
+class WavelengthCalibration:
+    """像素 -> 波长(nm) 多项式，整条波长轴预先算好"""
+
+    def __init__(self, coefficients, lines=(), npixels=NPIXELS):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)  # 最高次在前，同 np.polyval
+        self.derivative = np.polyder(self.coefficients)
+        self.lines = [tuple(line) for line in lines]  # 拟合用的 (像素, 波长)
+        self.npixels = npixels
+        self.axis = np.polyval(self.coefficients, np.arange(npixels))
+
+    @classmethod
+    def fit(cls, pixels, wavelengths, degree=2, npixels=NPIXELS):
+        """由参考谱线的像素位置和已知波长拟合多项式"""
+        pixels = np.asarray(pixels, dtype=np.float64)
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        if len(pixels) <= degree:
+            raise ValueError(f"degree {degree} fit needs at least {degree + 1} reference lines")
+        coefficients = np.polyfit(pixels, wavelengths, degree)
+        return cls(coefficients, zip(pixels.tolist(), wavelengths.tolist()), npixels)
+
+    @property
+    def residuals(self):
+        """各参考谱线的拟合残差(nm)"""
+        if not self.lines:
+            return np.empty(0)
+        pixels, wavelengths = np.array(self.lines).T
+        return wavelengths - np.polyval(self.coefficients, pixels)
+
+    def to_wavelength(self, pixels):
+        """像素位置（可为小数）-> 波长"""
+        return np.polyval(self.coefficients, pixels)
+
+    def width_to_nm(self, pixels, widths):
+        """把 pixels 处以像素为单位的宽度换算为 nm"""
+        return np.abs(np.polyval(self.derivative, pixels)) * widths
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'coefficients': self.coefficients.tolist(), 'lines': self.lines,
+                       'npixels': self.npixels}, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['coefficients'], data.get('lines', ()), data.get('npixels', NPIXELS))
+
+
+def _refine(left, center, right, method):
+    """三点亚像素插值，返回相对中心像素的偏移"""
+    if method == 'gaussian':
+        # 对数域的抛物线插值，要求三点都为正
+        left, center, right = (np.log(np.maximum(v, 1e-9)) for v in (left, center, right))
+    denom = left - 2 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(denom < 0, 0.5 * (left - right) / denom, 0.0)
+    return np.clip(delta, -0.5, 0.5)
+
+
+def find_peaks(frames, threshold=0.2, method='parabolic', min_distance=3, centroid_radius=4, fwhm_window=32):
+    """在单帧 (p,) 或帧块 (n, p) 中一次找出所有峰
+
+    峰为高于 最小值 + threshold * (最大值 - 最小值) 的局部极大值，
+    同一帧中距离小于 min_distance 的峰只保留较高的一个。
+    位置用 method（parabolic / gaussian / centroid）做亚像素细化，平顶峰取半高中点，
+    半高全宽在峰两侧各 fwhm_window 像素内线性插值求得，找不到时为 NaN。
+    """
+    if method not in REFINE_METHODS:
+        raise ValueError(f"unknown refine method '{method}'")
+    y = np.atleast_2d(np.asarray(frames, dtype=np.float64))
+    n, p = y.shape
+    base = y.min(axis=1)
+    level = base + threshold * (y.max(axis=1) - base)
+
+    # 局部极大值：严格大于左邻、不小于右邻（平顶取最左侧）
+    mid = y[:, 1:-1]
+    is_peak = (mid > y[:, :-2]) & (mid >= y[:, 2:]) & (mid > level[:, None])
+    frame, index = np.nonzero(is_peak)
+    index += 1
+    height = y[frame, index]
+
+    # 去除同一帧中过近的次峰，每轮比较相邻峰，直到没有过近的峰
+    while len(index) > 1:
+        close = (frame[1:] == frame[:-1]) & (index[1:] - index[:-1] < min_distance)
+        if not close.any():
+            break
+        lower_right = height[1:] <= height[:-1]
+        drop = np.zeros(len(index), dtype=bool)
+        drop[1:] |= close & lower_right
+        drop[:-1] |= close & ~lower_right
+        keep = ~drop
+        frame, index, height = frame[keep], index[keep], height[keep]
+
+    half = base[frame] + (height - base[frame]) / 2
+    if method == 'centroid':
+        # 只用半高以上的部分做重心，避免窗口截断引起的偏差
+        offsets = np.arange(-centroid_radius, centroid_radius + 1)
+        cols = np.clip(index[:, None] + offsets, 0, p - 1)
+        weights = np.maximum(y[frame[:, None], cols] - half[:, None], 0.0)
+        total = weights.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = np.where(total > 0, (weights * (cols - index[:, None])).sum(axis=1) / total, 0.0)
+    else:
+        delta = _refine(y[frame, index - 1] - base[frame], height - base[frame],
+                        y[frame, index + 1] - base[frame], method)
+    position = index + delta
+
+    # 半高全宽：两侧第一个低于半高的像素与其内侧像素之间线性插值
+    steps = np.arange(1, fwhm_window + 1)
+    edges = []
+    for sign in (-1, 1):
+        cols = index[:, None] + sign * steps
+        valid = (cols >= 0) & (cols < p)
+        values = y[frame[:, None], np.clip(cols, 0, p - 1)]
+        below = (values < half[:, None]) & valid
+        found = below.any(axis=1)
+        k = below.argmax(axis=1)
+        outer = index + sign * (k + 1)
+        inner = outer - sign
+        y_out = y[frame, np.clip(outer, 0, p - 1)]
+        y_in = y[frame, inner]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edge = outer - sign * (half - y_out) / (y_in - y_out)
+        edges.append(np.where(found, edge, np.nan))
+    fwhm = edges[1] - edges[0]
+
+    # 平顶（如饱和）峰取两侧半高点的中点
+    plateau = (height == y[frame, index + 1]) & ~np.isnan(fwhm)
+    position = np.where(plateau, (edges[0] + edges[1]) / 2, position)
+
+    return Peaks(frame, index, position, height, fwhm)
+
+
+def main_peaks(peaks, nframes):
+    """每帧最高的峰在 peaks 中的下标，没有峰的帧为 -1"""
+    result = np.full(nframes, -1)
+    if len(peaks.frame):
+        # 按 (帧, 高度) 排序后每帧最后一个即最高峰
+        order = np.lexsort((peaks.height, peaks.frame))
+        last = np.r_[peaks.frame[order][1:] != peaks.frame[order][:-1], True]
+        result[peaks.frame[order][last]] = order[last]
+    return result
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Spectral calibration tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    fit = sub.add_parser('fit', help="fit a pixel -> wavelength polynomial from reference lines")
+    fit.add_argument('lines', nargs='+', metavar='PIXEL=NM', help="reference line, e.g. 64.2=546.07")
+    fit.add_argument('--degree', type=int, default=2)
+    fit.add_argument('-o', '--output', default='wavelength.json')
+    args = parser.parse_args(argv)
+
+    pairs = [tuple(float(v) for v in line.split('=', 1)) for line in args.lines]
+    pixels, wavelengths = zip(*pairs)
+    calibration = WavelengthCalibration.fit(pixels, wavelengths, args.degree)
+    calibration.save(args.output)
+    for (pixel, nm), residual in zip(calibration.lines, calibration.residuals):
+        print(f"pixel {pixel:8.3f}  {nm:9.3f} nm  residual {residual:+.4f} nm")
+    print(f"range {calibration.axis[0]:.2f} - {calibration.axis[-1]:.2f} nm, saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
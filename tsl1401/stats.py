@@ -0,0 +1,130 @@
+"""光谱统计：逐帧指标与滚动窗口统计（不依赖 Qt）"""
+from collections import namedtuple
+
+import numpy as np
+
+from .protocol import NPIXELS
+
+FrameStats = namedtuple('FrameStats', ['max', 'min', 'mean', 'std', 'peak_pos'])
+
+
+def frame_stats(frames):
+    """一次计算最大值/最小值/均值/标准差/峰值位置
+
+    frames 为单帧 (pixels,) 或帧块 (n, pixels)，整块只转换一次 dtype。
+    单帧时各字段为标量，帧块时为 (n,) 数组。
+    """
+    a = np.asarray(frames)
+    if a.ndim == 1:
+        return FrameStats(*(v[0] for v in frame_stats(a[None])))
+
+    rows = np.arange(len(a))
+    peak = a.argmax(axis=1)
+    trough = a.argmin(axis=1)
+    f = a.astype(np.float64)
+    n = a.shape[1]
+    mean = f.sum(axis=1) / n
+    var = np.einsum('ij,ij->i', f, f) / n - mean * mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    return FrameStats(a[rows, peak], a[rows, trough], mean, std, peak)
+
+
+class RollingStats:
+    """最近 window 帧的逐像素滚动统计
+
+    均值/方差用滑动窗口的 Welford 更新，每帧 O(pixels)，所有数组预先分配。
+    同时记录帧间噪声 rms(x[t] - x[t-1]) / sqrt(2) 的窗口平均。
+    """
+
+    def __init__(self, window=100, npixels=NPIXELS):
+        self.window = window
+        self.npixels = npixels
+        self.history = np.zeros((window, npixels))
+        self.noise_history = np.zeros(window)
+        self.mean = np.zeros(npixels)
+        self.m2 = np.zeros(npixels)
+        self.previous = np.zeros(npixels)
+        self.noise = 0.0  # 最新一帧的帧间噪声
+        self.noise_sum = 0.0
+        self.count = 0  # 窗口内帧数
+        self.seen = 0  # 总帧数
+        self.index = 0
+        self._x = np.zeros(npixels)
+        self._delta = np.zeros(npixels)
+        self._tmp = np.zeros(npixels)
+        self._step = np.zeros(npixels)
+
+    def reset(self):
+        self.history[:] = 0
+        self.noise_history[:] = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+        self.noise = self.noise_sum = 0.0
+        self.count = self.seen = self.index = 0
+
+    def update(self, frame):
+        """加入一帧，窗口已满时同时移出最旧的一帧"""
+        x, d, t, u = self._x, self._delta, self._tmp, self._step
+        np.copyto(x, frame)
+
+        if self.count < self.window:
+            self.count += 1
+            np.subtract(x, self.mean, out=d)
+            np.multiply(d, 1.0 / self.count, out=u)
+            self.mean += u
+            np.subtract(x, self.mean, out=t)
+        else:
+            # M2 += (x - old) * (x - new_mean + old - old_mean)
+            old = self.history[self.index]
+            np.subtract(x, self.mean, out=t)
+            t += old
+            np.subtract(x, old, out=d)
+            np.multiply(d, 1.0 / self.window, out=u)
+            self.mean += u
+            t -= self.mean
+        t *= d
+        self.m2 += t
+        self.history[self.index] = x
+
+        # 帧间噪声
+        if self.seen:
+            np.subtract(x, self.previous, out=d)
+            noise = float(np.sqrt(np.dot(d, d) / (2 * self.npixels)))
+            self.noise_sum += noise - self.noise_history[self.index]
+            self.noise_history[self.index] = noise
+            self.noise = noise
+        self.previous[:] = x
+        self.seen += 1
+        self.index = (self.index + 1) % self.window
+
+    def update_block(self, frames):
+        for frame in frames:
+            self.update(frame)
+
+    @property
+    def variance(self):
+        """逐像素方差（样本方差）"""
+        if self.count < 2:
+            return np.zeros(self.npixels)
+        return np.maximum(self.m2, 0.0) / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def mean_noise(self):
+        """窗口内帧间噪声的平均值"""
+        n = min(self.seen - 1, self.window)
+        return self.noise_sum / n if n > 0 else 0.0
+
+    def snr(self):
+        """逐像素信噪比：均值 / 标准差"""
+        std = self.std
+        return np.divide(self.mean, std, out=np.zeros(self.npixels), where=std > 0)
+
+    def peak_snr(self):
+        """平均光谱峰值处的信噪比"""
+        if not self.count:
+            return 0.0
+        return float(self.snr()[np.argmax(self.mean)])
@@ -0,0 +1,54 @@
+"""处理流水线各阶段耗时统计"""
+import time
+
+import numpy as np
+
+
+class StageTimer:
+    """记录每个阶段最近 window 次耗时
+
+    每个阶段只由一个线程写入，样本存放在预分配数组中，记录一次只是一次赋值和一次累加。
+    """
+
+    def __init__(self, stages, window=1000):
+        self.stages = list(stages)
+        self.window = window
+        self.samples = {stage: np.zeros(window) for stage in self.stages}
+        self.counts = dict.fromkeys(self.stages, 0)
+        self.totals = dict.fromkeys(self.stages, 0.0)  # 各阶段累计耗时(秒)，不受 window 限制
+
+    def add(self, stage, seconds):
+        count = self.counts[stage]
+        self.samples[stage][count % self.window] = seconds
+        self.counts[stage] = count + 1
+        self.totals[stage] += seconds
+
+    def since(self, stage, start):
+        """记录从 start（time.perf_counter()）到现在的耗时"""
+        self.add(stage, time.perf_counter() - start)
+
+    def reset(self):
+        for stage in self.stages:
+            self.counts[stage] = 0
+            self.totals[stage] = 0.0
+
+    def summary(self):
+        """{阶段: (次数, 平均, 中位数, p95, p99, 最大值)}，时间单位为毫秒"""
+        result = {}
+        for stage in self.stages:
+            count = self.counts[stage]
+            if not count:
+                continue
+            ms = self.samples[stage][:min(count, self.window)] * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            result[stage] = (count, float(ms.mean()), float(p50), float(p95), float(p99), float(ms.max()))
+        return result
+
+
+def format_report(*timers):
+    """把多个 StageTimer 的统计合并为一张文本表格"""
+    lines = [f"{'stage':<10}{'count':>9}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)"]
+    for timer in timers:
+        for stage, (count, mean, p50, p95, p99, peak) in timer.summary().items():
+            lines.append(f"{stage:<10}{count:>9}{mean:>9.3f}{p50:>9.3f}{p95:>9.3f}{p99:>9.3f}{peak:>9.3f}")
+    return '\n'.join(lines)
@@ -0,0 +1,279 @@
+"""触发采集：预触发环形缓冲区 + 按帧块向量化检测事件（不依赖 Qt）
+
+以全速采集，但只保存和显示事件前后的一段帧。最近 pre + post 帧始终保留在
+预分配的环形缓冲区中；每块新帧先算出每帧的触发信号（某个像素、像素区间之和或
+整帧最大值），再一次性判断触发条件：
+
+    level      信号不低于阈值
+    edge       信号由低于阈值变为不低于阈值（上升沿）
+    deviation  信号偏离之前 window 帧的滚动平均超过阈值
+
+触发后等到触发帧之后的 post 帧到齐，把 [触发帧 - pre, 触发帧 + post) 写成一个
+录制文件（.tslrec，可以直接回放），在 holdoff 帧（默认 post）之内不再触发。
+
+    python -m tsl1401 record --port /dev/ttyUSB0 --duration 3600 --trigger edge:600@60:70 --pre 200
+    python main.py --replay synthetic --trigger deviation:3000 --waterfall 1024
+    python -m tsl1401 trigger bench
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .protocol import NPIXELS
+from .recording import EXTENSION, save_frames
+from .replay import SyntheticSpectrum
+from .ringbuffer import FrameRing
+
+TRIGGER_LEVEL = 'level'
+TRIGGER_EDGE = 'edge'
+TRIGGER_DEVIATION = 'deviation'
+TRIGGER_MODES = (TRIGGER_LEVEL, TRIGGER_EDGE, TRIGGER_DEVIATION)
+
+DEFAULT_PRE = 100  # 触发帧之前保存的帧数
+DEFAULT_POST = 100  # 从触发帧起保存的帧数
+DEFAULT_WINDOW = 100  # deviation 的滚动基线帧数
+TRIGGER_DIR = 'triggers'
+
+# seq: 触发帧序号；index: 触发帧在 frames 中的下标；frames: (n, npixels) 原始帧；
+# first_seq: frames[0] 的序号；timestamps: 每帧收到的时间（time.time）；value: 触发帧的信号
+TriggerEvent = namedtuple('TriggerEvent', 'seq index frames first_seq timestamps value')
+
+
+def parse_trigger(spec, window=DEFAULT_WINDOW, holdoff=None):
+    """解析 "模式:阈值[@像素]"，如 "level:900"、"edge:600@64"、"deviation:2000@40:80"
+
+    像素为单个像素或左闭右开的像素区间（取和），省略时取整帧最大值。
+    """
+    condition, _, roi = spec.partition('@')
+    mode, _, threshold = condition.partition(':')
+    if mode not in TRIGGER_MODES or not threshold:
+        raise ValueError(f"trigger '{spec}' is not <{'|'.join(TRIGGER_MODES)}>:<threshold>[@pixels]")
+    if not roi:
+        pixels = None
+    elif ':' in roi:
+        start, stop = roi.split(':', 1)
+        pixels = (int(start) if start else 0, int(stop) if stop else NPIXELS)
+    else:
+        pixels = (int(roi), int(roi) + 1)
+    return Trigger(mode, float(threshold), pixels, window, holdoff)
+
+
+class Trigger:
+    """逐帧的触发信号与触发条件，跨帧块保留上一帧信号和滚动基线"""
+
+    def __init__(self, mode, threshold, pixels=None, window=DEFAULT_WINDOW, holdoff=None):
+        if mode not in TRIGGER_MODES:
+            raise ValueError(f"unknown trigger mode '{mode}'")
+        if pixels is not None and not 0 <= pixels[0] < pixels[1] <= NPIXELS:
+            raise ValueError(f"trigger pixels {pixels[0]}:{pixels[1]} are outside 0:{NPIXELS}")
+        self.mode = mode
+        self.threshold = threshold
+        self.pixels = pixels  # (start, stop) 像素区间，None 为整帧最大值
+        self.window = max(int(window), 1)
+        self.holdoff = holdoff  # 触发后不再触发的帧数，None 为等于 post
+        self.last = None  # 上一帧的信号
+        self.baseline = np.zeros(0)  # 最近 window 帧的信号
+
+    def describe(self):
+        where = 'max' if self.pixels is None else (
+            f"pixel {self.pixels[0]}" if self.pixels[1] - self.pixels[0] == 1 else f"sum {self.pixels[0]}:{self.pixels[1]}")
+        return f"{self.mode} {self.threshold:g} ({where})"
+
+    def signal(self, frames):
+        """每帧的触发信号 (n,)"""
+        if self.pixels is None:
+            return frames.max(axis=1).astype(np.float64)
+        start, stop = self.pixels
+        return frames[:, start:stop].sum(axis=1, dtype=np.float64)
+
+    def evaluate(self, frames):
+        """返回 (满足条件的帧的布尔数组, 信号)，整块一次计算"""
+        signal = self.signal(frames)
+        if self.mode == TRIGGER_LEVEL:
+            hits = signal >= self.threshold
+        elif self.mode == TRIGGER_EDGE:
+            previous = np.empty_like(signal)
+            previous[0] = signal[0] if self.last is None else self.last  # 第一帧之前没有信号，不算上升沿
+            previous[1:] = signal[:-1]
+            hits = (signal >= self.threshold) & (previous < self.threshold)
+        else:
+            hits = self.deviation(signal) >= self.threshold
+        self.last = signal[-1]
+        return hits, signal
+
+    def deviation(self, signal):
+        """每帧信号与之前 window 帧（不含本帧，不足时取已有的帧）平均值之差的绝对值"""
+        h = len(self.baseline)
+        values = np.concatenate((self.baseline, signal))
+        total = np.concatenate(([0.0], np.cumsum(values)))
+        stop = h + np.arange(len(signal))
+        start = np.maximum(stop - self.window, 0)
+        count = stop - start
+        baseline = (total[stop] - total[start]) / np.maximum(count, 1)
+        deviation = np.abs(signal - baseline)
+        deviation[count == 0] = 0.0  # 第一帧没有基线
+        self.baseline = values[-self.window:]
+        return deviation
+
+
+class TriggerCapture:
+    """预触发环形缓冲区：检测触发并在触发后的帧到齐时交出 TriggerEvent
+
+    缓冲区容量为 pre + post + block，大帧块按 block 帧分段处理，
+    事件需要的帧在交出前不会被覆盖。设置了 writer 时事件同时写入磁盘。
+    """
+
+    def __init__(self, trigger, pre=DEFAULT_PRE, post=DEFAULT_POST, npixels=NPIXELS, block=1024, writer=None):
+        self.trigger = trigger
+        self.pre = max(int(pre), 0)
+        self.post = max(int(post), 1)
+        self.holdoff = self.post if trigger.holdoff is None else max(int(trigger.holdoff), 1)
+        self.block = block
+        capacity = self.pre + self.post + block
+        self.ring = FrameRing(capacity, npixels)
+        self.times = np.zeros(capacity)  # 与 ring 同样按序号取模存放的接收时间
+        self.armed_at = 0  # 此序号之前的帧不再触发
+        self.waiting = []  # 已触发、等待后续帧的 (序号, 信号)
+        self.fired = 0  # 已触发次数
+        self.writer = writer
+
+    def process(self, frames, timestamp=None):
+        """加入一块原始帧，返回这次完成的 TriggerEvent 列表"""
+        if timestamp is None:
+            timestamp = time.time()
+        events = []
+        for i in range(0, len(frames), self.block):
+            events.extend(self.process_block(frames[i:i + self.block], timestamp))
+        return events
+
+    def process_block(self, frames, timestamp):
+        start, stop = self.ring.write(frames)
+        capacity = self.ring.capacity
+        index = np.arange(start, stop) % capacity
+        self.times[index] = timestamp
+
+        hits, signal = self.trigger.evaluate(frames)
+        candidates = np.flatnonzero(hits) + start
+        # 只有真正触发的帧需要逐个处理，每次触发后跳过 holdoff 帧
+        i = int(np.searchsorted(candidates, self.armed_at))
+        while i < len(candidates):
+            seq = int(candidates[i])
+            self.waiting.append((seq, float(signal[seq - start])))
+            self.fired += 1
+            self.armed_at = seq + self.holdoff
+            i = int(np.searchsorted(candidates, self.armed_at))
+
+        events = []
+        while self.waiting and self.waiting[0][0] + self.post <= stop:
+            seq, value = self.waiting.pop(0)
+            block, first = self.ring.read(max(seq - self.pre, 0), seq + self.post)
+            timestamps = self.times[np.arange(first, first + len(block)) % capacity]
+            event = TriggerEvent(seq, seq - first, block, first, timestamps, value)
+            if self.writer is not None:
+                self.writer.write(event)
+            events.append(event)
+        return events
+
+    def close(self):
+        """写完已交出的事件，返回保存的文件数"""
+        writer, self.writer = self.writer, None
+        if writer is None:
+            return 0
+        writer.close()
+        return len(writer.saved)
+
+
+class EventWriter(threading.Thread):
+    """后台写入触发事件，每个事件一个录制文件
+
+    采集线程只把事件放入有界队列，队列满时丢弃事件并计入 dropped。
+    """
+
+    def __init__(self, directory=TRIGGER_DIR, prefix='trigger', max_queue=64):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.queue = queue.Queue(max_queue)
+        self.saved = []  # 已写入的文件
+        self.dropped = 0
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, event):
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(event.timestamps[event.index]))
+        return os.path.join(self.directory, f"{self.prefix}_{stamp}_{event.seq}{EXTENSION}")
+
+    def write(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """写完队列中剩余的事件"""
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            path = self.path_for(event)
+            try:
+                save_frames(path, event.frames, event.first_seq, event.timestamps)
+                self.saved.append(path)
+            except OSError as e:
+                if self.error is None:
+                    print(f"Trigger save error: {e}")
+                self.error = e
+
+
+def bench(modes, blocks, frames, pre, post, interval):
+    """每种触发条件与帧块大小：处理速度（帧/秒）和检出的事件数
+
+    合成光谱每 interval 帧插入一次 3 帧长的闪光（全谱增加 300）。
+    """
+    source = SyntheticSpectrum(seed=0)
+    data = source.read(frames)
+    flashes = np.arange(interval // 2, frames - 3, interval)
+    for offset in range(3):
+        data[flashes + offset] = np.minimum(data[flashes + offset] + 300, 1023)
+    specs = {
+        TRIGGER_LEVEL: f"level:{int(data[:, 10].mean()) + 150}@10",
+        TRIGGER_EDGE: f"edge:{int(data[:, 40:80].sum(axis=1, dtype=np.int64).mean()) + 6000}@40:80",
+        TRIGGER_DEVIATION: "deviation:6000@0:128",
+    }
+    print(f"{frames} frames, {len(flashes)} flashes, window {pre}+{post} frames")
+    print(f"{'trigger':<32}{'block':>7}{'frames/s':>13}{'events':>8}")
+    for mode in modes:
+        for block in blocks:
+            capture = TriggerCapture(parse_trigger(specs[mode]), pre, post)
+            events = 0
+            t = time.perf_counter()
+            for i in range(0, frames, block):
+                events += len(capture.process(data[i:i + block], 0.0))
+            elapsed = time.perf_counter() - t
+            print(f"{capture.trigger.describe():<32}{block:>7}{frames / elapsed:>13.0f}{events:>8}")
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Benchmark triggered capture on synthetic flashes")
+    parser.add_argument('mode', choices=['bench'])
+    parser.add_argument('--triggers', nargs='+', default=list(TRIGGER_MODES), choices=TRIGGER_MODES)
+    parser.add_argument('--blocks', type=int, nargs='+', default=[1, 16, 256], help="frames per block")
+    parser.add_argument('--frames', type=int, default=200000, help="frames to process per run")
+    parser.add_argument('--pre', type=int, default=DEFAULT_PRE, help="frames kept before the trigger")
+    parser.add_argument('--post', type=int, default=DEFAULT_POST, help="frames kept from the trigger on")
+    parser.add_argument('--interval', type=int, default=2000, help="frames between synthetic flashes")
+    args = parser.parse_args(argv)
+    bench(args.triggers, args.blocks, args.frames, args.pre, args.post, args.interval)
+
+
+if __name__ == '__main__':
+    main()
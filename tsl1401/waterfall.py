@@ -0,0 +1,163 @@
+"""瀑布图（时间-光谱图）：帧历史的滚动 RGBA 图像（不依赖 Qt）
+
+帧历史由处理链以采集速率写入 uint16 环形缓冲区，界面每次刷新只把新增的行
+查表着色一次，写入预分配的图像缓冲区；图像对象只更新数据，不重新创建。
+
+测量绘制耗时随历史深度的变化（需要 matplotlib）：
+
+    python -m tsl1401 waterfall --depths 256 1024 4096 16384 --fps 1000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .protocol import NPIXELS
+from .replay import SyntheticSpectrum
+from .ringbuffer import FrameRing
+
+LEVELS = 1024  # 10 位 ADC，查找表按数值直接索引
+
+
+def make_lut(colormap, levels=LEVELS):
+    """(levels, 4) uint8 颜色查找表，colormap 把 [0, 1] 映射为 RGBA 浮点数（如 matplotlib 的颜色映射）"""
+    colours = np.asarray(colormap(np.linspace(0.0, 1.0, levels)), dtype=np.float64)
+    return np.round(colours * 255).astype(np.uint8)
+
+
+def to_history(frames):
+    """处理后的帧转换为 uint16，校正后的负值截为 0"""
+    if frames.dtype == np.uint16:
+        return frames
+    return np.clip(frames, 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+class Waterfall:
+    """最近 depth 帧的 RGBA 图像，最老的一行在前
+
+    缓冲区高 2*depth 行，每行同时写入 i 和 i+depth，
+    rgba[head:head+depth] 总是按时间排好序的连续视图，滚动时不复制整幅图像。
+    """
+
+    def __init__(self, depth, npixels, lut):
+        self.depth = depth
+        self.npixels = npixels
+        self.lut = lut
+        self.rgba = np.zeros((2 * depth, npixels, 4), dtype=np.uint8)
+        self.count = 0  # 已写入的总行数
+
+    def add(self, rows):
+        """加入 (n, npixels) uint16 帧，每个值只查表一次"""
+        rows = rows[-self.depth:]
+        n = len(rows)
+        if not n:
+            return
+        colours = self.lut[np.minimum(rows, len(self.lut) - 1)]
+        index = (self.count + np.arange(n)) % self.depth
+        self.rgba[index] = colours
+        self.rgba[index + self.depth] = colours
+        self.count += n
+
+    def view(self, rows=None):
+        """按时间排序的 (depth, npixels, 4) 视图
+
+        rows 为屏幕上的像素行数：历史比屏幕高时每隔 step 行取一行（仍是视图，不复制），
+        绘制耗时只与屏幕尺寸有关，与历史深度无关。取的行按绝对帧号对齐，滚动时图像不闪烁。
+        """
+        head = self.count % self.depth
+        window = self.rgba[head:head + self.depth]
+        step = -(-self.depth // rows) if rows else 1
+        if step <= 1:
+            return window
+        first = (self.depth - self.count) % step
+        return window[first:first + (self.depth // step) * step:step]
+
+
+class WaterfallFeed:
+    """跟踪一个处理链的帧历史，把上次以来的新帧加入瀑布图
+
+    历史缓冲区因像素掩码变化而重建时，瀑布图也随之重建。
+    """
+
+    def __init__(self, depth, lut):
+        self.depth = depth
+        self.lut = lut
+        self.ring = None
+        self.cursor = 0
+        self.waterfall = None
+
+    def update(self, ring):
+        """读取 ring 中的新帧，返回是否有新行；瀑布图重建后 self.waterfall 换成新对象"""
+        if ring is None:
+            return False
+        if ring is not self.ring:
+            self.ring = ring
+            self.cursor = max(0, ring.count - self.depth)
+            self.waterfall = Waterfall(self.depth, ring.frames.shape[1], self.lut)
+        rows, start = ring.read(self.cursor)
+        self.cursor = start + len(rows)
+        self.waterfall.add(rows)
+        return len(rows) > 0
+
+
+def bench(depths, fps, refresh, renders, width, height):
+    """每个历史深度：写入历史的耗时/帧与一次刷新（着色 + blit 图像）的耗时"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import colormaps
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    lut = make_lut(colormaps['viridis'])
+    batch = max(1, int(round(fps / refresh)))
+    source = SyntheticSpectrum(rate=fps, seed=0)
+    blocks = [source.read(batch) for _ in range(8)]
+    print(f"{width}x{height} px image, {batch} new frames per refresh ({fps:g} fps at {refresh:g} Hz)")
+    print(f"{'depth':>7}  {'ingest us/frame':>15}  {'render p50 ms':>13}  {'render p95 ms':>13}  {'max fps':>9}")
+    for depth in depths:
+        ring = FrameRing(depth, NPIXELS)
+        feed = WaterfallFeed(depth, lut)
+        figure = Figure(figsize=(width / 100, height / 100), dpi=100)
+        canvas = FigureCanvasAgg(figure)
+        ax = figure.add_subplot(111)
+        image = ax.imshow(np.zeros((depth, NPIXELS, 4), np.uint8), aspect='auto', interpolation='nearest',
+                          origin='lower', extent=(0, NPIXELS - 1, depth, 0), animated=True)
+        canvas.draw()
+        background = canvas.copy_from_bbox(figure.bbox)
+
+        ingest = np.empty(renders)
+        render = np.empty(renders)
+        for i in range(renders):
+            block = blocks[i % len(blocks)]
+            t = time.perf_counter()
+            ring.write(to_history(block))
+            ingest[i] = (time.perf_counter() - t) / batch
+            t = time.perf_counter()
+            feed.update(ring)
+            image.set_data(feed.waterfall.view(height))
+            canvas.restore_region(background)
+            ax.draw_artist(image)
+            canvas.blit(figure.bbox)
+            render[i] = time.perf_counter() - t
+        p50, p95 = np.percentile(render, [50, 95]) * 1000
+        # 一秒内刷新 refresh 次，剩余时间用于写入历史
+        budget = 1.0 - refresh * np.median(render)
+        max_fps = budget / np.median(ingest) if budget > 0 else 0.0
+        print(f"{depth:>7}  {np.median(ingest) * 1e6:>15.2f}  {p50:>13.2f}  {p95:>13.2f}  {max_fps:>9.0f}")
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Benchmark waterfall render cost versus history depth")
+    parser.add_argument('--depths', type=int, nargs='+', default=[256, 1024, 4096, 16384],
+                        help="history depths (rows) to measure")
+    parser.add_argument('--fps', type=float, default=1000.0, help="acquisition rate feeding the history")
+    parser.add_argument('--refresh', type=float, default=30.0, help="display refresh rate (Hz)")
+    parser.add_argument('--renders', type=int, default=200, help="refreshes to time per depth")
+    parser.add_argument('--size', type=int, nargs=2, default=[800, 300], metavar=('W', 'H'),
+                        help="image size on screen in pixels")
+    args = parser.parse_args(argv)
+    bench(args.depths, args.fps, args.refresh, args.renders, *args.size)
+
+
+if __name__ == '__main__':
+    main()